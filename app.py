@@ -7,16 +7,32 @@ sys.stdout.reconfigure(encoding='utf-8')
 from daily_logger import daily_logger, log_exceptions, log_function_call, log_info, log_warning, log_error, log_exception, log_debug
 
 # 导入其他模块
+import logger_config
 import back_configuration as bc
 from skin_analysis import Sample
-import gemma3n_models as gm
 import deepseek_R1_reasoning as dp
+from result_cache import image_content_hash
+from skin_result import SkinResult
+from chart_builder import radar_config
+from task_registry import TaskRegistry, session_key
+from stream_coalescer import create_stream_coalescer, stream_metrics
+from stream_merge import DONE, ERROR, STARTED, AsyncStreamMerger, StreamMerger
+from reasoning_cache import replay_pieces
+from client_registry import get_registry
+from pipeline_scheduler import StageBusyError
+from rate_limiter import RateLimitTimeout, SingleFlight, UpstreamThrottledError
+from resilience import CircuitOpenError, DeadlineExceeded, get_resilience
+from stage_timing import NULL_TIMELINE, TimelineRegistry, timing_metrics
+from tracing import bind_request, get_tracer
 
 # 交互模块
 import os
+import asyncio
+import threading
+import time
 import uuid
-import shutil
 from datetime import datetime
+from functools import lru_cache
 
 # 添加当前目录到Python路径
 sys.path.append('.')
@@ -24,69 +40,153 @@ sys.path.append('.')
 # 启动日志
 log_info("LittleSkin智能皮肤检测平台启动")
 
-# 全局任务管理
-import threading
-current_task_id = None
-task_lock = threading.Lock()
-
-def generate_task_id():
-    """生成唯一的任务ID"""
-    import time
-    return f"task_{int(time.time() * 1000)}"
-
-def is_task_current(task_id):
-    """检查任务是否仍然是当前任务"""
-    global current_task_id
-    with task_lock:
-        return current_task_id == task_id
-
-def set_current_task(task_id):
-    """设置当前任务ID"""
-    global current_task_id
-    with task_lock:
-        current_task_id = task_id
-        log_info(f"设置当前任务ID: {task_id}")
+# 配置热更新：config.yaml 修改后自动重新加载，请求处理中只读取内存快照
+def on_config_reload(success, error):
+    if success:
+        log_info("检测到config.yaml变化，配置已重新加载")
+    else:
+        log_error(f"config.yaml重新加载失败，继续使用旧配置: {error}")
+
+logger_config.start_config_watcher(on_config_reload)
+
+# 存储保留：后台线程定期按大小/数量/年龄上限清理本地目录，并清理OSS上传前缀下的过期对象
+def on_storage_sweep(result):
+    if result["error"]:
+        log_warning(f"OSS过期对象清理失败: {result['error']}")
+    if result["local_removed_files"] or result["oss_removed"]:
+        log_info(f"存储清理完成: 删除本地文件 {result['local_removed_files']} 个，"
+                 f"OSS对象 {result['oss_removed']} 个，当前占用 {result['footprint']}")
+
+storage_sweeper = bc.storage_sweeper_instantiation(on_storage_sweep)
+storage_sweeper.start()
+
+# 任务管理：按会话隔离，新提交只取消同一会话的旧任务
+task_registry = TaskRegistry()
+
+def set_current_task(session_id):
+    """为会话开启新任务，返回新任务的取消令牌"""
+    token = task_registry.start(session_id)
+    log_info(f"会话 {session_id} 设置当前任务ID: {token.task_id}")
+    return token
+
+def get_task_token(session_id, task_id):
+    """获取会话中指定任务的取消令牌"""
+    return task_registry.get(session_id, task_id)
+
+# 皮肤分析结果缓存（按图片内容哈希），重复图片直接返回结果
+skin_result_cache = bc.result_cache_instantiation()
+# DeepSeek回答缓存：相同的皮肤数据和问题直接回放缓存的推理和回答
+reasoning_response_cache = bc.reasoning_cache_instantiation()
+# 用户未输入问题时使用的默认问题
+DEFAULT_QUESTION = "请分析我的皮肤状况"
+
+# 流水线调度：分析 -> {推理, 图表} 各阶段独立的并发上限和排队上限
+pipeline = bc.pipeline_scheduler_instantiation()
+
+# 上传OSS前的图片预处理（自动旋转、缩放、重新编码）
+image_preprocessor = bc.image_preprocess_instantiation()
+# 图片默认直接从内存上传OSS，开启后才在本地 images/ 目录归档
+archive_local = bc.archive_local_instantiation()
+
+# 阿里云皮肤分析的令牌桶限速，以及相同图片并发请求的合并
+skin_rate_limiter = bc.rate_limiter_instantiation()
+analysis_flight = SingleFlight()
+
+# 外部调用的 Span 汇总为直方图；重试/熔断和各阶段排队的统计也一并从 /metrics 输出
+tracer = get_tracer()
+tracer.metrics.add_collector("littleskin_resilience", "service", lambda: get_resilience().stats())
+tracer.metrics.add_collector("littleskin_pipeline", "stage", pipeline.stats)
+tracer.metrics.add_collector("littleskin_logging", "logger", lambda: {"daily_logger": daily_logger.stats()})
+tracer.metrics.add_collector("littleskin_cache", "cache", lambda: {"skin_result": skin_result_cache.stats(),
+                                                                    "reasoning": reasoning_response_cache.stats()})
+
+# 每次提交的分阶段耗时，推理和图表都结束后汇总输出
+def on_timeline_complete(timeline):
+    log_info(f"任务 {timeline.task_id} 阶段耗时: {timeline.summary()}，累计统计: {timing_metrics.snapshot()}")
+
+timelines = TimelineRegistry(on_complete=on_timeline_complete)
+
+# 推测执行：分析进行中预热下游服务的连接，分析结束时推理和图表可以直接复用
+_warmup_lock = threading.Lock()
+_last_warmup = 0.0
+_warmup_tasks = set()
+
+def _should_warmup():
+    """同一间隔内只预热一次，keep-alive 连接在此期间仍然有效"""
+    global _last_warmup
+    interval = bc.speculative_instantiation()['warmup_interval_seconds']
+    with _warmup_lock:
+        now = time.monotonic()
+        if now - _last_warmup < interval:
+            return False
+        _last_warmup = now
+        return True
+
+def _warmup_targets():
+    """需要预热的服务：OSS 上传、DeepSeek 推理，以及 creative 模式下的 NIM"""
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    dp_api_key, dp_base_url, _ = bc.deepseek_R1_instantiation()
+    chart_builder = bc.chart_builder_instantiation()
+    nim_url = chart_builder.nim_options[1] if chart_builder.mode == "creative" else None
+    return (access_key_id, access_key_secret, bucket_name, oss_endpoint), (dp_api_key, dp_base_url), nim_url
+
+def start_warmup(timeline):
+    """在后台线程中预热连接，不阻塞当前请求"""
+    if not _should_warmup():
+        return
+    oss_options, deepseek_options, nim_url = _warmup_targets()
+    registry = get_registry()
+
+    def run():
+        with timeline.stage("warmup"):
+            for name, fn, args in (("OSS", registry.warm_oss, oss_options),
+                                   ("DeepSeek", registry.warm_openai, deepseek_options),
+                                   ("NIM", registry.warm_http, (nim_url,))):
+                if name == "NIM" and not nim_url:
+                    continue
+                try:
+                    fn(*args)
+                except Exception as e:
+                    log_debug(f"{name} 连接预热失败: {str(e)}")
+
+    threading.Thread(target=run, name="connection-warmup", daemon=True).start()
+
+def async_start_warmup(timeline):
+    """start_warmup 的异步版本：在事件循环中并发预热，不等待结果"""
+    if not _should_warmup():
+        return
+    oss_options, deepseek_options, nim_url = _warmup_targets()
+    registry = get_registry()
+
+    async def warm(name, awaitable):
+        try:
+            await awaitable
+        except Exception as e:
+            log_debug(f"{name} 连接预热失败: {str(e)}")
+
+    async def run():
+        started = time.perf_counter()
+        jobs = [warm("OSS", asyncio.to_thread(registry.warm_oss, *oss_options)),
+                warm("DeepSeek", registry.warm_openai_async(*deepseek_options))]
+        if nim_url:
+            jobs.append(warm("NIM", registry.warm_http_async(nim_url)))
+        await asyncio.gather(*jobs)
+        timeline.record("warmup", started, time.perf_counter())
+
+    # 保留任务引用，避免任务在完成前被垃圾回收
+    task = asyncio.get_running_loop().create_task(run())
+    _warmup_tasks.add(task)
+    task.add_done_callback(_warmup_tasks.discard)
+
+# 推理提示词在启动时加载并编译一次，请求处理中不再读取 system_prompt.txt
+prompt_templates = dp.get_prompt_templates()
+log_info(f"推理提示词已加载，模板版本: {prompt_templates.version}，系统提示词 {len(prompt_templates.system_prompt)} 字")
 
 # 模拟数据生成函数
 def generate_mock_skin_data():
-    """生成模拟皮肤分析数据，用于阿里云API失败时的降级处理"""
-    mock_data = {
-        "data": {
-            "elements": [
-                {
-                    "type": "acne",
-                    "confidence": 0.85,
-                    "location": {"x": 120, "y": 80, "width": 30, "height": 25},
-                    "severity": "轻度"
-                },
-                {
-                    "type": "wrinkle",
-                    "confidence": 0.72,
-                    "location": {"x": 200, "y": 150, "width": 40, "height": 15},
-                    "severity": "中度"
-                },
-                {
-                    "type": "spot",
-                    "confidence": 0.68,
-                    "location": {"x": 180, "y": 120, "width": 20, "height": 20},
-                    "severity": "轻度"
-                }
-            ],
-            "overall_score": 75,
-            "skin_type": "混合性",
-            "main_concerns": ["痘痘", "细纹", "色斑"],
-            "recommendations": [
-                "建议使用温和的洁面产品",
-                "注意防晒，使用SPF30+的防晒霜",
-                "保持充足睡眠，减少熬夜",
-                "多喝水，保持皮肤水分"
-            ]
-        },
-        "status": "mock_data",
-        "message": "使用模拟数据进行演示分析"
-    }
+    """生成模拟皮肤分析数据，用于阿里云API失败时的降级处理（与真实结果使用同一结构）"""
     log_info("生成模拟皮肤分析数据")
-    return mock_data
+    return SkinResult.mock()
 
 def css_to_js(example_images, static_urls, intro_content, benefit_content):
   
@@ -145,14 +245,27 @@ def stream_print(response):
 
 # —— 上传与滑动图像区块 ——
 @log_exceptions
-def save_uploaded_image(image_path):  # 将图片保存到本地
-    """保存上传的图片到images文件夹，返回新的文件路径"""
+def prepare_uploaded_image(image_path):
+    """读取上传的图片并在内存中完成预处理，返回 (图片字节, 扩展名)，不写本地文件"""
     log_debug(f"接收到图片路径: {image_path}")
 
     if not image_path or not os.path.exists(image_path):
         log_error(f"图片路径不存在: {image_path}")
         return None
 
+    # 解码一次，自动旋转、缩放并重新编码；无法处理时使用原图字节
+    image_data, extension, preprocess_stats = image_preprocessor.prepare(image_path)
+    log_info(f"图片预处理完成，预处理统计: {preprocess_stats}")
+
+    # 开启本地归档时才在 images/ 中保留一份副本
+    if archive_local:
+        save_uploaded_image(image_data, extension)
+
+    return image_data, extension
+
+@log_exceptions
+def save_uploaded_image(image_data, extension):  # 将图片保存到本地
+    """保存预处理后的图片到images文件夹，返回新的文件路径"""
     # 确保images目录存在
     images_dir = "images"
     if not os.path.exists(images_dir):
@@ -162,22 +275,17 @@ def save_uploaded_image(image_path):  # 将图片保存到本地
     # 生成唯一的文件名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     unique_id = str(uuid.uuid4())[:8]
-    file_extension = os.path.splitext(image_path)[1] or '.png'
-    new_filename = f"uploaded_{timestamp}_{unique_id}{file_extension}"
-    new_filepath = os.path.join(images_dir, new_filename)
+    new_filepath = os.path.join(images_dir, f"uploaded_{timestamp}_{unique_id}{extension}")
 
-    # 复制文件到新位置
-    shutil.copy2(image_path, new_filepath)
+    with tracer.span("archive.save", bytes=len(image_data)), open(new_filepath, 'wb') as f:
+        f.write(image_data)
     log_info(f"图片已保存到: {new_filepath}")
 
     return new_filepath
 
-# 导入时间模块用于重试延迟
-import time
-
 # 皮肤数据分析函数 - 独立于可视化，支持重试
 @log_exceptions
-def get_skin_analysis_data(image):
+def get_skin_analysis_data(image, timeline=NULL_TIMELINE):
     """获取皮肤分析数据，独立于可视化过程，支持重试机制"""
     log_info("开始皮肤数据分析")
 
@@ -186,89 +294,187 @@ def get_skin_analysis_data(image):
         return None, "? 未检测到图片"
 
     try:
-        # 第一步是保存图片
-        saved_path = save_uploaded_image(image)
-        if not saved_path:
-            log_error("图片保存失败")
-            return None, "? 图片保存失败"
-
-        log_info(f"开始调用阿里云皮肤分析API，图片路径: {saved_path}")
-
-        # 重试机制：最多重试3次
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                log_info(f"第{attempt + 1}次尝试调用阿里云API")
-
-                # 获取皮肤分析数据
-                skin_analysis, oss_img_url = bc.skin_analysis_instantiation(saved_path)
-                log_debug(f"OSS图片URL: {oss_img_url}")
-
-                skins_data = Sample.main(sys.argv[1:], skin_analysis, oss_img_url)
-
-                if skins_data:
-                    log_info(f"皮肤数据分析成功完成（第{attempt + 1}次尝试）")
-                    return skins_data, "? 皮肤数据分析完成"
-                else:
-                    log_warning(f"第{attempt + 1}次尝试：皮肤数据分析返回空结果")
-                    if attempt < max_retries - 1:
-                        log_info(f"等待2秒后进行第{attempt + 2}次重试...")
-                        import time
-                        time.sleep(2)
-                        continue
-                    else:
-                        log_warning("阿里云API失败，使用模拟数据继续流程")
-                        # 使用模拟数据继续流程，确保用户体验
-                        mock_data = generate_mock_skin_data()
-                        return mock_data, "?? 阿里云服务暂时不可用，使用模拟数据进行演示分析"
-
-            except Exception as retry_error:
-                log_error(f"第{attempt + 1}次尝试失败: {str(retry_error)}")
-                if attempt < max_retries - 1:
-                    log_info(f"等待3秒后进行第{attempt + 2}次重试...")
-                    import time
-                    time.sleep(3)
-                    continue
-                else:
-                    log_exception(f"所有重试均失败，最终异常: {str(retry_error)}")
-                    log_warning("阿里云API异常，使用模拟数据继续流程")
-                    # 使用模拟数据继续流程
-                    mock_data = generate_mock_skin_data()
-                    return mock_data, f"?? 阿里云服务异常，使用模拟数据进行演示分析（已重试{max_retries}次）"
+        # 先按图片内容哈希查询缓存，命中则跳过保存、OSS上传和阿里云调用
+        image_hash = image_content_hash(image)
+        # 缓存中保存的是紧凑字典（旧缓存可能是JSON字符串），统一还原为结果模型
+        cached_data = SkinResult.from_value(skin_result_cache.get(image_hash))
+        if cached_data is not None:
+            log_info(f"皮肤分析结果命中缓存: {image_hash[:16]}，缓存统计: {skin_result_cache.stats()}")
+            return cached_data, "? 皮肤数据分析完成（命中缓存）"
+
+        # 同一张图片的并发请求只调用一次阿里云，其余请求等待并共享结果
+        return analysis_flight.do(image_hash, _analyze_image, image, image_hash, timeline)
 
     except Exception as e:
         log_exception(f"皮肤数据分析异常: {str(e)}")
         return None, f"? 皮肤数据分析失败: {str(e)}"
 
-# 数据可视化函数 - 独立处理，不影响主流程
-@log_exceptions
-def generate_visualization_chart(skins_data):
-    """生成可视化图表，独立处理，失败不影响主流程"""
-    log_info("开始生成数据可视化图表")
+def _analyze_image(image, image_hash, timeline=NULL_TIMELINE):
+    """预处理图片、上传OSS并调用阿里云皮肤分析（未命中缓存时）"""
+    # 第一步是在内存中预处理图片
+    with timeline.stage("preprocess"):
+        prepared = prepare_uploaded_image(image)
+    if not prepared:
+        log_error("图片读取失败")
+        return None, "? 图片读取失败"
+    image_data, extension = prepared
 
-    if not skins_data:
-        log_warning("皮肤数据为空，无法生成可视化图表")
-        return """
-        <div style="text-align: center; padding: 20px; background: #fff3cd; border: 1px solid #ffeaa7; border-radius: 8px;">
-            <h3 style="color: #856404; margin-bottom: 15px;">?? 可视化图表生成失败</h3>
-            <p style="color: #856404;">皮肤数据为空，无法生成可视化图表</p>
-        </div>
-        """
+    resilience = get_resilience()
+    # 本次请求的总时间预算，预算用完不再重试
+    deadline = resilience.deadline()
 
     try:
-        log_info("调用Gemma3n模型生成可视化图表")
-        api_key, invoke_url, model_name, max_tokens = bc.skin_data_visualization()
-        chart_result = gm.gemma3n_skin_quickchartURL(skins_data, api_key, invoke_url, model_name, max_tokens)
-        # 处理返回值，可能是URL字符串或(URL, config)元组
-        if isinstance(chart_result, tuple):
-            chart_url, config = chart_result
-        else:
-            chart_url = chart_result
+        # 图片字节直接从内存上传，且只上传一次（OSS 调用自带重试），后面的重试只针对皮肤分析接口
+        with timeline.stage("upload"):
+            skin_analysis, oss_img_url = bc.skin_analysis_instantiation_from_bytes(image_data, extension)
+        log_debug(f"OSS图片URL: {oss_img_url}")
+
+        def detect_skin():
+            # 先按公测版的速率排队取令牌，再在分析阶段的槽位内调用，遵守并发限制
+            waited = skin_rate_limiter.acquire()
+            if waited > 1:
+                log_info(f"等待阿里云调用令牌 {waited:.2f} 秒")
+            return pipeline.run("analysis", Sample.main, sys.argv[1:], skin_analysis, oss_img_url)
+
+        log_info(f"开始调用阿里云皮肤分析API，图片URL: {oss_img_url}")
+        try:
+            # 网络错误、5xx 按指数退避重试；限流时暂停发放令牌后重试；参数、图片错误不重试
+            with timeline.stage("analysis"):
+                skins_data = resilience.call("imageprocess", detect_skin, deadline=deadline,
+                                             on_throttled=skin_rate_limiter.on_throttled)
+        finally:
+            # 分析结束后（无论成败）OSS上的图片不再需要，按保留策略删除或改标签
+            release_uploaded_image(oss_img_url)
+    except Exception as error:
+        return _analysis_failure(error)
+
+    if skins_data:
+        log_info("皮肤数据分析成功完成")
+        # 只缓存真实结果，模拟数据不入缓存
+        skin_result_cache.set(image_hash, skins_data.to_dict())
+        return skins_data, "? 皮肤数据分析完成"
+
+    log_warning("阿里云API返回空结果，使用模拟数据继续流程")
+    # 使用模拟数据继续流程，确保用户体验
+    mock_data = generate_mock_skin_data()
+    return mock_data, "?? 阿里云服务暂时不可用，使用模拟数据进行演示分析"
+
+def release_uploaded_image(oss_img_url):
+    """按保留策略处理OSS上的图片，失败只记录日志（后台清理线程和生命周期规则会兜底）"""
+    try:
+        action = bc.release_uploaded_image(oss_img_url)
+        log_debug(f"OSS图片已处理({action}): {oss_img_url}")
+    except Exception as e:
+        log_warning(f"OSS图片处理失败，等待后台清理: {str(e)}")
+
+def _analysis_failure(error):
+    """根据皮肤分析的失败原因返回界面结果（同步和异步流水线共用）"""
+    if isinstance(error, (StageBusyError, RateLimitTimeout, UpstreamThrottledError)):
+        # 本地排队已满或被上游持续限流，不是服务故障，不用模拟数据冒充分析结果
+        log_warning(f"{error}，阶段状态: {pipeline.stage('analysis').stats()}，限速器状态: {skin_rate_limiter.stats()}")
+        return None, "?? 当前分析请求较多，请稍后重试"
+
+    if isinstance(error, CircuitOpenError):
+        # 已知服务不可用，直接走模拟数据，不再等待超时
+        log_warning(f"{error}，直接使用模拟数据")
+        return generate_mock_skin_data(), "?? 阿里云服务暂时不可用，使用模拟数据进行演示分析"
+
+    if isinstance(error, DeadlineExceeded):
+        log_warning(f"皮肤分析超出时间预算: {error}")
+    else:
+        log_exception(f"所有重试均失败，最终异常: {str(error)}")
+    log_warning("阿里云API异常，使用模拟数据继续流程")
+    # 使用模拟数据继续流程
+    mock_data = generate_mock_skin_data()
+    return mock_data, "?? 阿里云服务异常，使用模拟数据进行演示分析"
+
+async def async_get_skin_analysis_data(image, timeline=NULL_TIMELINE):
+    """get_skin_analysis_data 的异步版本：等待阿里云和OSS期间让出事件循环，重试间隔不阻塞线程"""
+    log_info("开始皮肤数据分析（异步）")
+
+    if image is None:
+        log_warning("未检测到图片")
+        return None, "? 未检测到图片"
 
-        log_info(f"可视化图表生成成功，URL: {chart_url}")
+    try:
+        # 哈希计算是本地磁盘IO，放到线程中执行
+        image_hash = await asyncio.to_thread(image_content_hash, image)
+        # 缓存中保存的是紧凑字典（旧缓存可能是JSON字符串），统一还原为结果模型
+        cached_data = SkinResult.from_value(skin_result_cache.get(image_hash))
+        if cached_data is not None:
+            log_info(f"皮肤分析结果命中缓存: {image_hash[:16]}，缓存统计: {skin_result_cache.stats()}")
+            return cached_data, "? 皮肤数据分析完成（命中缓存）"
+
+        return await analysis_flight.do_async(image_hash, _async_analyze_image, image, image_hash, timeline)
+
+    except Exception as e:
+        log_exception(f"皮肤数据分析异常: {str(e)}")
+        return None, f"? 皮肤数据分析失败: {str(e)}"
+
+async def _async_analyze_image(image, image_hash, timeline=NULL_TIMELINE):
+    """_analyze_image 的异步版本"""
+    with timeline.stage("preprocess"):
+        prepared = await asyncio.to_thread(prepare_uploaded_image, image)
+    if not prepared:
+        log_error("图片读取失败")
+        return None, "? 图片读取失败"
+    image_data, extension = prepared
+
+    resilience = get_resilience()
+    deadline = resilience.deadline()
+
+    try:
+        with timeline.stage("upload"):
+            skin_analysis, oss_img_url = await bc.skin_analysis_instantiation_from_bytes_async(image_data, extension)
+        log_debug(f"OSS图片URL: {oss_img_url}")
+
+        async def detect_skin():
+            waited = await skin_rate_limiter.acquire_async()
+            if waited > 1:
+                log_info(f"等待阿里云调用令牌 {waited:.2f} 秒")
+            async with pipeline.stage("analysis").async_slot():
+                return await Sample.main_async(sys.argv[1:], skin_analysis, oss_img_url)
+
+        log_info(f"开始调用阿里云皮肤分析API，图片URL: {oss_img_url}")
+        try:
+            with timeline.stage("analysis"):
+                skins_data = await resilience.call_async("imageprocess", detect_skin, deadline=deadline,
+                                                         on_throttled=skin_rate_limiter.on_throttled)
+        finally:
+            await asyncio.to_thread(release_uploaded_image, oss_img_url)
+    except Exception as error:
+        return _analysis_failure(error)
+
+    if skins_data:
+        log_info("皮肤数据分析成功完成")
+        skin_result_cache.set(image_hash, skins_data.to_dict())
+        return skins_data, "? 皮肤数据分析完成"
+
+    log_warning("阿里云API返回空结果，使用模拟数据继续流程")
+    mock_data = generate_mock_skin_data()
+    return mock_data, "?? 阿里云服务暂时不可用，使用模拟数据进行演示分析"
+
+# 可视化区域的HTML片段 - 同步和异步流水线共用
+def visualization_notice_html(title, message, border_color="#ffc107", text_color="#856404"):
+    """可视化区域的提示卡片（数据为空、任务中断、服务繁忙等）"""
+    return f"""
+        <div style="
+            background: #ffffff;
+            border: 1px solid {border_color};
+            border-radius: 12px;
+            padding: 25px;
+            margin: 10px 0;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+            text-align: center;
+        ">
+            <h3 style="color: {text_color}; font-weight: 600;">{title}</h3>
+            <p style="color: {text_color};">{message}</p>
+        </div>
+        """
 
-        # 创建成功的可视化HTML
-        html_content = f"""
+def chart_success_html(chart_url):
+    """图表生成成功的HTML"""
+    return f"""
         <div style="
             background: #ffffff;
             border: 1px solid #e0e0e0;
@@ -287,18 +493,15 @@ def generate_visualization_chart(skins_data):
                     border-radius: 8px;
                     box-shadow: 0 4px 8px rgba(0,0,0,0.1);
                     cursor: pointer;"
-             onclick="window.open(this.src, '_blank')"
+             onclick="var w = window.open('', '_blank'); if (w) {{ w.document.write('<img src=&quot;' + this.src + '&quot; style=&quot;max-width:100%&quot;>'); w.document.close(); }}"
              onerror="this.parentElement.innerHTML='<div style=\\'color: #dc3545; padding: 20px; background: #ffffff;\\'>? 图表加载失败，可能是网络问题</div>'">
             <p style="margin-top: 15px; color: #666; font-size: 14px;">点击图片可查看大图</p>
         </div>
         """
-        return html_content
-
-    except Exception as e:
-        log_error(f"可视化生成失败: {str(e)}", exc_info=True)
 
-        # 返回错误提示，但不阻断主流程
-        return f"""
+def chart_failed_html(error):
+    """图表生成失败的HTML，不阻断主流程"""
+    return f"""
         <div style="
             background: #ffffff;
             border: 1px solid #f5c6cb;
@@ -313,575 +516,629 @@ def generate_visualization_chart(skins_data):
             <p style="color: #6c757d; font-size: 14px;">但这不影响皮肤分析结果的生成</p>
             <details style="margin-top: 15px; text-align: left;">
                 <summary style="color: #6c757d; cursor: pointer;">查看详细错误信息</summary>
-                <pre style="background: #f8f9fa; padding: 10px; margin-top: 5px; border-radius: 4px; font-size: 12px; color: #495057;">{str(e)}</pre>
+                <pre style="background: #f8f9fa; padding: 10px; margin-top: 5px; border-radius: 4px; font-size: 12px; color: #495057;">{str(error)}</pre>
             </details>
         </div>
         """
 
-# 导入markdown渲染库
-import markdown
+def empty_visualization_html():
+    return visualization_notice_html("?? 可视化图表生成失败", "皮肤数据为空，无法生成可视化图表", border_color="#ffeaa7")
+
+def interrupted_visualization_html():
+    return visualization_notice_html("?? 可视化已被中断", "新的图片分析已开始，请查看最新结果")
+
+def busy_visualization_html():
+    return visualization_notice_html("?? 可视化服务繁忙", "当前图表生成请求较多，请稍后重试，这不影响分析结果")
+
+def failed_visualization_html():
+    return visualization_notice_html("? 可视化图表更新失败", "后台更新过程中出现错误，但不影响分析结果",
+                                     border_color="#f5c6cb", text_color="#721c24")
+
+# 推测执行时提交后立即显示的图表骨架：空白坐标轴的雷达图，分析完成后由真正的图表替换
+@lru_cache(maxsize=1)
+def chart_skeleton_html():
+    try:
+        skeleton_url = bc.chart_renderer_instantiation().chart_url(radar_config(SkinResult(), [""] * 6, [0] * 6))
+    except Exception as e:
+        log_warning(f"图表骨架渲染失败: {str(e)}")
+        return visualization_notice_html("?? 正在分析皮肤数据...", "分析完成后自动生成可视化图表",
+                                         border_color="#bbdefb", text_color="#1976d2")
+    return f"""
+        <div style="
+            background: #ffffff;
+            border: 1px solid #bbdefb;
+            border-radius: 12px;
+            padding: 25px;
+            margin: 10px 0;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+            text-align: center;
+        ">
+            <h3 style="color: #1976d2; margin-bottom: 20px; font-weight: 600;">?? 正在分析皮肤数据...</h3>
+            <img src="{skeleton_url}"
+             alt="图表生成中"
+             style="max-width: 100%; height: auto; opacity: 0.35;">
+            <p style="margin-top: 15px; color: #1976d2; font-size: 14px;">分析完成后自动生成可视化图表</p>
+        </div>
+        """
+
+def _chart_url(chart_result):
+    # 处理返回值，可能是URL字符串或(URL, config)元组
+    if isinstance(chart_result, tuple):
+        chart_url, config = chart_result
+        return chart_url
+    return chart_result
+
+# 数据可视化函数 - 独立处理，不影响主流程
+@log_exceptions
+def generate_visualization_chart(skins_data):
+    """生成可视化图表，独立处理，失败不影响主流程"""
+    log_info("开始生成数据可视化图表")
+
+    if not skins_data:
+        log_warning("皮肤数据为空，无法生成可视化图表")
+        return empty_visualization_html()
+
+    try:
+        chart_builder = bc.chart_builder_instantiation()
+        log_info(f"生成可视化图表，模式: {chart_builder.mode}")
+        chart_url = _chart_url(chart_builder.chart(skins_data))
+
+        log_info(f"可视化图表生成成功，URL: {chart_url[:100]}")
+        return chart_success_html(chart_url)
+
+    except Exception as e:
+        log_error(f"可视化生成失败: {str(e)}", exc_info=True)
+        return chart_failed_html(e)
+
+async def async_generate_visualization_chart(skins_data):
+    """generate_visualization_chart 的异步版本，使用 httpx.AsyncClient 调用NIM"""
+    log_info("开始生成数据可视化图表（异步）")
+
+    if not skins_data:
+        log_warning("皮肤数据为空，无法生成可视化图表")
+        return empty_visualization_html()
+
+    try:
+        chart_url = _chart_url(await bc.chart_builder_instantiation().chart_async(skins_data))
+
+        log_info(f"可视化图表生成成功，URL: {chart_url[:100]}")
+        return chart_success_html(chart_url)
+
+    except Exception as e:
+        log_error(f"可视化生成失败: {str(e)}", exc_info=True)
+        return chart_failed_html(e)
+
+# 导入markdown渲染模块（复用渲染引擎，支持增量渲染）
+from stream_render import IncrementalMarkdownRenderer, render_markdown
 
 # HTML内容格式化函数 - 支持Markdown渲染
-def format_reasoning_html(content):
-    """将推理内容格式化为HTML，支持Markdown渲染"""
+# 面板样式和自动滚动脚本已移到 assets/stream_panes.css 和 assets/stream_panes_js.js，
+# 在页面加载时注入一次，这里每次只输出面板内容本身
+def format_reasoning_html(content, rendered_content=None):
+    """将推理内容格式化为HTML，支持Markdown渲染；rendered_content为增量渲染器已渲染好的HTML"""
     if not content:
         return """
-        <div id="reasoning-container" style="
-            background: #f8f9fa;
-            border: 1px solid #dee2e6;
-            border-radius: 8px;
-            padding: 20px;
-            min-height: 400px;
-            max-height: 600px;
-            overflow-y: scroll;
-            font-family: 'Consolas', 'Monaco', monospace;
-            font-size: 14px;
-            line-height: 1.6;
-            position: relative;
-        ">
-        <div style="color: #6c757d; text-align: center; padding: 50px;">
+        <div id="reasoning-container">
+        <div class="stream-pane-placeholder">
             ?? 等待开始推理分析...
         </div>
         </div>
-        <script>
-        setTimeout(function() {
-            var container = document.getElementById('reasoning-container');
-            if (container) {
-                container.scrollTop = container.scrollHeight;
-            }
-        }, 100);
-        </script>
         """
 
-    # 使用markdown渲染内容
-    try:
-        md = markdown.Markdown(extensions=['fenced_code', 'tables'])
-        rendered_content = md.convert(content)
-    except:
-        # 如果markdown渲染失败，使用HTML转义
-        import html
-        rendered_content = html.escape(content).replace('\n', '<br>')
+    if rendered_content is None:
+        rendered_content = render_markdown(content)
 
     return f"""
-    <style>
-    #reasoning-container {{
-        scrollbar-width: thin;
-        scrollbar-color: #6c757d #f8f9fa;
-    }}
-    #reasoning-container::-webkit-scrollbar {{
-        width: 8px;
-    }}
-    #reasoning-container::-webkit-scrollbar-track {{
-        background: #f8f9fa;
-    }}
-    #reasoning-container::-webkit-scrollbar-thumb {{
-        background: #6c757d;
-        border-radius: 4px;
-    }}
-    #reasoning-container::-webkit-scrollbar-thumb:hover {{
-        background: #495057;
-    }}
-    #reasoning-container h1, #reasoning-container h2, #reasoning-container h3 {{
-        color: #343a40;
-        margin-top: 1.5em;
-        margin-bottom: 0.5em;
-    }}
-    #reasoning-container code {{
-        background: #e9ecef;
-        padding: 2px 4px;
-        border-radius: 3px;
-        font-family: 'Consolas', 'Monaco', monospace;
-    }}
-    #reasoning-container pre {{
-        background: #e9ecef;
-        padding: 10px;
-        border-radius: 5px;
-        overflow-x: auto;
-    }}
-    #reasoning-container blockquote {{
-        border-left: 4px solid #007bff;
-        padding-left: 15px;
-        margin: 15px 0;
-        color: #6c757d;
-    }}
-    </style>
-    <div id="reasoning-container" style="
-        background: #f8f9fa;
-        border: 1px solid #dee2e6;
-        border-radius: 8px;
-        padding: 20px;
-        min-height: 400px;
-        max-height: 600px;
-        overflow-y: scroll;
-        font-family: 'Consolas', 'Monaco', monospace;
-        font-size: 14px;
-        line-height: 1.6;
-        position: relative;
-    ">
-    <div style="color: #495057;">
+    <div id="reasoning-container">
+    <div>
         {rendered_content}
     </div>
     </div>
-    <script>
-    (function() {{
-        var container = document.getElementById('reasoning-container');
-        if (!container) return;
-
-        // 检查是否已经设置过滚动监听器
-        if (!container.hasAttribute('data-scroll-handler-set')) {{
-            var userInteracting = false;
-            var lastUserInteraction = 0;
-            var lastScrollTop = 0;
-            var autoScrollEnabled = true;
-
-            // 监听多种用户交互事件
-            var interactionEvents = ['mousedown', 'wheel', 'touchstart', 'keydown'];
-            interactionEvents.forEach(function(eventType) {{
-                container.addEventListener(eventType, function(e) {{
-                    userInteracting = true;
-                    lastUserInteraction = Date.now();
-
-                    // 如果是滚轮事件，立即禁用自动滚动
-                    if (eventType === 'wheel') {{
-                        autoScrollEnabled = false;
-                        container.setAttribute('data-auto-scroll', 'false');
-
-                        // 3秒后重新启用自动滚动（如果用户在底部）
-                        setTimeout(function() {{
-                            var currentScrollTop = container.scrollTop;
-                            var maxScrollTop = container.scrollHeight - container.clientHeight;
-                            if (currentScrollTop >= maxScrollTop - 20) {{
-                                autoScrollEnabled = true;
-                                container.setAttribute('data-auto-scroll', 'true');
-                            }}
-                        }}, 3000);
-                    }}
-                }}, {{ passive: true }});
-            }});
-
-            // 监听滚动事件
-            container.addEventListener('scroll', function(e) {{
-                var currentScrollTop = container.scrollTop;
-                var maxScrollTop = container.scrollHeight - container.clientHeight;
-                var now = Date.now();
-
-                // 如果最近有用户交互，认为是用户主动滚动
-                if (now - lastUserInteraction < 1000) {{
-                    userInteracting = true;
-                    autoScrollEnabled = false;
-                    container.setAttribute('data-auto-scroll', 'false');
-                }}
-
-                // 检查是否滚动到底部
-                if (currentScrollTop >= maxScrollTop - 20) {{
-                    // 延迟恢复自动滚动，避免误判
-                    setTimeout(function() {{
-                        if (container.scrollTop >= container.scrollHeight - container.clientHeight - 20) {{
-                            autoScrollEnabled = true;
-                            container.setAttribute('data-auto-scroll', 'true');
-                            userInteracting = false;
-                        }}
-                    }}, 500);
-                }}
-
-                lastScrollTop = currentScrollTop;
-            }}, {{ passive: true }});
-
-            // 监听鼠标离开事件
-            container.addEventListener('mouseleave', function() {{
-                setTimeout(function() {{
-                    userInteracting = false;
-                }}, 1000);
-            }});
-
-            // 标记已设置监听器
-            container.setAttribute('data-scroll-handler-set', 'true');
-            container.setAttribute('data-auto-scroll', 'true');
-        }}
-
-        // 智能滚动逻辑 - 更保守的自动滚动
-        setTimeout(function() {{
-            var autoScroll = container.getAttribute('data-auto-scroll') === 'true';
-            var now = Date.now();
-            var timeSinceLastInteraction = now - (parseInt(container.getAttribute('data-last-interaction')) || 0);
-
-            // 只有在明确允许自动滚动且用户最近没有交互时才滚动
-            if (autoScroll && timeSinceLastInteraction > 500) {{
-                var currentScrollTop = container.scrollTop;
-                var maxScrollTop = container.scrollHeight - container.clientHeight;
-
-                // 只有当前不在底部时才滚动
-                if (currentScrollTop < maxScrollTop - 10) {{
-                    container.scrollTop = container.scrollHeight;
-                }}
-            }}
-        }}, 100);
-
-        // 记录当前时间戳
-        container.setAttribute('data-last-interaction', Date.now().toString());
-    }})();
-    </script>
     """
 
-def format_real_output_html(content):
-    """将真实输出内容格式化为HTML，支持Markdown渲染"""
+def format_real_output_html(content, rendered_content=None):
+    """将真实输出内容格式化为HTML，支持Markdown渲染；rendered_content为增量渲染器已渲染好的HTML"""
     if not content:
         return """
-        <div id="real-output-container" style="
-            background: #ffffff;
-            border: 1px solid #dee2e6;
-            border-radius: 8px;
-            padding: 20px;
-            min-height: 400px;
-            max-height: 600px;
-            overflow-y: scroll;
-            font-family: 'Microsoft YaHei', 'PingFang SC', sans-serif;
-            font-size: 15px;
-            line-height: 1.8;
-            position: relative;
-        ">
-        <div style="color: #6c757d; text-align: center; padding: 50px;">
+        <div id="real-output-container">
+        <div class="stream-pane-placeholder">
             ? 等待推理完成后显示结果...
         </div>
         </div>
-        <script>
-        setTimeout(function() {
-            var container = document.getElementById('real-output-container');
-            if (container) {
-                container.scrollTop = container.scrollHeight;
-            }
-        }, 100);
-        </script>
         """
 
-    # 使用markdown渲染内容
-    try:
-        md = markdown.Markdown(extensions=['fenced_code', 'tables'])
-        rendered_content = md.convert(content)
-    except:
-        # 如果markdown渲染失败，使用HTML转义
-        import html
-        rendered_content = html.escape(content).replace('\n', '<br>')
+    if rendered_content is None:
+        rendered_content = render_markdown(content)
 
     return f"""
-    <style>
-    #real-output-container {{
-        scrollbar-width: thin;
-        scrollbar-color: #007bff #ffffff;
-    }}
-    #real-output-container::-webkit-scrollbar {{
-        width: 8px;
-    }}
-    #real-output-container::-webkit-scrollbar-track {{
-        background: #ffffff;
-    }}
-    #real-output-container::-webkit-scrollbar-thumb {{
-        background: #007bff;
-        border-radius: 4px;
-    }}
-    #real-output-container::-webkit-scrollbar-thumb:hover {{
-        background: #0056b3;
-    }}
-    #real-output-container h1, #real-output-container h2, #real-output-container h3 {{
-        color: #007bff;
-        margin-top: 1.5em;
-        margin-bottom: 0.5em;
-        border-bottom: 2px solid #e9ecef;
-        padding-bottom: 0.3em;
-    }}
-    #real-output-container h4, #real-output-container h5, #real-output-container h6 {{
-        color: #495057;
-        margin-top: 1.2em;
-        margin-bottom: 0.5em;
-    }}
-    #real-output-container code {{
-        background: #f8f9fa;
-        color: #e83e8c;
-        padding: 2px 6px;
-        border-radius: 3px;
-        font-family: 'Consolas', 'Monaco', monospace;
-    }}
-    #real-output-container pre {{
-        background: #f8f9fa;
-        border: 1px solid #e9ecef;
-        padding: 15px;
-        border-radius: 5px;
-        overflow-x: auto;
-        margin: 15px 0;
-    }}
-    #real-output-container blockquote {{
-        border-left: 4px solid #28a745;
-        background: #f8fff9;
-        padding: 10px 15px;
-        margin: 15px 0;
-        color: #155724;
-    }}
-    #real-output-container table {{
-        border-collapse: collapse;
-        width: 100%;
-        margin: 15px 0;
-    }}
-    #real-output-container th, #real-output-container td {{
-        border: 1px solid #dee2e6;
-        padding: 8px 12px;
-        text-align: left;
-    }}
-    #real-output-container th {{
-        background: #f8f9fa;
-        font-weight: bold;
-    }}
-    #real-output-container ul, #real-output-container ol {{
-        padding-left: 20px;
-        margin: 10px 0;
-    }}
-    #real-output-container li {{
-        margin: 5px 0;
-    }}
-    </style>
-    <div id="real-output-container" style="
-        background: #ffffff;
-        border: 1px solid #dee2e6;
-        border-radius: 8px;
-        padding: 20px;
-        min-height: 400px;
-        max-height: 600px;
-        overflow-y: scroll;
-        font-family: 'Microsoft YaHei', 'PingFang SC', sans-serif;
-        font-size: 15px;
-        line-height: 1.8;
-        position: relative;
-    ">
-    <div style="color: #212529;">
+    <div id="real-output-container">
+    <div>
         {rendered_content}
     </div>
     </div>
-    <script>
-    (function() {{
-        var container = document.getElementById('real-output-container');
-        if (!container) return;
-
-        // 检查是否已经设置过滚动监听器
-        if (!container.hasAttribute('data-scroll-handler-set')) {{
-            var userInteracting = false;
-            var lastUserInteraction = 0;
-            var lastScrollTop = 0;
-            var autoScrollEnabled = true;
-
-            // 监听多种用户交互事件
-            var interactionEvents = ['mousedown', 'wheel', 'touchstart', 'keydown'];
-            interactionEvents.forEach(function(eventType) {{
-                container.addEventListener(eventType, function(e) {{
-                    userInteracting = true;
-                    lastUserInteraction = Date.now();
-
-                    // 如果是滚轮事件，立即禁用自动滚动
-                    if (eventType === 'wheel') {{
-                        autoScrollEnabled = false;
-                        container.setAttribute('data-auto-scroll', 'false');
-
-                        // 3秒后重新启用自动滚动（如果用户在底部）
-                        setTimeout(function() {{
-                            var currentScrollTop = container.scrollTop;
-                            var maxScrollTop = container.scrollHeight - container.clientHeight;
-                            if (currentScrollTop >= maxScrollTop - 20) {{
-                                autoScrollEnabled = true;
-                                container.setAttribute('data-auto-scroll', 'true');
-                            }}
-                        }}, 3000);
-                    }}
-                }}, {{ passive: true }});
-            }});
-
-            // 监听滚动事件
-            container.addEventListener('scroll', function(e) {{
-                var currentScrollTop = container.scrollTop;
-                var maxScrollTop = container.scrollHeight - container.clientHeight;
-                var now = Date.now();
-
-                // 如果最近有用户交互，认为是用户主动滚动
-                if (now - lastUserInteraction < 1000) {{
-                    userInteracting = true;
-                    autoScrollEnabled = false;
-                    container.setAttribute('data-auto-scroll', 'false');
-                }}
-
-                // 检查是否滚动到底部
-                if (currentScrollTop >= maxScrollTop - 20) {{
-                    // 延迟恢复自动滚动，避免误判
-                    setTimeout(function() {{
-                        if (container.scrollTop >= container.scrollHeight - container.clientHeight - 20) {{
-                            autoScrollEnabled = true;
-                            container.setAttribute('data-auto-scroll', 'true');
-                            userInteracting = false;
-                        }}
-                    }}, 500);
-                }}
-
-                lastScrollTop = currentScrollTop;
-            }}, {{ passive: true }});
-
-            // 监听鼠标离开事件
-            container.addEventListener('mouseleave', function() {{
-                setTimeout(function() {{
-                    userInteracting = false;
-                }}, 1000);
-            }});
-
-            // 标记已设置监听器
-            container.setAttribute('data-scroll-handler-set', 'true');
-            container.setAttribute('data-auto-scroll', 'true');
-        }}
-
-        // 智能滚动逻辑 - 更保守的自动滚动
-        setTimeout(function() {{
-            var autoScroll = container.getAttribute('data-auto-scroll') === 'true';
-            var now = Date.now();
-            var timeSinceLastInteraction = now - (parseInt(container.getAttribute('data-last-interaction')) || 0);
-
-            // 只有在明确允许自动滚动且用户最近没有交互时才滚动
-            if (autoScroll && timeSinceLastInteraction > 500) {{
-                var currentScrollTop = container.scrollTop;
-                var maxScrollTop = container.scrollHeight - container.clientHeight;
-
-                // 只有当前不在底部时才滚动
-                if (currentScrollTop < maxScrollTop - 10) {{
-                    container.scrollTop = container.scrollHeight;
-                }}
-            }}
-        }}, 100);
-
-        // 记录当前时间戳
-        container.setAttribute('data-last-interaction', Date.now().toString());
-    }})();
-    </script>
     """
 
+# 流式推理的面板状态 - 同步和异步流水线共用
+class ReasoningStreamView:
+    """累积DeepSeek流式分片，增量渲染并按帧率合并为推理/输出两个面板的HTML"""
+
+    def __init__(self, session_id, task_id):
+        self.session_id = session_id
+        self.task_id = task_id
+        self.reasoning_content = ""
+        self.real_content = ""
+        # 双模型模式下快速模型的简要结论，显示在真实输出面板的顶部
+        self.summary_content = ""
+        # 增量渲染器：已结束的块缓存为HTML，每个分片只重新渲染末尾未结束的块
+        self.reasoning_renderer = IncrementalMarkdownRenderer()
+        self.real_renderer = IncrementalMarkdownRenderer()
+        self.summary_renderer = IncrementalMarkdownRenderer()
+        # 合并器：分片先累积，按帧率/字数阈值才推送一次，避免每个token都推送两份完整HTML
+        self.coalescer = create_stream_coalescer(bc.stream_coalescing_instantiation())
+
+    def initial(self):
+        """初始状态"""
+        initial_reasoning = format_reasoning_html("?? 正在连接DeepSeek模型...")
+        initial_real = format_real_output_html("? 等待推理完成...")
+        return self.coalescer.flushed(initial_reasoning, initial_real)
+
+    def feed(self, chunk):
+        """处理一个响应分片，需要推送时返回两个面板的HTML，否则返回None"""
+        delta = chunk.choices[0].delta
+        return self.feed_text(getattr(delta, 'reasoning_content', None), getattr(delta, 'content', None))
+
+    def feed_text(self, reasoning=None, content=None):
+        """处理一段推理过程 / 真实输出文本（模型分片或缓存回放）"""
+        # 处理推理过程 - 累积后按帧率推送
+        if reasoning:
+            self.reasoning_content += reasoning
+            self.reasoning_renderer.feed(reasoning)
+            self.coalescer.add(reasoning)
+
+        # 处理真实输出 - 累积后按帧率推送
+        if content:
+            self.real_content += content
+            self.real_renderer.feed(content)
+            self.coalescer.add(content)
+
+        if self.coalescer.should_flush():
+            return self.coalescer.flushed(*self._render_panes())
+        return None
+
+    def feed_summary(self, chunk):
+        """处理快速模型的一个分片，需要推送时返回两个面板的HTML，否则返回None"""
+        if not chunk.choices:
+            return None
+        return self.feed_summary_text(getattr(chunk.choices[0].delta, 'content', None))
+
+    def feed_summary_text(self, content):
+        if not content:
+            return None
+        first = not self.summary_content
+        self.summary_content += content
+        self.summary_renderer.feed(content)
+        self.coalescer.add(content)
+
+        # 简要结论的第一段内容立即推送，这是用户最先看到的结果
+        if first or self.coalescer.should_flush():
+            return self.coalescer.flushed(*self._render_panes())
+        return None
+
+    def replay(self, field, text):
+        """回放缓存回答的一个分片，field 为 summary / reasoning / content"""
+        if field == "summary":
+            return self.feed_summary_text(text)
+        if field == "reasoning":
+            return self.feed_text(reasoning=text)
+        return self.feed_text(content=text)
+
+    def cache_entry(self):
+        """完整的回答，写入回答缓存"""
+        return {"summary": self.summary_content, "reasoning": self.reasoning_content, "content": self.real_content}
+
+    def _real_output_html(self, placeholder):
+        """真实输出面板：简要结论在上，R1 的详细分析在下"""
+        if not self.summary_content:
+            if self.real_content:
+                return format_real_output_html(self.real_content, self.real_renderer.html())
+            return format_real_output_html(placeholder)
+        rendered = f'<div class="fast-summary"><p class="fast-summary-title">简要结论</p>{self.summary_renderer.html()}</div>'
+        if self.real_content:
+            rendered += f'<p class="fast-summary-title">详细分析</p>{self.real_renderer.html()}'
+        else:
+            rendered += f'<p class="stream-pane-placeholder">{placeholder}</p>'
+        return format_real_output_html(self.summary_content + self.real_content, rendered)
+
+    def _render_panes(self):
+        if self.reasoning_content:
+            reasoning_html = format_reasoning_html(self.reasoning_content, self.reasoning_renderer.html())
+        elif self.real_content:
+            reasoning_html = format_reasoning_html("? 推理完成")
+        else:
+            reasoning_html = format_reasoning_html("?? 正在连接DeepSeek模型...")
+        real_html = self._real_output_html("? 推理中，请稍候...")
+        return reasoning_html, real_html
+
+    def interrupted(self):
+        """任务被同一会话的新任务取消"""
+        log_info(f"推理任务 {self.task_id} 已被中断，停止流式输出")
+        interrupted_reasoning = format_reasoning_html("?? 推理已被新的图片分析中断")
+        interrupted_real = format_real_output_html("?? 分析已中断，请查看新的分析结果")
+        panes = self.coalescer.flushed(interrupted_reasoning, interrupted_real)
+        stream_metrics.record(self.session_id, self.coalescer.stats())
+        return panes
+
+    def final(self):
+        """最终状态：无论合并器中是否还有未推送的内容，都完整推送一次"""
+        # 简化日志记录
+        if self.reasoning_content:
+            log_info("推理过程输出完成")
+        if self.real_content:
+            log_info("真实输出完成")
+
+        log_info("DeepSeek推理分析完成")
+
+        final_reasoning = format_reasoning_html(self.reasoning_content, self.reasoning_renderer.html()) if self.reasoning_content else format_reasoning_html("?? 未收到推理内容")
+        final_real = self._real_output_html("?? 未收到分析结果")
+        panes = self.coalescer.flushed(final_reasoning, final_real)
+
+        session_totals = stream_metrics.record(self.session_id, self.coalescer.stats())
+        log_info(f"流式推送统计: 本次 {self.coalescer.stats()}，会话累计 {session_totals}")
+        return panes
+
+def stream_error_panes(message, real_message):
+    return format_reasoning_html(message), format_real_output_html(real_message)
+
 # 流式推理函数 - 真正的流式输出
-def stream_deepseek_analysis(skin_data, user_prompt):
+def stream_deepseek_analysis(skin_data, user_prompt, task_id, request: gr.Request = None):
     """流式输出DeepSeek推理过程和真实输出"""
     log_info("开始DeepSeek推理分析")
 
-    # 获取当前任务ID
-    global current_task_id
-    with task_lock:
-        task_id = current_task_id
+    # 获取本会话当前任务的取消令牌
+    session_id = session_key(request)
+    cancel_token = get_task_token(session_id, task_id)
+    timeline = timelines.get(task_id)
+    bind_request(task_id)
 
+    # 缓存命中时直接回放，不调用DeepSeek，也不占用推理阶段的槽位
+    cache_key, cached = _lookup_reasoning_cache(skin_data, user_prompt)
+    if cached is not None:
+        with timeline.stage("reasoning"):
+            yield from _replay_cached_answer(cached, session_id, task_id, cancel_token)
+        return
+
+    # 推理阶段的槽位在整个流式输出期间保持占用，阶段已满时直接提示繁忙
+    try:
+        with pipeline.stage("reasoning").slot() as wait:
+            if wait > 1:
+                log_info(f"推理任务 {task_id} 排队 {wait:.2f} 秒")
+            with timeline.stage("reasoning"):
+                yield from _stream_deepseek_chunks(skin_data, user_prompt, task_id, session_id, cancel_token,
+                                                   timeline, cache_key)
+    except StageBusyError as busy_error:
+        log_warning(f"{busy_error}，当前阶段状态: {pipeline.stage('reasoning').stats()}")
+        # 推理阶段不会执行，时间线不再等待它
+        timeline.skip("reasoning")
+        yield stream_error_panes("?? 当前推理请求较多，请稍后重试", "?? 推理服务繁忙，请稍后重试")
+
+def _stream_event_panes(view, source, event, value, timeline, request_started, first_tokens, failed_sources):
+    """处理合并流中的一个事件，返回 (需要推送的面板或None, 是否结束推理)"""
+    if event == STARTED:
+        if source == "reasoning":
+            log_info("DeepSeek API调用成功，开始流式输出")
+        return None, False
+    if event == DONE:
+        return None, False
+    if event == ERROR:
+        failed_sources.add(source)
+        if source == "summary":
+            # 简要结论只用于提前展示，失败不影响 R1 的深度分析
+            log_warning(f"快速模型调用失败: {str(value)}")
+            return None, False
+        if source in first_tokens:
+            log_error(f"推理过程出错: {str(value)}")
+            return stream_error_panes(f"? 推理过程出错: {str(value)}", "? 真实输出获取失败"), True
+        log_error(f"DeepSeek API调用失败: {str(value)}")
+        return stream_error_panes(f"? API调用失败: {str(value)}", "? 无法连接到DeepSeek服务"), True
+
+    if source not in first_tokens:
+        first_tokens.add(source)
+        timeline.record(f"{source}_first_token", request_started, time.perf_counter())
+    try:
+        return (view.feed_summary(value) if source == "summary" else view.feed(value)), False
+    except Exception as chunk_error:
+        log_error(f"处理响应块时出错: {str(chunk_error)}")
+        return None, False
+
+def _stream_sources(skin_data, user_question, analysis_fn, summary_fn):
+    """R1 的深度推理，以及配置了快速模型时的简要结论；每一路在合并器中各自建立连接"""
+    dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
+    sources = {"reasoning": lambda: analysis_fn(skin_data, dp_api_key, dp_base_url, dp_model_name, user_question)}
+    fast_options = bc.deepseek_fast_instantiation()
+    if fast_options is not None:
+        fast_api_key, fast_base_url, fast_model_name, fast_max_tokens = fast_options
+        log_info(f"双模型模式：{fast_model_name} 输出简要结论，{dp_model_name} 同时进行深度推理")
+        sources["summary"] = lambda: summary_fn(skin_data, fast_api_key, fast_base_url, fast_model_name,
+                                                user_question, fast_max_tokens)
+    return sources
+
+def _reasoning_cache_key(skin_data, user_question):
+    """回答缓存的键：压缩后的皮肤数据、规范化的问题、提示词版本和模型名称"""
+    template_version = dp.get_prompt_templates().version
+    reasoning_response_cache.check_version(template_version)
+    _, _, dp_model_name = bc.deepseek_R1_instantiation()
+    fast_options = bc.deepseek_fast_instantiation()
+    model_names = (dp_model_name, fast_options[2] if fast_options else "")
+    return reasoning_response_cache.key(skin_data, user_question, template_version, model_names,
+                                        bc.prompt_compactor_instantiation())
+
+def _lookup_reasoning_cache(skin_data, user_prompt):
+    """返回 (缓存键, 缓存的回答或None)；没有皮肤数据或无法计算键时不使用缓存"""
+    if not skin_data:
+        return None, None
+    try:
+        cache_key = _reasoning_cache_key(skin_data, user_prompt or DEFAULT_QUESTION)
+    except Exception as e:
+        log_warning(f"计算DeepSeek回答缓存键失败，不使用缓存: {str(e)}")
+        return None, None
+    return cache_key, reasoning_response_cache.get(cache_key)
+
+def _replay_cached_answer(cached, session_id, task_id, cancel_token):
+    """相同的皮肤数据和问题已有完整回答时，按流式效果回放缓存"""
+    log_info(f"DeepSeek回答缓存命中，回放缓存结果，缓存统计: {reasoning_response_cache.stats()}")
+    view = ReasoningStreamView(session_id, task_id)
+    yield view.initial()
+    for field, text in replay_pieces(cached, reasoning_response_cache.replay_chunk_chars):
+        if cancel_token.cancelled:
+            yield view.interrupted()
+            return
+        panes = view.replay(field, text)
+        if panes is not None:
+            yield panes
+        delay = reasoning_response_cache.replay_delay(text)
+        if delay:
+            time.sleep(delay)
+    yield view.final()
+
+async def _async_replay_cached_answer(cached, session_id, task_id, cancel_token):
+    """_replay_cached_answer 的异步版本，回放间隔不占用工作线程"""
+    log_info(f"DeepSeek回答缓存命中，回放缓存结果，缓存统计: {reasoning_response_cache.stats()}")
+    view = ReasoningStreamView(session_id, task_id)
+    yield view.initial()
+    for field, text in replay_pieces(cached, reasoning_response_cache.replay_chunk_chars):
+        if cancel_token.cancelled:
+            yield view.interrupted()
+            return
+        panes = view.replay(field, text)
+        if panes is not None:
+            yield panes
+        delay = reasoning_response_cache.replay_delay(text)
+        if delay:
+            await asyncio.sleep(delay)
+    yield view.final()
+
+def _stream_deepseek_chunks(skin_data, user_prompt, task_id, session_id, cancel_token, timeline=NULL_TIMELINE,
+                            cache_key=None):
+    """调用DeepSeek并把流式分片渲染为两个面板的HTML"""
     try:
         # 如果没有皮肤数据，直接返回错误
         if not skin_data:
             log_error("皮肤数据为空，无法进行推理分析")
-            error_reasoning = format_reasoning_html("? 皮肤数据为空，无法进行推理分析")
-            error_real = format_real_output_html("? 无法进行分析")
-            yield error_reasoning, error_real
+            yield stream_error_panes("? 皮肤数据为空，无法进行推理分析", "? 无法进行分析")
             return
 
-        log_info("实例化DeepSeek模型")
-        # 实例化deepseek模型
-        dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
-
-        user_question = user_prompt or "请分析我的皮肤状况"
+        user_question = user_prompt or DEFAULT_QUESTION
         log_info(f"用户问题: {user_question}")
 
+        view = ReasoningStreamView(session_id, task_id)
+
         log_info("调用DeepSeek API")
+        merger = StreamMerger(_stream_sources(skin_data, user_question, dp.dp_analysis_result, dp.dp_fast_summary))
+        yield view.initial()
 
+        request_started = time.perf_counter()
+        first_tokens = set()
+        failed_sources = set()
         try:
-            response = dp.dp_analysis_result(skin_data, dp_api_key, dp_base_url, dp_model_name, user_question)
-            log_info("DeepSeek API调用成功，开始流式输出")
-        except Exception as api_error:
-            log_exception(f"DeepSeek API调用失败: {str(api_error)}")
-            error_reasoning = format_reasoning_html(f"? API调用失败: {str(api_error)}")
-            error_real = format_real_output_html("? 无法连接到DeepSeek服务")
-            yield error_reasoning, error_real
-            return
-
-        reasoning_content = ""
-        real_content = ""
+            for source, event, value in merger:
+                # 检查任务是否已被同一会话的新任务取消
+                if cancel_token.cancelled:
+                    yield view.interrupted()
+                    return
 
-        # 初始状态
-        initial_reasoning = format_reasoning_html("?? 正在连接DeepSeek模型...")
-        initial_real = format_real_output_html("? 等待推理完成...")
-        yield initial_reasoning, initial_real
-
-        log_info("开始流式接收DeepSeek响应")
-
-        for chunk in response:
-            try:
-                # 检查任务是否仍然是当前任务
-                if not is_task_current(task_id):
-                    log_info(f"推理任务 {task_id} 已被中断，停止流式输出")
-                    interrupted_reasoning = format_reasoning_html("?? 推理已被新的图片分析中断")
-                    interrupted_real = format_real_output_html("?? 分析已中断，请查看新的分析结果")
-                    yield interrupted_reasoning, interrupted_real
+                panes, finished = _stream_event_panes(view, source, event, value, timeline, request_started,
+                                                      first_tokens, failed_sources)
+                if panes is not None:
+                    yield panes
+                if finished:
                     return
+        finally:
+            # 中断、出错或页面关闭时不再继续读取任何一路流
+            merger.close()
 
-                delta = chunk.choices[0].delta
+        yield view.final()
+        # 只缓存完整结束的回答：中断、出错时在上面已经返回，简要结论失败时回答不完整
+        if not failed_sources:
+            reasoning_response_cache.set(cache_key, view.cache_entry())
 
-                # 处理推理过程 - 实时流式输出
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                    reasoning_content += delta.reasoning_content
-                    reasoning_html = format_reasoning_html(reasoning_content)
-                    real_html = format_real_output_html(real_content) if real_content else format_real_output_html("? 推理中，请稍候...")
-                    yield reasoning_html, real_html
+    except Exception as e:
+        log_exception(f"推理过程出错: {str(e)}")
+        yield stream_error_panes(f"? 推理过程出错: {str(e)}", "? 真实输出获取失败")
 
-                # 处理真实输出 - 实时流式输出
-                if hasattr(delta, 'content') and delta.content:
-                    real_content += delta.content
-                    reasoning_html = format_reasoning_html(reasoning_content) if reasoning_content else format_reasoning_html("? 推理完成")
-                    real_html = format_real_output_html(real_content)
-                    yield reasoning_html, real_html
+# 异步流式推理函数 - 使用 AsyncOpenAI，等待模型输出期间不占用工作线程
+async def async_stream_deepseek_analysis(skin_data, user_prompt, task_id, request: gr.Request = None):
+    """stream_deepseek_analysis 的异步版本"""
+    log_info("开始DeepSeek推理分析（异步）")
 
-            except Exception as chunk_error:
-                log_error(f"处理响应块时出错: {str(chunk_error)}")
-                continue
+    session_id = session_key(request)
+    cancel_token = get_task_token(session_id, task_id)
+    timeline = timelines.get(task_id)
+    bind_request(task_id)
 
-        # 简化日志记录
-        if reasoning_content:
-            log_info("推理过程输出完成")
-        if real_content:
-            log_info("真实输出完成")
+    cache_key, cached = _lookup_reasoning_cache(skin_data, user_prompt)
+    if cached is not None:
+        with timeline.stage("reasoning"):
+            async for panes in _async_replay_cached_answer(cached, session_id, task_id, cancel_token):
+                yield panes
+        return
 
-        log_info("DeepSeek推理分析完成")
+    try:
+        async with pipeline.stage("reasoning").async_slot() as wait:
+            if wait > 1:
+                log_info(f"推理任务 {task_id} 排队 {wait:.2f} 秒")
+            with timeline.stage("reasoning"):
+                async for panes in _async_stream_deepseek_chunks(skin_data, user_prompt, task_id, session_id,
+                                                                 cancel_token, timeline, cache_key):
+                    yield panes
+    except StageBusyError as busy_error:
+        log_warning(f"{busy_error}，当前阶段状态: {pipeline.stage('reasoning').stats()}")
+        # 推理阶段不会执行，时间线不再等待它
+        timeline.skip("reasoning")
+        yield stream_error_panes("?? 当前推理请求较多，请稍后重试", "?? 推理服务繁忙，请稍后重试")
+
+async def _async_stream_deepseek_chunks(skin_data, user_prompt, task_id, session_id, cancel_token,
+                                        timeline=NULL_TIMELINE, cache_key=None):
+    """_stream_deepseek_chunks 的异步版本"""
+    try:
+        if not skin_data:
+            log_error("皮肤数据为空，无法进行推理分析")
+            yield stream_error_panes("? 皮肤数据为空，无法进行推理分析", "? 无法进行分析")
+            return
 
-        # 确保最终状态
-        final_reasoning = format_reasoning_html(reasoning_content if reasoning_content else "?? 未收到推理内容")
-        final_real = format_real_output_html(real_content if real_content else "?? 未收到分析结果")
-        yield final_reasoning, final_real
+        user_question = user_prompt or DEFAULT_QUESTION
+        log_info(f"用户问题: {user_question}")
 
-    except Exception as e:
-        log_exception(f"推理过程出错: {str(e)}")
-        error_reasoning = format_reasoning_html(f"? 推理过程出错: {str(e)}")
-        error_real = format_real_output_html("? 真实输出获取失败")
-        yield error_reasoning, error_real
+        view = ReasoningStreamView(session_id, task_id)
+
+        merger = AsyncStreamMerger(_stream_sources(skin_data, user_question, dp.dp_analysis_result_async,
+                                                   dp.dp_fast_summary_async))
+        yield view.initial()
 
+        request_started = time.perf_counter()
+        first_tokens = set()
+        failed_sources = set()
+        try:
+            async for source, event, value in merger:
+                if cancel_token.cancelled:
+                    yield view.interrupted()
+                    return
+
+                panes, finished = _stream_event_panes(view, source, event, value, timeline, request_started,
+                                                      first_tokens, failed_sources)
+                if panes is not None:
+                    yield panes
+                if finished:
+                    return
+        finally:
+            await merger.close()
 
+        yield view.final()
+        if not failed_sources:
+            reasoning_response_cache.set(cache_key, view.cache_entry())
+
+    except Exception as e:
+        log_exception(f"推理过程出错: {str(e)}")
+        yield stream_error_panes(f"? 推理过程出错: {str(e)}", "? 真实输出获取失败")
 
 # 主提交函数 - 独立处理皮肤分析和可视化
 @log_exceptions
-def main_submit_fn(image, user_prompt):
+def main_submit_fn(image, user_prompt, request: gr.Request = None):
     """主提交处理函数 - 皮肤分析和可视化独立处理"""
     log_info("=== 用户提交分析请求 ===")
     log_debug(f"用户输入: {user_prompt}")
 
-    # 生成新的任务ID并设置为当前任务
-    task_id = generate_task_id()
-    set_current_task(task_id)
+    # 为本会话开启新任务，同时取消本会话的旧任务
+    cancel_token = set_current_task(session_key(request))
+    task_id = cancel_token.task_id
 
     if image is None:
         log_warning("用户未上传图片")
-        return "? 请先上传图片", "", "", "", ""
+        return "? 请先上传图片", "", "", "", "", task_id
 
     # 第一步：获取皮肤分析数据（核心数据，必须成功）
-    skin_data, analysis_status = get_skin_analysis_data(image)
+    bind_request(task_id)
+    timeline = timelines.start(task_id)
+    skin_data, analysis_status = get_skin_analysis_data(image, timeline)
+    return _submit_outputs(skin_data, analysis_status, cancel_token, timeline)
+
+async def async_main_submit_fn(image, user_prompt, request: gr.Request = None):
+    """main_submit_fn 的异步版本"""
+    log_info("=== 用户提交分析请求（异步） ===")
+    log_debug(f"用户输入: {user_prompt}")
+
+    cancel_token = set_current_task(session_key(request))
+    task_id = cancel_token.task_id
+
+    if image is None:
+        log_warning("用户未上传图片")
+        return "? 请先上传图片", "", "", "", "", task_id
+
+    bind_request(task_id)
+    timeline = timelines.start(task_id)
+    skin_data, analysis_status = await async_get_skin_analysis_data(image, timeline)
+    return _submit_outputs(skin_data, analysis_status, cancel_token, timeline)
+
+# 推测执行的提交函数 - 分析进行中先显示图表骨架并预热下游连接，分析完成后再输出结果
+def speculative_submit_fn(image, user_prompt, request: gr.Request = None):
+    """main_submit_fn 的推测执行版本（生成器：先输出骨架，再输出分析结果）"""
+    log_info("=== 用户提交分析请求（推测执行） ===")
+    log_debug(f"用户输入: {user_prompt}")
+
+    cancel_token = set_current_task(session_key(request))
+    task_id = cancel_token.task_id
+
+    if image is None:
+        log_warning("用户未上传图片")
+        yield "? 请先上传图片", "", "", "", "", task_id
+        return
+
+    timeline = timelines.start(task_id)
+    start_warmup(timeline)
+    yield "?? 正在分析皮肤数据...", chart_skeleton_html(), "?? 等待皮肤分析完成...", "", None, task_id
 
-    # 检查任务是否仍然是当前任务
-    if not is_task_current(task_id):
+    # 生成器的每一段可能在不同的上下文中执行，分析前重新绑定请求ID
+    bind_request(task_id)
+    skin_data, analysis_status = get_skin_analysis_data(image, timeline)
+    yield _submit_outputs(skin_data, analysis_status, cancel_token, timeline, chart_skeleton_html())
+
+async def async_speculative_submit_fn(image, user_prompt, request: gr.Request = None):
+    """speculative_submit_fn 的异步版本"""
+    log_info("=== 用户提交分析请求（推测执行，异步） ===")
+    log_debug(f"用户输入: {user_prompt}")
+
+    cancel_token = set_current_task(session_key(request))
+    task_id = cancel_token.task_id
+
+    if image is None:
+        log_warning("用户未上传图片")
+        yield "? 请先上传图片", "", "", "", "", task_id
+        return
+
+    timeline = timelines.start(task_id)
+    async_start_warmup(timeline)
+    yield "?? 正在分析皮肤数据...", chart_skeleton_html(), "?? 等待皮肤分析完成...", "", None, task_id
+
+    bind_request(task_id)
+    skin_data, analysis_status = await async_get_skin_analysis_data(image, timeline)
+    yield _submit_outputs(skin_data, analysis_status, cancel_token, timeline, chart_skeleton_html())
+
+def _submit_outputs(skin_data, analysis_status, cancel_token, timeline=NULL_TIMELINE, placeholder=None):
+    """根据分析结果生成提交后的初始界面状态；placeholder 为分析完成后可视化区域显示的内容"""
+    task_id = cancel_token.task_id
+
+    # 检查任务是否已被同一会话的新任务取消
+    if cancel_token.cancelled:
         log_info(f"任务 {task_id} 已被新任务中断，停止处理")
-        return "?? 任务已被新的图片分析中断", "", "", "", ""
+        timeline.skip("chart")
+        timeline.skip("reasoning")
+        return "?? 任务已被新的图片分析中断", "", "", "", "", task_id
 
     # 如果皮肤数据分析失败，整个流程无法继续
     if skin_data is None:
         log_error(f"皮肤数据分析失败: {analysis_status}")
-        return analysis_status, "", "", "", ""
+        timeline.skip("chart")
+        timeline.skip("reasoning")
+        return analysis_status, "", "", "", "", task_id
 
     log_info("皮肤数据分析成功，准备启动可视化和推理")
 
@@ -903,94 +1160,85 @@ def main_submit_fn(image, user_prompt):
 
     # 返回初始状态，推理过程将通过生成器函数流式更新
     log_info("返回初始状态，准备启动流式推理")
-    return analysis_status, loading_visualization, "?? 正在启动推理分析...", "", skin_data
+    return analysis_status, placeholder or loading_visualization, "?? 正在启动推理分析...", "", skin_data, task_id
 
 # 可视化更新函数 - 在后台异步更新可视化结果
 @log_exceptions
-def update_visualization(skin_data):
+def update_visualization(skin_data, task_id, request: gr.Request = None):
     """后台更新可视化图表"""
+    bind_request(task_id)
+    with timelines.get(task_id).stage("chart"):
+        return _update_visualization(skin_data, task_id, request)
+
+def _update_visualization(skin_data, task_id, request):
     log_info("开始后台更新可视化图表")
 
-    # 获取当前任务ID
-    global current_task_id
-    with task_lock:
-        task_id = current_task_id
+    # 获取本会话当前任务的取消令牌
+    cancel_token = get_task_token(session_key(request), task_id)
 
     if not skin_data:
         log_warning("皮肤数据为空，返回占位符")
-        return """
-        <div style="
-            background: #ffffff;
-            border: 1px solid #ffeaa7;
-            border-radius: 12px;
-            padding: 25px;
-            margin: 10px 0;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            text-align: center;
-        ">
-            <h3 style="color: #856404; font-weight: 600;">?? 可视化图表生成失败</h3>
-            <p style="color: #856404;">皮肤数据为空，无法生成可视化图表</p>
-        </div>
-        """
+        return empty_visualization_html()
 
-    # 检查任务是否仍然是当前任务
-    if not is_task_current(task_id):
+    # 检查任务是否已被同一会话的新任务取消
+    if cancel_token.cancelled:
         log_info(f"可视化任务 {task_id} 已被中断，停止生成")
-        return """
-        <div style="
-            background: #ffffff;
-            border: 1px solid #ffc107;
-            border-radius: 12px;
-            padding: 25px;
-            margin: 10px 0;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            text-align: center;
-        ">
-            <h3 style="color: #856404; font-weight: 600;">?? 可视化已被中断</h3>
-            <p style="color: #856404;">新的图片分析已开始，请查看最新结果</p>
-        </div>
-        """
+        return interrupted_visualization_html()
 
-    # 在后台生成真正的可视化图表
+    # 在后台生成真正的可视化图表（占用图表阶段的槽位，遵守NIM配额）
     try:
-        visualization_html = generate_visualization_chart(skin_data)
+        try:
+            visualization_html = pipeline.run("chart", generate_visualization_chart, skin_data)
+        except StageBusyError as busy_error:
+            log_warning(f"{busy_error}，当前阶段状态: {pipeline.stage('chart').stats()}")
+            return busy_visualization_html()
 
-        # 再次检查任务是否仍然是当前任务
-        if not is_task_current(task_id):
+        # 再次检查任务是否已被取消
+        if cancel_token.cancelled:
             log_info(f"可视化任务 {task_id} 在生成完成后被中断")
-            return """
-            <div style="
-                background: #ffffff;
-                border: 1px solid #ffc107;
-                border-radius: 12px;
-                padding: 25px;
-                margin: 10px 0;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                text-align: center;
-            ">
-                <h3 style="color: #856404; font-weight: 600;">?? 可视化已被中断</h3>
-                <p style="color: #856404;">新的图片分析已开始，请查看最新结果</p>
-            </div>
-            """
+            return interrupted_visualization_html()
 
         log_info("后台可视化图表更新成功")
         return visualization_html
     except Exception as e:
         log_error(f"后台可视化更新失败: {str(e)}", exc_info=True)
-        return f"""
-        <div style="
-            background: #ffffff;
-            border: 1px solid #f5c6cb;
-            border-radius: 12px;
-            padding: 25px;
-            margin: 10px 0;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            text-align: center;
-        ">
-            <h3 style="color: #721c24; margin-bottom: 15px; font-weight: 600;">? 可视化图表更新失败</h3>
-            <p style="color: #721c24;">后台更新过程中出现错误，但不影响分析结果</p>
-        </div>
-        """
+        return failed_visualization_html()
+
+async def async_update_visualization(skin_data, task_id, request: gr.Request = None):
+    """update_visualization 的异步版本"""
+    bind_request(task_id)
+    with timelines.get(task_id).stage("chart"):
+        return await _async_update_visualization(skin_data, task_id, request)
+
+async def _async_update_visualization(skin_data, task_id, request):
+    log_info("开始后台更新可视化图表（异步）")
+
+    cancel_token = get_task_token(session_key(request), task_id)
+
+    if not skin_data:
+        log_warning("皮肤数据为空，返回占位符")
+        return empty_visualization_html()
+
+    if cancel_token.cancelled:
+        log_info(f"可视化任务 {task_id} 已被中断，停止生成")
+        return interrupted_visualization_html()
+
+    try:
+        try:
+            visualization_html = await pipeline.run_async("chart", async_generate_visualization_chart, skin_data)
+        except StageBusyError as busy_error:
+            log_warning(f"{busy_error}，当前阶段状态: {pipeline.stage('chart').stats()}")
+            return busy_visualization_html()
+
+        if cancel_token.cancelled:
+            log_info(f"可视化任务 {task_id} 在生成完成后被中断")
+            return interrupted_visualization_html()
+
+        log_info("后台可视化图表更新成功")
+        return visualization_html
+    except Exception as e:
+        log_error(f"后台可视化更新失败: {str(e)}", exc_info=True)
+        return failed_visualization_html()
 
 
 
@@ -1092,28 +1340,39 @@ def img_and_text_module():
             )
 
 
-    # 创建隐藏的状态组件来存储皮肤数据
+    # 创建隐藏的状态组件来存储皮肤数据和本次任务ID
     skin_data_state = gr.State()
+    task_id_state = gr.State()
+
+    # 开启异步流水线时使用 asyncio 版本的处理函数，等待外部服务期间不占用工作线程
+    if bc.async_mode_instantiation():
+        submit_fn, reasoning_fn, visualization_fn = async_main_submit_fn, async_stream_deepseek_analysis, async_update_visualization
+    else:
+        submit_fn, reasoning_fn, visualization_fn = main_submit_fn, stream_deepseek_analysis, update_visualization
+
+    # 推测执行：提交后立即显示图表骨架，分析进行中预热下游连接
+    if bc.speculative_instantiation()['enabled']:
+        submit_fn = async_speculative_submit_fn if bc.async_mode_instantiation() else speculative_submit_fn
 
     # 绑定事件 - 分步骤处理
     # 第一步：处理图片和初始化
     submit_event = submit_btn.click(
-        fn=main_submit_fn,
+        fn=submit_fn,
         inputs=[image_input, text_input],
-        outputs=[status_output, result_output, model_proc, out_real, skin_data_state]
+        outputs=[status_output, result_output, model_proc, out_real, skin_data_state, task_id_state]
     )
 
     # 第二步：启动DeepSeek流式推理分析
     submit_event.then(
-        fn=stream_deepseek_analysis,
-        inputs=[skin_data_state, text_input],
+        fn=reasoning_fn,
+        inputs=[skin_data_state, text_input, task_id_state],
         outputs=[model_proc, out_real]
     )
 
     # 第三步：可视化更新（独立运行，不阻塞推理）
     submit_event.then(
-        fn=update_visualization,
-        inputs=[skin_data_state],
+        fn=visualization_fn,
+        inputs=[skin_data_state, task_id_state],
         outputs=[result_output]
     )
  
@@ -1149,14 +1408,28 @@ if __name__ == "__main__":
         log_info("加载前端配置")
         # 自定义 JavaScript 代码实现拖拽功能
         custom_css, intro_content, benefit_content = bc.front_end_instantiation()
+        # 推理面板的样式和滚动脚本只在页面加载时注入一次，不随每次流式更新重复发送
+        stream_css, stream_js = bc.stream_panes_instantiation()
 
         log_info("创建Gradio界面")
-        with gr.Blocks(css=custom_css, title="LittleSkin - 智能皮肤检测平台") as demo:
+        with gr.Blocks(css=custom_css + "\n" + stream_css, head=f"<script>{stream_js}</script>", title="LittleSkin - 智能皮肤检测平台") as demo:
 
             css_to_js(example_images, static_urls, intro_content, benefit_content)
 
             img_and_text_module()
 
+        # 显式设置Gradio队列：总并发上限和排队上限，各阶段的细粒度限额由 pipeline 控制
+        queue_options = bc.pipeline_queue_instantiation()
+        demo.queue(
+            default_concurrency_limit=queue_options.get('gradio_concurrency_limit', 32),
+            max_size=queue_options.get('gradio_queue_size', 128)
+        )
+
+        # 本地指标端点，供 Prometheus 抓取各阶段的延迟直方图
+        metrics_server = bc.metrics_server_instantiation()
+        if metrics_server is not None:
+            log_info(f"指标端点已启动: http://{metrics_server.server_address[0]}:{metrics_server.server_address[1]}/metrics")
+
         log_info("启动Web服务器，自动选择端口")
         demo.launch(server_name="0.0.0.0", server_port=7860, share=False, inbrowser=False)
 
@@ -1166,4 +1439,6 @@ if __name__ == "__main__":
         log_exception(f"程序启动失败: {str(e)}")
         raise
     finally:
+        get_registry().close_all()
+        tracer.flush()
         log_info("=== LittleSkin智能皮肤检测平台关闭 ===")
@@ -0,0 +1,95 @@
+// 推理过程 / 真实输出面板的智能自动滚动
+// 页面加载时注入一次：Gradio 每次流式更新都会重建面板节点，这里监听节点变化，
+// 在新节点上恢复用户的滚动状态，用户手动滚动查看历史时暂停自动滚动，回到底部后恢复
+(function () {
+    var PANE_IDS = ['reasoning-container', 'real-output-container'];
+    // 按面板保存滚动状态，面板节点被替换后依然有效
+    var paneState = {};
+
+    PANE_IDS.forEach(function (id) {
+        paneState[id] = { autoScroll: true, lastInteraction: 0, scrollTop: 0 };
+    });
+
+    function isAtBottom(container, tolerance) {
+        return container.scrollTop >= container.scrollHeight - container.clientHeight - tolerance;
+    }
+
+    function bindPane(container) {
+        var state = paneState[container.id];
+        container.setAttribute('data-scroll-handler-set', 'true');
+
+        // 监听多种用户交互事件
+        ['mousedown', 'wheel', 'touchstart', 'keydown'].forEach(function (eventType) {
+            container.addEventListener(eventType, function () {
+                state.lastInteraction = Date.now();
+
+                // 如果是滚轮事件，立即禁用自动滚动，3秒后若用户在底部则重新启用
+                if (eventType === 'wheel') {
+                    state.autoScroll = false;
+                    setTimeout(function () {
+                        var current = document.getElementById(container.id);
+                        if (current && isAtBottom(current, 20)) {
+                            state.autoScroll = true;
+                        }
+                    }, 3000);
+                }
+            }, { passive: true });
+        });
+
+        // 监听滚动事件
+        container.addEventListener('scroll', function () {
+            // 如果最近有用户交互，认为是用户主动滚动
+            if (Date.now() - state.lastInteraction < 1000) {
+                state.autoScroll = false;
+            }
+            state.scrollTop = container.scrollTop;
+
+            // 滚动到底部后延迟恢复自动滚动，避免误判
+            if (isAtBottom(container, 20)) {
+                setTimeout(function () {
+                    if (isAtBottom(container, 20)) {
+                        state.autoScroll = true;
+                    }
+                }, 500);
+            }
+        }, { passive: true });
+    }
+
+    function syncPane(id) {
+        var container = document.getElementById(id);
+        if (!container) return;
+        var state = paneState[id];
+
+        if (!container.hasAttribute('data-scroll-handler-set')) {
+            bindPane(container);
+        }
+
+        if (state.autoScroll && Date.now() - state.lastInteraction > 500) {
+            container.scrollTop = container.scrollHeight;
+        } else {
+            // 用户正在查看历史内容，保持原来的位置
+            container.scrollTop = state.scrollTop;
+        }
+    }
+
+    var pending = false;
+    var observer = new MutationObserver(function () {
+        // 合并同一帧内的多次变更
+        if (pending) return;
+        pending = true;
+        requestAnimationFrame(function () {
+            pending = false;
+            PANE_IDS.forEach(syncPane);
+        });
+    });
+
+    function start() {
+        observer.observe(document.body, { childList: true, subtree: true });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+})();
@@ -1,4 +1,6 @@
-import sys, logger_config, img_to_oss
+import sys, logger_config, img_to_oss, result_cache, pipeline_scheduler, rate_limiter, image_preprocess, storage_retention, prompt_compaction, chart_builder, chart_renderer, tracing, reasoning_cache
+from client_registry import get_registry
+from daily_logger import log_warning
 sys.stdout.reconfigure(encoding='utf-8')
 from pathlib import Path
 
@@ -20,9 +22,80 @@ def img_to_oss_url():
 def skin_analysis_instantiation(custom_img_path=None):
     access_key_id, access_key_secret, bucket_name, oss_endpoint = img_to_oss_url()
     skin_analysis = logger_config.Config().get_skin_analysis()
-    oss_img_url = img_to_oss.file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, custom_img_path)
+    upload_options = logger_config.Config().get_img_to_oss()
+    oss_img_url = img_to_oss.file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, custom_img_path,
+                                                url_mode=upload_options.get('url_mode') or 'public',
+                                                url_expires=int(upload_options.get('signed_url_expires') or 300))
     return skin_analysis, oss_img_url
 
+# 从内存中的图片字节实例化皮肤分析：按内容命名并直接上传到OSS，不经过本地文件
+def skin_analysis_instantiation_from_bytes(image_data, extension):
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = img_to_oss_url()
+    skin_analysis = logger_config.Config().get_skin_analysis()
+    oss_object_name, upload_options = _upload_options(image_data, extension)
+    oss_img_url = img_to_oss.upload_bytes_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                                  image_data, oss_object_name, **upload_options)
+    return skin_analysis, oss_img_url
+
+# skin_analysis_instantiation_from_bytes 的异步版本
+async def skin_analysis_instantiation_from_bytes_async(image_data, extension):
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = img_to_oss_url()
+    skin_analysis = logger_config.Config().get_skin_analysis()
+    oss_object_name, upload_options = _upload_options(image_data, extension)
+    oss_img_url = await img_to_oss.upload_bytes_oss_url_async(access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                                              image_data, oss_object_name, **upload_options)
+    return skin_analysis, oss_img_url
+
+def _upload_options(image_data, extension):
+    upload_options = logger_config.Config().get_img_to_oss()
+    retention = _oss_retention()
+    # 分析后删除对象时每次上传使用独立的对象名，避免删除正在被其他分析读取的同名对象
+    oss_object_name = img_to_oss.content_object_name(image_data, extension, upload_options.get('object_prefix', 'uploads'),
+                                                     unique=retention.deletes_objects)
+    return oss_object_name, {
+        'multipart_threshold': int(upload_options.get('multipart_threshold') or 10 * 1024 * 1024),
+        'part_size': int(upload_options.get('part_size') or 2 * 1024 * 1024),
+        'headers': retention.upload_headers(),
+        'url_mode': upload_options.get('url_mode') or 'public',
+        'url_expires': int(upload_options.get('signed_url_expires') or 300),
+        'url_min_remaining': int(upload_options.get('signed_url_min_remaining') or 60),
+    }
+
+def _oss_retention():
+    return storage_retention.create_oss_retention(logger_config.Config().get_storage_retention())
+
+# 分析完成后按保留策略处理上传到OSS的图片（删除或改标签）
+def release_uploaded_image(oss_img_url):
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = img_to_oss_url()
+    return img_to_oss.release_oss_object(access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                         oss_img_url, _oss_retention())
+
+# 对本地目录和OSS上传前缀的后台清理线程进行实例化
+def storage_sweeper_instantiation(on_sweep=None):
+    retention_options = logger_config.Config().get_storage_retention()
+    local_retention = storage_retention.create_local_retention(retention_options)
+
+    oss_sweep = None
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = img_to_oss_url()
+    oss_max_age_seconds = int(retention_options.get('oss_max_age_seconds') or 0)
+    object_prefix = logger_config.Config().get_img_to_oss().get('object_prefix', 'uploads')
+    # 没有上传前缀时不清理OSS，避免误删bucket中的其他对象
+    if bucket_name and oss_endpoint and object_prefix and oss_max_age_seconds:
+        def oss_sweep():
+            bucket = get_registry().oss_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+            return storage_retention.sweep_oss_prefix(bucket, object_prefix.strip('/') + '/', oss_max_age_seconds)
+
+    return storage_retention.RetentionSweeper(
+        local_retention,
+        interval_seconds=int(retention_options.get('sweep_interval_seconds') or 0),
+        oss_sweep=oss_sweep,
+        on_sweep=on_sweep,
+    )
+
+# 是否在本地 images/ 目录中额外保留上传图片的副本
+def archive_local_instantiation():
+    return bool(logger_config.Config().get_img_to_oss().get('archive_local', False))
+
 # 对deepseek-R1的基础配置进行实例化
 def deepseek_R1_instantiation():
     deepseek_llm = logger_config.Config().get_deepseek_api()
@@ -31,6 +104,14 @@ def deepseek_R1_instantiation():
     model_name = deepseek_llm.get('model_name')
     return api_key, base_url, model_name
 
+# 双模型模式的快速模型（与 R1 共用密钥和 base_url），未配置模型名称时返回 None
+def deepseek_fast_instantiation():
+    deepseek_llm = logger_config.Config().get_deepseek_api()
+    fast_model_name = deepseek_llm.get('fast_model_name')
+    if not fast_model_name:
+        return None
+    return deepseek_llm.get('api_key'), deepseek_llm.get('base_url'), fast_model_name, int(deepseek_llm.get('fast_max_tokens') or 300)
+
 # 对皮肤数据可视化进行实例化
 def skin_data_visualization():
     gemma3n_llm = logger_config.Config().get_gemma3n_api()
@@ -42,6 +123,94 @@ def skin_data_visualization():
 
     return api_key, invoke_url, model_name, max_tokens
 
+# 对图表生成器进行实例化（默认按规则本地生成，Gemma3n 作为可选模式和回退）
+def chart_builder_instantiation():
+    chart_options = logger_config.Config().get_chart_builder()
+    return chart_builder.create_chart_builder(chart_options, skin_data_visualization(), chart_renderer_instantiation())
+
+# 对图表渲染后端进行实例化（默认在服务端渲染为SVG，按配置哈希缓存）
+def chart_renderer_instantiation():
+    render_options = logger_config.Config().get_chart_render()
+    return chart_renderer.create_chart_renderer(render_options)
+
+# 对皮肤分析结果缓存进行实例化
+def result_cache_instantiation():
+    cache_options = logger_config.Config().get_result_cache()
+    return result_cache.create_result_cache(cache_options)
+
+# 对DeepSeek回答缓存进行实例化
+def reasoning_cache_instantiation():
+    cache_options = logger_config.Config().get_reasoning_cache()
+    return reasoning_cache.create_reasoning_cache(cache_options)
+
+# 对分析流水线调度器进行实例化
+def pipeline_scheduler_instantiation():
+    pipeline_options = logger_config.Config().get_pipeline()
+    return pipeline_scheduler.create_pipeline_scheduler(pipeline_options)
+
+# 对Gradio队列参数进行实例化
+def pipeline_queue_instantiation():
+    pipeline_options = logger_config.Config().get_pipeline()
+    return {
+        'gradio_concurrency_limit': int(pipeline_options.get('gradio_concurrency_limit') or 32),
+        'gradio_queue_size': int(pipeline_options.get('gradio_queue_size') or 128),
+    }
+
+# 对上传前的图片预处理器进行实例化
+def image_preprocess_instantiation():
+    preprocess_options = logger_config.Config().get_image_preprocess()
+    return image_preprocess.create_image_preprocessor(preprocess_options)
+
+# 对注入大模型提示词的分析结果压缩器进行实例化
+def prompt_compactor_instantiation():
+    compaction_options = logger_config.Config().get_prompt_compaction()
+    return prompt_compaction.create_prompt_compactor(compaction_options)
+
+# 对批量分析的默认参数进行实例化
+def batch_analysis_instantiation():
+    batch_options = logger_config.Config().get_batch_analysis()
+    return {
+        'workers': int(batch_options.get('workers') or 4),
+        'output': batch_options.get('output') or 'batch_results.jsonl',
+        'output_format': batch_options.get('output_format') or 'jsonl',
+        'question': batch_options.get('question') or '',
+    }
+
+# 对阿里云皮肤分析的限速器进行实例化
+def rate_limiter_instantiation():
+    rate_limit_options = logger_config.Config().get_rate_limit()
+    return rate_limiter.create_rate_limiter(rate_limit_options)
+
+# 启动本地指标端点（/metrics），未配置端口或启动失败时返回 None
+def metrics_server_instantiation():
+    tracing_options = logger_config.Config().get_tracing()
+    metrics_port = int(tracing_options.get('metrics_port') or 0)
+    if not tracing_options.get('enabled', True) or not metrics_port:
+        return None
+    metrics_host = tracing_options.get('metrics_host') or '127.0.0.1'
+    try:
+        return tracing.start_metrics_server(metrics_host, metrics_port)
+    except OSError as e:
+        # 端口被占用（例如同一台机器上的第二个实例）时只是没有指标端点，不能影响页面启动
+        log_warning(f"指标端点 {metrics_host}:{metrics_port} 启动失败，不提供 /metrics: {e}")
+        return None
+
+# 推测执行参数（图表骨架、下游连接预热）
+def speculative_instantiation():
+    pipeline_options = logger_config.Config().get_pipeline()
+    return {
+        'enabled': bool(pipeline_options.get('speculative', False)),
+        'warmup_interval_seconds': float(pipeline_options.get('warmup_interval_seconds') or 30),
+    }
+
+# 是否启用异步流水线
+def async_mode_instantiation():
+    return bool(logger_config.Config().get_pipeline().get('async_mode', False))
+
+# 对流式输出合并参数进行实例化
+def stream_coalescing_instantiation():
+    return logger_config.Config().get_stream_coalescing()
+
 # 对前端配置进行实例化
 def front_end_instantiation():
     front_end = logger_config.Config().get_front_end()
@@ -61,6 +230,20 @@ def front_end_instantiation():
 
     return css_content, intro_content, benefit_content
 
+# 对流式推理面板的静态样式和脚本进行实例化（页面加载时注入一次）
+def stream_panes_instantiation():
+    front_end = logger_config.Config().get_front_end()
+    stream_panes_css_path = front_end.get('stream_panes_css_path', 'assets/stream_panes.css')
+    stream_panes_js_path = front_end.get('stream_panes_js_path', 'assets/stream_panes_js.js')
+
+    with open(stream_panes_css_path, 'r', encoding='utf-8') as css_file:
+        stream_css = css_file.read()
+
+    with open(stream_panes_js_path, 'r', encoding='utf-8') as js_file:
+        stream_js = js_file.read()
+
+    return stream_css, stream_js
+
 
 if __name__ == '__main__':
     print(front_end_instantiation())       
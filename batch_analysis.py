@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+批量皮肤分析
+对一个目录或清单文件中的图片离线执行 预处理 -> 上传OSS -> 皮肤分析 -> 图表配置 -> 推理，
+用于夜间回填大量图片：
+- 固定大小的线程池并发处理，在途任务数有上限，不会一次性把所有图片读进内存
+- 皮肤分析共用 rate_limit 的令牌桶（sqlite 后端时与线上进程共享配额）和 resilience 的重试/熔断
+- 结果逐条追加写入 JSONL 并立即落盘，结果文件同时作为检查点：
+  重新运行时跳过已成功的图片，只处理未完成和失败的图片
+- 全部完成后可选转换为 Parquet（需要安装 pandas 和 pyarrow）
+- 批量任务不使用模拟数据，失败的图片记录错误原因
+
+用法：
+    python batch_analysis.py --dir image --output results.jsonl
+    python batch_analysis.py --manifest manifest.txt --workers 8 --no-reasoning
+    python batch_analysis.py --dir image --output results.jsonl --format parquet
+
+清单文件每行一张图片：纯路径，或 {"path": "...", "question": "..."} 形式的 JSON。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import back_configuration as bc
+import deepseek_R1_reasoning as dp
+from resilience import get_resilience
+from result_cache import image_content_hash
+from skin_analysis import Sample
+from skin_result import SkinResult
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def load_tasks(directory=None, manifest=None, default_question=""):
+    """读取待处理的图片列表，返回 [{"path": ..., "question": ...}]"""
+    tasks = []
+    if directory:
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    tasks.append({"path": os.path.join(root, name), "question": default_question})
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('{'):
+                    item = json.loads(line)
+                    tasks.append({"path": item["path"], "question": item.get("question") or default_question})
+                else:
+                    tasks.append({"path": line, "question": default_question})
+    return tasks
+
+
+def load_checkpoint(output_path):
+    """从结果文件中读取已成功处理的图片路径；进程崩溃时最后一行可能不完整，直接跳过"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["path"])
+    return done
+
+
+def collect_reasoning(response):
+    """把推理的流式响应收集为 (推理过程, 最终输出)"""
+    reasoning_content = []
+    content = []
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if getattr(delta, 'reasoning_content', None):
+            reasoning_content.append(delta.reasoning_content)
+        if getattr(delta, 'content', None):
+            content.append(delta.content)
+    return "".join(reasoning_content), "".join(content)
+
+
+class BatchAnalyzer:
+    """单张图片的完整处理流程，线程池中的各工作线程共用"""
+
+    def __init__(self, include_chart=True, include_reasoning=True):
+        self.include_chart = include_chart
+        self.include_reasoning = include_reasoning
+        self.preprocessor = bc.image_preprocess_instantiation()
+        self.result_cache = bc.result_cache_instantiation()
+        self.rate_limiter = bc.rate_limiter_instantiation()
+        self.resilience = get_resilience()
+
+    def analyze_skin(self, image_data, extension, image_hash):
+        """上传并调用皮肤分析，结果写入缓存（与线上共用，重复图片不再消耗配额）"""
+        cached = SkinResult.from_value(self.result_cache.get(image_hash))
+        if cached is not None:
+            return cached, True
+
+        skin_analysis, oss_img_url = bc.skin_analysis_instantiation_from_bytes(image_data, extension)
+
+        def detect_skin():
+            self.rate_limiter.acquire()
+            return Sample.main([], skin_analysis, oss_img_url)
+
+        try:
+            skins_data = self.resilience.call("imageprocess", detect_skin, deadline=self.resilience.deadline(),
+                                              on_throttled=self.rate_limiter.on_throttled)
+        finally:
+            try:
+                bc.release_uploaded_image(oss_img_url)
+            except Exception:
+                # 释放失败由后台清理和生命周期规则兜底
+                pass
+        if not skins_data:
+            raise RuntimeError("皮肤分析返回空结果")
+        self.result_cache.set(image_hash, skins_data.to_dict())
+        return skins_data, False
+
+    def run(self, task):
+        """处理一张图片，返回写入结果文件的记录；任何一步失败都记录在 error 中"""
+        started = time.perf_counter()
+        record = {"path": task["path"], "question": task["question"], "status": "ok"}
+        timings = {}
+        try:
+            image_hash = image_content_hash(task["path"])
+            record["image_hash"] = image_hash
+
+            stage_started = time.perf_counter()
+            image_data, extension, _ = self.preprocessor.prepare(task["path"])
+            skins_data, cached = self.analyze_skin(image_data, extension, image_hash)
+            timings["analysis"] = round(time.perf_counter() - stage_started, 3)
+            record["skin_data"] = skins_data.to_dict()
+            record["cached"] = cached
+
+            if self.include_chart:
+                stage_started = time.perf_counter()
+                chart_url, chart_config = bc.chart_builder_instantiation().chart(skins_data)
+                timings["chart"] = round(time.perf_counter() - stage_started, 3)
+                record["chart_url"] = chart_url
+                record["chart_config"] = chart_config
+
+            if self.include_reasoning:
+                stage_started = time.perf_counter()
+                dp_api_key, dp_base_url, dp_model_name = bc.deepseek_R1_instantiation()
+                response = dp.dp_analysis_result(skins_data, dp_api_key, dp_base_url, dp_model_name,
+                                                 task["question"])
+                record["reasoning"], record["answer"] = collect_reasoning(response)
+                timings["reasoning"] = round(time.perf_counter() - stage_started, 3)
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = f"{type(e).__name__}: {e}"
+
+        timings["total"] = round(time.perf_counter() - started, 3)
+        record["timings"] = timings
+        record["finished_at"] = datetime.now().isoformat(timespec='seconds')
+        return record
+
+
+def write_parquet(jsonl_path, parquet_path):
+    """把 JSONL 结果转换为 Parquet，同一图片有多条记录时保留最后一条"""
+    try:
+        import pandas as pd
+    except ImportError:
+        print("未安装 pandas/pyarrow，跳过 Parquet 转换，结果保留在 JSONL 中")
+        return False
+
+    records = {}
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["path"]] = record
+    frame = pd.DataFrame(list(records.values()))
+    # 嵌套字段序列化为 JSON 字符串，保证各行的列类型一致
+    for column in ("chart_config", "timings"):
+        if column in frame:
+            frame[column] = frame[column].map(lambda value: json.dumps(value, ensure_ascii=False)
+                                              if isinstance(value, (dict, list)) else value)
+    try:
+        frame.to_parquet(parquet_path, index=False)
+    except ImportError:
+        print("未安装 pyarrow，跳过 Parquet 转换，结果保留在 JSONL 中")
+        return False
+    return True
+
+
+def main():
+    options = bc.batch_analysis_instantiation()
+
+    parser = argparse.ArgumentParser(description="批量皮肤分析")
+    parser.add_argument('--dir', help="图片目录（递归查找）")
+    parser.add_argument('--manifest', help="清单文件，每行一个图片路径或 JSON")
+    parser.add_argument('--output', default=options['output'], help="结果文件（JSONL），同时作为检查点")
+    parser.add_argument('--format', choices=('jsonl', 'parquet'), default=options['output_format'],
+                        help="完成后额外输出的格式")
+    parser.add_argument('--workers', type=int, default=options['workers'], help="并发处理的图片数")
+    parser.add_argument('--question', default=options['question'], help="清单中未指定问题时使用的默认问题")
+    parser.add_argument('--no-chart', action='store_true', help="不生成图表配置")
+    parser.add_argument('--no-reasoning', action='store_true', help="不调用推理模型")
+    args = parser.parse_args()
+
+    if not args.dir and not args.manifest:
+        parser.error("需要指定 --dir 或 --manifest")
+
+    tasks = load_tasks(args.dir, args.manifest, args.question)
+    done = load_checkpoint(args.output)
+    pending = [task for task in tasks if task["path"] not in done]
+    print(f"共 {len(tasks)} 张图片，已完成 {len(tasks) - len(pending)} 张，本次处理 {len(pending)} 张")
+
+    analyzer = BatchAnalyzer(include_chart=not args.no_chart, include_reasoning=not args.no_reasoning)
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    counts = {"ok": 0, "failed": 0}
+    started = time.perf_counter()
+    task_iter = iter(pending)
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch") as executor, \
+            open(args.output, 'a', encoding='utf-8') as output:
+        in_flight = set()
+        while True:
+            # 在途任务数保持在 2 倍线程数以内
+            while len(in_flight) < args.workers * 2:
+                task = next(task_iter, None)
+                if task is None:
+                    break
+                in_flight.add(executor.submit(analyzer.run, task))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                # 每条结果立即落盘，进程崩溃后从这里继续
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                os.fsync(output.fileno())
+                counts[record["status"]] += 1
+                processed = counts["ok"] + counts["failed"]
+                print(f"[{processed}/{len(pending)}] {record['status']} {record['path']}"
+                      + (f" - {record['error']}" if record["status"] == "failed" else ""))
+
+    elapsed = time.perf_counter() - started
+    print(f"完成: 成功 {counts['ok']} 张，失败 {counts['failed']} 张，耗时 {elapsed:.1f} 秒，"
+          f"限速器状态: {analyzer.rate_limiter.stats()}")
+
+    if args.format == 'parquet':
+        parquet_path = os.path.splitext(args.output)[0] + ".parquet"
+        if write_parquet(args.output, parquet_path):
+            print(f"Parquet 结果已写入: {parquet_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+图表配置生成模块
+DetectSkinDisease 的结果结构是固定的（{病症名称: 置信度}），不需要每次请求都让 Gemma3n 生成 Chart.js 配置。
+这里按规则在本地直接生成配置：
+- 结果数量在 3 到 radar_max_labels 之间用雷达图，其余用柱状图（按置信度着色）
+- 只展示置信度最高的 max_labels 项，置信度换算为百分比
+模式：
+- rules: 默认，本地规则生成；数据无法识别时回退到 Gemma3n
+- creative: 保留原先的 Gemma3n 生成方式，调用失败时回退到本地规则
+两种模式生成的配置都交给 chart_renderer 渲染为图表地址。
+"""
+
+import gemma3n_models as gm
+from daily_logger import log_warning
+from skin_result import SkinResult
+
+MODE_RULES = "rules"
+MODE_CREATIVE = "creative"
+
+# 置信度对应的柱状图颜色：高 / 中 / 低
+SCORE_COLORS = (
+    (0.5, "rgba(220, 53, 69, 0.8)"),
+    (0.2, "rgba(255, 159, 64, 0.8)"),
+    (0.0, "rgba(40, 167, 69, 0.8)"),
+)
+RADAR_COLOR = "rgb(54, 162, 235)"
+RADAR_FILL = "rgba(54, 162, 235, 0.2)"
+
+
+def _score_color(score):
+    for threshold, color in SCORE_COLORS:
+        if score >= threshold:
+            return color
+    return SCORE_COLORS[-1][1]
+
+
+def _title(result):
+    title = "皮肤检测结果"
+    if result.body_part:
+        title += f"（{result.body_part}）"
+    if result.is_mock:
+        title += " - 模拟数据"
+    return title
+
+
+def radar_config(result, labels, values):
+    return {
+        "type": "radar",
+        "data": {
+            "labels": labels,
+            "datasets": [{
+                "label": "置信度(%)",
+                "data": values,
+                "backgroundColor": RADAR_FILL,
+                "borderColor": RADAR_COLOR,
+                "pointBackgroundColor": RADAR_COLOR,
+            }],
+        },
+        "options": {
+            "title": {"display": True, "text": _title(result)},
+            "legend": {"display": False},
+            "scale": {"ticks": {"beginAtZero": True, "max": 100}},
+        },
+    }
+
+
+def bar_config(result, labels, values, scores):
+    return {
+        "type": "bar",
+        "data": {
+            "labels": labels,
+            "datasets": [{
+                "label": "置信度(%)",
+                "data": values,
+                "backgroundColor": [_score_color(score) for score in scores],
+            }],
+        },
+        "options": {
+            "title": {"display": True, "text": _title(result)},
+            "legend": {"display": False},
+            "scales": {"yAxes": [{"ticks": {"beginAtZero": True, "max": 100}}]},
+        },
+    }
+
+
+def build_chart_config(value, chart_type="auto", max_labels=10, radar_max_labels=8):
+    """按规则生成 Chart.js 配置；数据无法识别或没有结果时返回 None"""
+    result = SkinResult.from_value(value)
+    if result is None:
+        return None
+    items = sorted(((name, score) for name, score in result.results.items() if isinstance(score, (int, float))),
+                   key=lambda item: item[1], reverse=True)[:max_labels]
+    if not items:
+        return None
+
+    labels = [name for name, _ in items]
+    scores = [score for _, score in items]
+    values = [round(score * 100, 1) for score in scores]
+
+    if chart_type == "auto":
+        chart_type = "radar" if 3 <= len(items) <= radar_max_labels else "bar"
+    if chart_type == "radar" and len(items) >= 3:
+        return radar_config(result, labels, values)
+    return bar_config(result, labels, values, scores)
+
+
+class ChartBuilder:
+    """按模式生成图表，返回 (图表URL, 配置)，与 gemma3n_skin_quickchartURL 的返回值相同"""
+
+    def __init__(self, mode=MODE_RULES, chart_type="auto", max_labels=10, radar_max_labels=8,
+                 fallback=True, nim_options=None, renderer=None):
+        self.mode = mode
+        self.chart_type = chart_type
+        self.max_labels = max_labels
+        self.radar_max_labels = radar_max_labels
+        self.fallback = fallback
+        # (api_key, invoke_url, model_name, max_tokens)
+        self.nim_options = nim_options
+        # 图表渲染后端，未指定时使用 quickchart.io 的 URL
+        self.renderer = renderer
+
+    def _url(self, config):
+        if self.renderer is None:
+            return gm.generate_quickchart_url(config)
+        return self.renderer.chart_url(config)
+
+    def _llm(self, chart):
+        # Gemma3n 返回 (quickchart URL, 配置)，按渲染后端重新生成地址
+        chart_url, config = chart
+        return self._url(config), config
+
+    def _rules(self, data):
+        config = build_chart_config(data, self.chart_type, self.max_labels, self.radar_max_labels)
+        if config is None:
+            return None
+        return self._url(config), config
+
+    def chart(self, data):
+        if self.mode != MODE_CREATIVE:
+            chart = self._rules(data)
+            if chart is not None or not self.fallback:
+                return chart
+            log_warning("分析结果无法按规则生成图表，回退到Gemma3n生成")
+            return self._llm(gm.gemma3n_skin_quickchartURL(data, *self.nim_options))
+
+        try:
+            return self._llm(gm.gemma3n_skin_quickchartURL(data, *self.nim_options))
+        except Exception as e:
+            chart = self._rules(data) if self.fallback else None
+            if chart is None:
+                raise
+            log_warning(f"Gemma3n生成图表失败，回退到规则生成: {str(e)}")
+            return chart
+
+    async def chart_async(self, data):
+        """chart() 的异步版本，只有调用 Gemma3n 时才需要等待网络"""
+        if self.mode != MODE_CREATIVE:
+            chart = self._rules(data)
+            if chart is not None or not self.fallback:
+                return chart
+            log_warning("分析结果无法按规则生成图表，回退到Gemma3n生成")
+            return self._llm(await gm.gemma3n_skin_quickchartURL_async(data, *self.nim_options))
+
+        try:
+            return self._llm(await gm.gemma3n_skin_quickchartURL_async(data, *self.nim_options))
+        except Exception as e:
+            chart = self._rules(data) if self.fallback else None
+            if chart is None:
+                raise
+            log_warning(f"Gemma3n生成图表失败，回退到规则生成: {str(e)}")
+            return chart
+
+
+def create_chart_builder(options, nim_options, renderer=None):
+    """根据配置字典创建图表生成器"""
+    options = options or {}
+    return ChartBuilder(
+        mode=options.get('mode') or MODE_RULES,
+        chart_type=options.get('chart_type') or "auto",
+        max_labels=int(options.get('max_labels') or 10),
+        radar_max_labels=int(options.get('radar_max_labels') or 8),
+        fallback=bool(options.get('fallback', True)),
+        nim_options=nim_options,
+        renderer=renderer,
+    )
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+图表渲染模块
+原先图表通过 https://quickchart.io/chart?c=... 渲染：完整配置编码进 URL（动辄数 KB），
+每次打开页面浏览器都要请求第三方服务重新渲染。这里在服务端把 Chart.js 配置直接渲染为 SVG：
+- 支持 radar / bar / horizontalBar / pie / doughnut，覆盖规则生成的全部图表和大部分 Gemma3n 生成的图表
+- 以配置的哈希为文件名缓存在 output_dir 中，相同配置只渲染一次（进程重启后依然有效）
+- 页面中以 data:image/svg+xml URI 直接内嵌，浏览器不再请求任何外部服务
+  （Gradio 的 /file= 路由出于 XSS 考虑把 SVG 作为附件下载，不能直接用作 <img> 地址）
+- 不支持的图表类型在 fallback 开启时退回 quickchart.io 的 URL
+- 文件数超过 max_files 时从最旧的文件开始删除
+"""
+
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+QUICKCHART_URL = "https://quickchart.io/chart"
+
+# 数据集未指定颜色时使用的调色板
+PALETTE = (
+    "rgb(54, 162, 235)", "rgb(255, 99, 132)", "rgb(255, 159, 64)", "rgb(75, 192, 192)",
+    "rgb(153, 102, 255)", "rgb(255, 205, 86)", "rgb(201, 203, 207)", "rgb(40, 167, 69)",
+)
+FONT_FAMILY = "'PingFang SC','Microsoft YaHei','Noto Sans CJK SC',sans-serif"
+
+
+class UnsupportedChartError(Exception):
+    """本地渲染不支持的图表类型"""
+
+
+def quickchart_url(config):
+    """quickchart.io 的图表 URL（本地无法渲染时使用）"""
+    config_json = json.dumps(config, separators=(',', ':'))
+    return f"{QUICKCHART_URL}?c={urllib.parse.quote(config_json)}"
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False,
+                                     separators=(',', ':')).encode('utf-8')).hexdigest()[:24]
+
+
+def _color(value, index, default=None):
+    """Chart.js 的颜色可以是单个值或按数据项给出的列表"""
+    if isinstance(value, list):
+        return value[index % len(value)] if value else (default or PALETTE[index % len(PALETTE)])
+    return value or default or PALETTE[index % len(PALETTE)]
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    # NaN / Infinity 无法换算为坐标，交给 quickchart 处理
+    if not math.isfinite(number):
+        raise UnsupportedChartError(f"图表数据包含非有限数值: {value}")
+    return number
+
+
+def _format_number(value):
+    return f"{value:.0f}" if value == int(value) else f"{value:.1f}"
+
+
+def _title_text(options):
+    """标题可以是 {"text": ...} 对象、纯字符串或字符串列表（模型生成的配置不一定符合 Chart.js 的格式）"""
+    options = options or {}
+    title = options.get("title") or (options.get("plugins") or {}).get("title") or {}
+    if isinstance(title, dict):
+        title = title.get("text") if title.get("display", True) else None
+    if isinstance(title, list):
+        return " ".join(str(item) for item in title)
+    return str(title) if title else None
+
+
+def _axis_max(options, values, radial):
+    """优先使用配置中的刻度上限，否则按数据向上取整"""
+    options = options or {}
+    if radial:
+        ticks = options.get("scale", {}).get("ticks", {})
+    else:
+        axes = options.get("scales", {}).get("yAxes") or options.get("scales", {}).get("xAxes") or [{}]
+        ticks = axes[0].get("ticks", {}) if axes else {}
+    if isinstance(ticks.get("max"), (int, float)) and math.isfinite(ticks["max"]) and ticks["max"] > 0:
+        return float(ticks["max"])
+    peak = max(values, default=0)
+    # 数据全为 0 或负数时（柱形从 0 起画，不显示负值）使用 1 作为上限
+    if peak <= 0:
+        peak = 1
+    magnitude = 10 ** math.floor(math.log10(peak))
+    return math.ceil(peak / magnitude) * magnitude
+
+
+class SvgChartRenderer:
+    """把 Chart.js 配置渲染为 SVG"""
+
+    def __init__(self, width=600, height=400):
+        self.width = width
+        self.height = height
+
+    def _svg(self, body, title):
+        header = ""
+        if title:
+            header = (f'<text x="{self.width / 2:.1f}" y="26" text-anchor="middle" font-size="16" '
+                      f'font-weight="600" fill="#333">{escape(title)}</text>')
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+                f'viewBox="0 0 {self.width} {self.height}" font-family="{FONT_FAMILY}">'
+                f'<rect width="100%" height="100%" fill="#ffffff"/>{header}{body}</svg>')
+
+    def render(self, config):
+        chart_type = config.get("type")
+        data = config.get("data") or {}
+        labels = [str(label) for label in data.get("labels") or []]
+        datasets = data.get("datasets") or []
+        if not labels or not datasets:
+            raise UnsupportedChartError("图表缺少 labels 或 datasets")
+        options = config.get("options") or {}
+        title = _title_text(options)
+
+        if chart_type == "radar":
+            body = self._radar(labels, datasets, options)
+        elif chart_type in ("bar", "horizontalBar"):
+            horizontal = chart_type == "horizontalBar" or options.get("indexAxis") == "y"
+            body = self._bar(labels, datasets, options, horizontal)
+        elif chart_type in ("pie", "doughnut"):
+            body = self._pie(labels, datasets[0], chart_type == "doughnut")
+        else:
+            raise UnsupportedChartError(f"不支持的图表类型: {chart_type}")
+        return self._svg(body, title)
+
+    def _radar(self, labels, datasets, options):
+        cx, cy = self.width / 2, self.height / 2 + 16
+        radius = min(self.width, self.height) / 2 - 60
+        values = [_number(v) for dataset in datasets for v in dataset.get("data") or []]
+        top = _axis_max(options, values, radial=True)
+        count = len(labels)
+
+        def point(index, ratio):
+            angle = -math.pi / 2 + 2 * math.pi * index / count
+            return cx + radius * ratio * math.cos(angle), cy + radius * ratio * math.sin(angle)
+
+        parts = []
+        # 网格与刻度
+        for step in range(1, 6):
+            ratio = step / 5
+            ring = " ".join(f"{x:.1f},{y:.1f}" for x, y in (point(i, ratio) for i in range(count)))
+            parts.append(f'<polygon points="{ring}" fill="none" stroke="#e0e0e0"/>')
+            parts.append(f'<text x="{cx + 3:.1f}" y="{cy - radius * ratio - 2:.1f}" font-size="10" '
+                         f'fill="#999">{_format_number(top * ratio)}</text>')
+        for index, label in enumerate(labels):
+            x, y = point(index, 1)
+            parts.append(f'<line x1="{cx:.1f}" y1="{cy:.1f}" x2="{x:.1f}" y2="{y:.1f}" stroke="#e0e0e0"/>')
+            lx, ly = point(index, 1.12)
+            anchor = "middle" if abs(lx - cx) < 1 else ("start" if lx > cx else "end")
+            parts.append(f'<text x="{lx:.1f}" y="{ly + 4:.1f}" text-anchor="{anchor}" font-size="12" '
+                         f'fill="#333">{escape(label)}</text>')
+        # 数据多边形
+        for dataset_index, dataset in enumerate(datasets):
+            border = _color(dataset.get("borderColor"), dataset_index)
+            fill = _color(dataset.get("backgroundColor"), dataset_index, "none")
+            points = [point(i, min(_number(v) / top, 1.0) if top else 0)
+                      for i, v in enumerate((dataset.get("data") or [])[:count])]
+            shape = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+            parts.append(f'<polygon points="{shape}" fill="{fill}" stroke="{border}" stroke-width="2"/>')
+            for x, y in points:
+                parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3" fill="{border}"/>')
+        return "".join(parts)
+
+    def _bar(self, labels, datasets, options, horizontal):
+        left, right, top_margin, bottom = (110, 30, 50, 30) if horizontal else (50, 20, 50, 60)
+        plot_w = self.width - left - right
+        plot_h = self.height - top_margin - bottom
+        values = [_number(v) for dataset in datasets for v in dataset.get("data") or []]
+        top = _axis_max(options, values, radial=False)
+        band = (plot_h if horizontal else plot_w) / len(labels)
+        bar_size = band * 0.7 / len(datasets)
+
+        parts = []
+        # 数值轴刻度
+        for step in range(0, 6):
+            ratio = step / 5
+            if horizontal:
+                x = left + plot_w * ratio
+                parts.append(f'<line x1="{x:.1f}" y1="{top_margin}" x2="{x:.1f}" y2="{top_margin + plot_h}" stroke="#eee"/>')
+                parts.append(f'<text x="{x:.1f}" y="{top_margin + plot_h + 16}" text-anchor="middle" font-size="10" '
+                             f'fill="#999">{_format_number(top * ratio)}</text>')
+            else:
+                y = top_margin + plot_h * (1 - ratio)
+                parts.append(f'<line x1="{left}" y1="{y:.1f}" x2="{left + plot_w}" y2="{y:.1f}" stroke="#eee"/>')
+                parts.append(f'<text x="{left - 6}" y="{y + 4:.1f}" text-anchor="end" font-size="10" '
+                             f'fill="#999">{_format_number(top * ratio)}</text>')
+
+        for index, label in enumerate(labels):
+            band_start = (top_margin if horizontal else left) + band * index + band * 0.15
+            for dataset_index, dataset in enumerate(datasets):
+                data = dataset.get("data") or []
+                value = _number(data[index]) if index < len(data) else 0.0
+                length = (plot_w if horizontal else plot_h) * min(max(value / top, 0.0), 1.0) if top else 0
+                color = _color(dataset.get("backgroundColor"), index if len(datasets) == 1 else dataset_index)
+                offset = band_start + bar_size * dataset_index
+                if horizontal:
+                    parts.append(f'<rect x="{left}" y="{offset:.1f}" width="{length:.1f}" height="{bar_size:.1f}" fill="{color}"/>')
+                    parts.append(f'<text x="{left + length + 4:.1f}" y="{offset + bar_size / 2 + 4:.1f}" font-size="10" '
+                                 f'fill="#555">{_format_number(value)}</text>')
+                else:
+                    y = top_margin + plot_h - length
+                    parts.append(f'<rect x="{offset:.1f}" y="{y:.1f}" width="{bar_size:.1f}" height="{length:.1f}" fill="{color}"/>')
+                    parts.append(f'<text x="{offset + bar_size / 2:.1f}" y="{y - 4:.1f}" text-anchor="middle" '
+                                 f'font-size="10" fill="#555">{_format_number(value)}</text>')
+            center = band_start + band * 0.35
+            if horizontal:
+                parts.append(f'<text x="{left - 6}" y="{center + 4:.1f}" text-anchor="end" font-size="12" '
+                             f'fill="#333">{escape(label)}</text>')
+            else:
+                parts.append(f'<text x="{center:.1f}" y="{top_margin + plot_h + 18}" text-anchor="middle" '
+                             f'font-size="12" fill="#333">{escape(label)}</text>')
+
+        axis = (f'<line x1="{left}" y1="{top_margin}" x2="{left}" y2="{top_margin + plot_h}" stroke="#999"/>'
+                if horizontal else
+                f'<line x1="{left}" y1="{top_margin + plot_h}" x2="{left + plot_w}" y2="{top_margin + plot_h}" stroke="#999"/>')
+        return "".join(parts) + axis
+
+    def _pie(self, labels, dataset, doughnut):
+        values = [max(_number(v), 0.0) for v in (dataset.get("data") or [])[:len(labels)]]
+        total = sum(values)
+        if not total:
+            raise UnsupportedChartError("饼图数据全为 0")
+        cx, cy = self.width * 0.38, self.height / 2 + 16
+        radius = min(self.width * 0.6, self.height - 60) / 2 - 10
+        parts = []
+        angle = -math.pi / 2
+        for index, value in enumerate(values):
+            color = _color(dataset.get("backgroundColor"), index)
+            sweep = 2 * math.pi * value / total
+            if sweep >= 2 * math.pi - 1e-9:
+                parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{radius:.1f}" fill="{color}"/>')
+            elif sweep > 0:
+                x1, y1 = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+                x2, y2 = cx + radius * math.cos(angle + sweep), cy + radius * math.sin(angle + sweep)
+                large = 1 if sweep > math.pi else 0
+                parts.append(f'<path d="M{cx:.1f},{cy:.1f} L{x1:.1f},{y1:.1f} A{radius:.1f},{radius:.1f} 0 {large} 1 '
+                             f'{x2:.1f},{y2:.1f} Z" fill="{color}" stroke="#fff"/>')
+            angle += sweep
+            # 图例
+            ly = 60 + index * 22
+            parts.append(f'<rect x="{self.width * 0.72:.1f}" y="{ly}" width="12" height="12" fill="{color}"/>')
+            parts.append(f'<text x="{self.width * 0.72 + 18:.1f}" y="{ly + 11}" font-size="12" fill="#333">'
+                         f'{escape(labels[index])} ({value / total:.0%})</text>')
+        if doughnut:
+            parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{radius * 0.5:.1f}" fill="#ffffff"/>')
+        return "".join(parts)
+
+
+# 最近生成的 data URI（进程内，按配置哈希），命中时不再读取文件
+URI_CACHE_SIZE = 256
+_uri_cache = OrderedDict()
+_uri_lock = threading.Lock()
+
+
+class ChartRenderer:
+    """渲染后端：local 渲染为 SVG 并按配置哈希缓存；quickchart 沿用 quickchart.io 的 URL"""
+
+    def __init__(self, backend="local", output_dir="cache/charts", width=600, height=400,
+                 max_files=1000, fallback=True):
+        self.backend = backend
+        self.output_dir = os.path.abspath(output_dir)
+        self.max_files = max_files
+        self.fallback = fallback
+        self.svg = SvgChartRenderer(width, height)
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        """文件数超过上限时删除最旧的文件"""
+        if not self.max_files:
+            return
+        entries = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.output_dir)
+                         if entry.is_file() and entry.name.endswith(".svg"))
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def render_file(self, config):
+        """返回配置对应的 SVG 文件路径，已渲染过的配置直接复用"""
+        path = os.path.join(self.output_dir, f"{config_hash(config)}.svg")
+        if os.path.exists(path):
+            return path
+        try:
+            svg = self.svg.render(config)
+        except UnsupportedChartError:
+            raise
+        except Exception as e:
+            # 模型生成的配置格式五花八门，未预料到的结构同样按不支持处理，由调用方决定是否退回 quickchart
+            raise UnsupportedChartError(f"图表配置无法渲染: {e}") from e
+        with self._lock:
+            os.makedirs(self.output_dir, exist_ok=True)
+            # 先写临时文件再替换，避免浏览器读到写了一半的文件
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(svg)
+            os.replace(temp_path, path)
+            self._prune()
+        return path
+
+    def chart_url(self, config):
+        """返回页面中使用的图表地址"""
+        if self.backend != "local":
+            return quickchart_url(config)
+        key = config_hash(config)
+        with _uri_lock:
+            uri = _uri_cache.get(key)
+            if uri is not None:
+                _uri_cache.move_to_end(key)
+                return uri
+        try:
+            path = self.render_file(config)
+        except UnsupportedChartError:
+            if not self.fallback:
+                raise
+            return quickchart_url(config)
+        with open(path, 'rb') as f:
+            uri = "data:image/svg+xml;base64," + base64.b64encode(f.read()).decode('ascii')
+        with _uri_lock:
+            _uri_cache[key] = uri
+            while len(_uri_cache) > URI_CACHE_SIZE:
+                _uri_cache.popitem(last=False)
+        return uri
+
+
+def create_chart_renderer(options):
+    """根据配置字典创建渲染后端"""
+    options = options or {}
+    return ChartRenderer(
+        backend=options.get('backend') or "local",
+        output_dir=options.get('output_dir') or "cache/charts",
+        width=int(options.get('width') or 600),
+        height=int(options.get('height') or 400),
+        max_files=int(options.get('max_files') or 0),
+        fallback=bool(options.get('fallback', True)),
+    )
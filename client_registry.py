@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+外部服务客户端注册表
+OSS、阿里云 imageprocess、DeepSeek(OpenAI 兼容接口) 和 NVIDIA NIM 的客户端在进程内只构建一次，
+复用 keep-alive 连接池，避免每次请求都重新握手 TLS、重新建立连接。
+- 客户端按 (类型, 服务地址) 分槽位缓存，凭证变化（密钥轮换）时自动重建
+- 超过 max_age_seconds 的客户端在下次取用时重建，定期回收长连接
+- 调用方遇到连接类错误时可以调用 invalidate() 让客户端下次重建
+- health_check() 逐个探测已创建的客户端，失败的客户端会被移除
+- 客户端在全局锁之外构建，慢的构建不会阻塞其他槽位的取用
+- 被替换或移除的客户端可能仍有进行中的流式请求，先保留 retire_grace_seconds 秒再关闭连接池；
+  异步客户端（AsyncOpenAI、httpx.AsyncClient）通过 aclose 关闭
+"""
+
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+
+import httpx
+import oss2
+import requests
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+from alibabacloud_imageprocess20200320.client import Client as imageprocess20200320Client
+from alibabacloud_tea_openapi import models as open_api_models
+
+import logger_config
+
+
+def _fingerprint(*parts):
+    """凭证指纹：只保存哈希，不在内存中额外保留明文密钥"""
+    return hashlib.sha256("\x00".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("client", "fingerprint", "created_at", "closer", "probe", "retired_at")
+
+    def __init__(self, client, fingerprint, closer=None, probe=None):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+        # closer 可以是普通函数，也可以是协程函数（异步客户端的 aclose）
+        self.closer = closer
+        self.probe = probe
+        self.retired_at = None
+
+
+# 在事件循环中调度的关闭任务，保留引用直到完成
+_closing_tasks = set()
+
+
+def _closing_done(task):
+    _closing_tasks.discard(task)
+    if not task.cancelled():
+        # 取出异常，关闭失败不影响业务
+        task.exception()
+
+
+def _run_async_close(coroutine):
+    """在当前线程的事件循环中调度异步关闭；没有运行中的事件循环（进程退出时）则同步执行"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None:
+        task = loop.create_task(coroutine)
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_done)
+        return
+    try:
+        asyncio.run(coroutine)
+    except Exception:
+        pass
+
+
+class ClientRegistry:
+    """进程级客户端注册表"""
+
+    def __init__(self, pool_size=32, max_age_seconds=3600, timeout_seconds=30, retire_grace_seconds=600):
+        self.pool_size = pool_size
+        self.max_age_seconds = max_age_seconds
+        self.timeout_seconds = timeout_seconds
+        # 被替换的客户端保留多久再关闭，应不短于最长的流式请求（DeepSeek 读超时 600 秒）
+        self.retire_grace_seconds = retire_grace_seconds
+        self._entries = {}
+        self._retired = []
+        self._lock = threading.Lock()
+        self._oss_session = None
+
+    def _usable(self, entry, fingerprint):
+        if entry is None or entry.fingerprint != fingerprint:
+            return False
+        return not (self.max_age_seconds and time.time() - entry.created_at > self.max_age_seconds)
+
+    def _get(self, slot, fingerprint, factory):
+        """取出槽位中的客户端；不存在、凭证变化或过期时重建"""
+        with self._lock:
+            entry = self._entries.get(slot)
+            if self._usable(entry, fingerprint):
+                return entry.client
+
+        # 在锁外构建客户端（可能要读取证书、建立会话），构建完成后再次检查槽位
+        client, closer, probe = factory()
+        built = _Entry(client, fingerprint, closer, probe)
+        discarded = None
+        with self._lock:
+            entry = self._entries.get(slot)
+            if self._usable(entry, fingerprint):
+                # 其他线程已经重建了该槽位，本次构建的客户端还没有被使用，直接关闭
+                discarded = built
+            else:
+                if entry is not None:
+                    self._retire(entry)
+                self._entries[slot] = entry = built
+            due = self._take_due_retired()
+        if discarded is not None:
+            self._close(discarded)
+        for retired in due:
+            self._close(retired)
+        return entry.client
+
+    def _retire(self, entry):
+        """移出槽位的客户端先保留，宽限期过后再关闭（调用方需持有 self._lock）"""
+        entry.retired_at = time.time()
+        self._retired.append(entry)
+
+    def _take_due_retired(self):
+        """取出宽限期已过的客户端（调用方需持有 self._lock）"""
+        cutoff = time.time() - self.retire_grace_seconds
+        due = [entry for entry in self._retired if entry.retired_at <= cutoff]
+        if due:
+            self._retired = [entry for entry in self._retired if entry.retired_at > cutoff]
+        return due
+
+    @staticmethod
+    def _close(entry):
+        if entry.closer is None:
+            return
+        try:
+            result = entry.closer()
+            if inspect.isawaitable(result):
+                _run_async_close(result)
+        except Exception:
+            pass
+
+    # —— OSS ——
+    def oss_bucket(self, access_key_id, access_key_secret, bucket_name, oss_endpoint):
+        """返回复用连接池的 oss2.Bucket"""
+        def factory():
+            bucket = oss2.Bucket(oss2.Auth(access_key_id, access_key_secret), oss_endpoint, bucket_name,
+                                 session=self._get_oss_session(), connect_timeout=self.timeout_seconds)
+            return bucket, None, bucket.get_bucket_info
+
+        return self._get(("oss", oss_endpoint, bucket_name),
+                         _fingerprint(access_key_id, access_key_secret), factory)
+
+    def _get_oss_session(self):
+        # 所有 Bucket 共享同一个 oss2.Session（内部是带连接池的 requests.Session）
+        if self._oss_session is None:
+            oss2.defaults.connection_pool_size = self.pool_size
+            self._oss_session = oss2.Session()
+        return self._oss_session
+
+    # —— 阿里云 imageprocess ——
+    def imageprocess_client(self, skin_analysis):
+        """返回复用的 DetectSkinDisease 客户端"""
+        access_key_id = skin_analysis.get('access_key_id')
+        access_key_secret = skin_analysis.get('access_key_secret')
+        endpoint = skin_analysis.get('endpoint', 'imageprocess.cn-shanghai.aliyuncs.com')
+
+        def factory():
+            config = open_api_models.Config(
+                access_key_id=access_key_id,
+                access_key_secret=access_key_secret,
+                max_idle_conns=self.pool_size,
+            )
+            config.endpoint = endpoint
+            return imageprocess20200320Client(config), None, None
+
+        return self._get(("imageprocess", endpoint),
+                         _fingerprint(access_key_id, access_key_secret), factory)
+
+    # —— DeepSeek（OpenAI 兼容接口）——
+    def openai_client(self, api_key, base_url):
+        """返回复用 httpx 连接池的 OpenAI 客户端"""
+        def factory():
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(600.0, connect=self.timeout_seconds),
+            )
+            # 重试统一由 resilience 模块负责，关闭 SDK 自带的重试，避免重试次数相乘
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            return client, client.close, client.models.list
+
+        return self._get(("openai", base_url), _fingerprint(api_key), factory)
+
+    def async_openai_client(self, api_key, base_url):
+        """返回复用 httpx 异步连接池的 AsyncOpenAI 客户端（供异步流水线使用）"""
+        def factory():
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(600.0, connect=self.timeout_seconds),
+            )
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            return client, client.close, None
+
+        return self._get(("async_openai", base_url), _fingerprint(api_key), factory)
+
+    # —— NVIDIA NIM 等普通 HTTP 接口 ——
+    def http_session(self):
+        """返回带连接池的 requests.Session"""
+        def factory():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            return session, session.close, None
+
+        return self._get(("http",), "", factory)
+
+    def async_http_client(self):
+        """返回带连接池的 httpx.AsyncClient（供异步流水线使用）"""
+        def factory():
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(30.0, connect=self.timeout_seconds),
+            )
+            return client, client.aclose, None
+
+        return self._get(("async_http",), "", factory)
+
+    # —— 连接预热 ——
+    def warm_oss(self, access_key_id, access_key_secret, bucket_name, oss_endpoint):
+        """对 bucket 域名发一个 HEAD 请求，提前建立 TCP/TLS 连接放入共享连接池（不关心返回的状态码）"""
+        bucket = self.oss_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+        scheme, host = bucket.endpoint.split("://", 1)
+        self._get_oss_session().session.head(f"{scheme}://{bucket_name}.{host}/", timeout=self.timeout_seconds)
+
+    def warm_openai(self, api_key, base_url):
+        """用一次模型列表请求建立到 DeepSeek 的连接"""
+        self.openai_client(api_key, base_url).models.list()
+
+    async def warm_openai_async(self, api_key, base_url):
+        await self.async_openai_client(api_key, base_url).models.list()
+
+    def warm_http(self, url):
+        """对 NIM 等接口发一个 HEAD 请求建立连接（接口只接受 POST 时返回 405，连接同样会保留）"""
+        self.http_session().head(url, timeout=self.timeout_seconds)
+
+    async def warm_http_async(self, url):
+        await self.async_http_client().head(url)
+
+    def invalidate(self, kind=None):
+        """移除指定类型（或全部）的客户端，下次取用时重建"""
+        with self._lock:
+            slots = [slot for slot in self._entries if kind is None or slot[0] == kind]
+            for slot in slots:
+                self._retire(self._entries.pop(slot))
+        return len(slots)
+
+    def health_check(self):
+        """探测所有已创建的客户端，返回 {槽位: 状态}，探测失败的客户端会被移除"""
+        with self._lock:
+            entries = list(self._entries.items())
+
+        report = {}
+        for slot, entry in entries:
+            name = ":".join(str(part) for part in slot)
+            if entry.probe is None:
+                report[name] = "ok (no probe)"
+                continue
+            try:
+                entry.probe()
+                report[name] = "ok"
+            except Exception as e:
+                report[name] = f"unhealthy: {e}"
+                with self._lock:
+                    if self._entries.get(slot) is entry:
+                        self._retire(self._entries.pop(slot))
+        return report
+
+    def _take_all(self):
+        with self._lock:
+            entries = list(self._entries.values()) + self._retired
+            self._entries.clear()
+            self._retired = []
+        return entries
+
+    def close_all(self):
+        """进程退出时关闭所有客户端（包括等待关闭的旧客户端）的连接池"""
+        for entry in self._take_all():
+            self._close(entry)
+
+    async def aclose_all(self):
+        """close_all() 的异步版本，在拥有异步客户端的事件循环中等待它们关闭完成"""
+        for entry in self._take_all():
+            if entry.closer is None:
+                continue
+            try:
+                result = entry.closer()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {":".join(str(part) for part in slot): round(now - entry.created_at, 1)
+                    for slot, entry in self._entries.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """返回进程级的客户端注册表（首次调用时按配置创建）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                options = logger_config.Config().get_client_pool()
+                _registry = ClientRegistry(
+                    pool_size=int(options.get('pool_size') or 32),
+                    max_age_seconds=int(options.get('max_age_seconds') or 0),
+                    timeout_seconds=int(options.get('timeout_seconds') or 30),
+                )
+    return _registry
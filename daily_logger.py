@@ -1,123 +1,287 @@
 # -*- coding: utf-8 -*-
 """
 日志管理模块
-自动创建按日期命名的日志文件，收集运行过程中的错误信息
+自动创建按日期滚动的日志文件，收集运行过程中的错误信息
+请求线程只把日志记录放入有界队列（QueueHandler），由专门的写入线程批量写文件和控制台：
+- 队列满时丢弃 WARNING 以下的新记录并计数，不阻塞请求线程；写入线程会补记一条丢弃数量的警告
+- WARNING 及以上的记录不丢弃：队列为它们预留了额外容量，预留容量也用完时短暂等待写入线程腾出空间
+- 每批记录写完后才 flush 一次，而不是每条记录 flush
+- 文件使用 TimedRotatingFileHandler 在午夜滚动，不再每次记录日志时检查日期、重建 logger
+- 文件格式可选文本（text）或每行一个 JSON 对象（json），控制台始终为文本
 """
 
+import atexit
+import functools
+import json
 import logging
 import os
+import queue
 import sys
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
+import threading
 import traceback
-import functools
+from datetime import datetime
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 未配置 logging 段时使用的默认值
+DEFAULT_OPTIONS = {
+    'log_dir': 'logger_log',
+    'filename': 'littleskin.log',
+    'level': 'DEBUG',
+    'file_format': 'text',
+    'console': True,
+    'backup_days': 30,
+    'queue_size': 10000,
+    'batch_size': 256,
+}
+
+# WARNING 及以上的记录在预留容量也用完时最多等待的秒数
+BLOCK_TIMEOUT = 1.0
+
+
+def _load_options():
+    """读取 config.yaml 的 logging 段；配置不可用时使用默认值，日志模块本身不能因配置出错而无法导入"""
+    options = dict(DEFAULT_OPTIONS)
+    try:
+        import logger_config
+        options.update(logger_config.Config().get_logging() or {})
+    except Exception as e:
+        print(f"[日志] 读取 logging 配置失败，使用默认配置: {e}")
+    return options
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON，便于日志平台按字段检索"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _BatchFlushMixin:
+    """flush() 推迟到整批记录写完后由写入线程调用 flush_batch()"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        # 进程退出时控制台流可能已先被关闭，与 logging.shutdown 一样忽略，写入线程不能因此退出
+        try:
+            super().flush()
+        except (OSError, ValueError):
+            pass
+
+
+class BatchStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchTimedRotatingFileHandler(_BatchFlushMixin, TimedRotatingFileHandler):
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列中的记录超过 capacity 时丢弃 WARNING 以下的记录并计数；在请求线程中只做必要的格式化"""
+
+    def __init__(self, log_queue, capacity, block_timeout=BLOCK_TIMEOUT):
+        super().__init__(log_queue)
+        self.capacity = capacity
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # 消息参数和异常堆栈在当前线程展开，写入线程不再引用调用方的对象
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno < logging.WARNING:
+            if self.queue.qsize() >= self.capacity:
+                self.dropped += 1
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            return
+        # 警告和错误使用 capacity 之外的预留容量，预留容量也满时短暂等待
+        try:
+            self.queue.put(record, timeout=self.block_timeout)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchQueueListener:
+    """写入线程：每次取出一批记录交给各处理器，整批写完后 flush 一次"""
+
+    _STOP = object()
+
+    def __init__(self, log_queue, handlers, batch_size=256, queue_handler=None):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = max(1, batch_size)
+        self.queue_handler = queue_handler
+        self._reported_dropped = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_dropped(self):
+        dropped = self.queue_handler.dropped if self.queue_handler is not None else 0
+        if dropped > self._reported_dropped:
+            record = logging.LogRecord("daily_logger", logging.WARNING, __file__, 0,
+                                       f"日志队列已满，丢弃了 {dropped - self._reported_dropped} 条日志（累计 {dropped} 条）",
+                                       None, None, "_report_dropped")
+            self._reported_dropped = dropped
+            self._handle(record)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._STOP:
+                    stopping = True
+                    continue
+                self._handle(record)
+            self._report_dropped()
+            for handler in self.handlers:
+                handler.flush_batch()
+
+    def stop(self):
+        """写完队列中剩余的记录后退出写入线程"""
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
 
 class DailyLogger:
-    """按日期管理的日志记录器"""
-    
-    def __init__(self, log_dir="logger_log"):
-        self.log_dir = log_dir
-        self.current_date = None
+    """按日期滚动的日志记录器，日志经队列交给后台线程写入"""
+
+    def __init__(self, log_dir=None, options=None):
+        self.options = options if options is not None else _load_options()
+        self.log_dir = log_dir or self.options['log_dir']
         self.logger = None
+        self.listener = None
+        self._queue_handler = None
         self._ensure_log_dir()
         self._setup_logger()
-    
+
     def _ensure_log_dir(self):
         """确保日志目录存在"""
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
             print(f"[日志] 创建日志目录: {self.log_dir}")
-    
-    def _get_current_date(self):
-        """获取当前日期字符串 YYYY-M-D 格式"""
-        now = datetime.now()
-        return f"{now.year}-{now.month}-{now.day}"
-    
-    def _get_log_filename(self, date_str):
-        """获取日志文件名"""
-        return os.path.join(self.log_dir, f"{date_str}.log")
-    
+
     def _setup_logger(self):
-        """设置日志记录器"""
-        current_date = self._get_current_date()
-        
-        # 如果日期变化，重新设置logger
-        if self.current_date != current_date:
-            self.current_date = current_date
-            
-            # 创建新的logger
-            logger_name = f"daily_logger_{current_date}"
-            self.logger = logging.getLogger(logger_name)
-            
-            # 清除之前的handlers
-            for handler in self.logger.handlers[:]:
-                self.logger.removeHandler(handler)
-            
-            self.logger.setLevel(logging.DEBUG)
-            
-            # 文件处理器
-            log_filename = self._get_log_filename(current_date)
-            file_handler = RotatingFileHandler(
-                log_filename, 
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5,
-                encoding='utf-8'
-            )
-            
-            # 控制台处理器
-            console_handler = logging.StreamHandler(sys.stdout)
-            
-            # 设置格式
-            formatter = logging.Formatter(
-                '%(asctime)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-            
-            file_handler.setFormatter(formatter)
-            console_handler.setFormatter(formatter)
-            
-            # 添加处理器
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
-            
-            # 防止重复日志
-            self.logger.propagate = False
-            
-            print(f"[日志] 日志文件: {log_filename}")
-    
-    def _check_date_change(self):
-        """检查日期是否变化，如果变化则重新设置logger"""
-        current_date = self._get_current_date()
-        if self.current_date != current_date:
-            self._setup_logger()
-    
-    def info(self, message):
+        """设置日志记录器：请求线程 -> 有界队列 -> 写入线程 -> 文件 / 控制台"""
+        text_formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+        # 文件处理器：午夜滚动为 <filename>.YYYY-MM-DD，保留 backup_days 天
+        log_filename = os.path.join(self.log_dir, self.options['filename'])
+        file_handler = BatchTimedRotatingFileHandler(
+            log_filename,
+            when='midnight',
+            backupCount=int(self.options['backup_days']),
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter() if self.options['file_format'] == 'json' else text_formatter)
+        handlers = [file_handler]
+
+        # 控制台处理器
+        if self.options['console']:
+            console_handler = BatchStreamHandler(sys.stdout)
+            console_handler.setFormatter(text_formatter)
+            handlers.append(console_handler)
+
+        # 队列总容量 = queue_size + 为 WARNING 及以上记录预留的容量
+        queue_size = int(self.options['queue_size'])
+        log_queue = queue.Queue(maxsize=queue_size + max(100, queue_size // 10))
+        self._queue_handler = DroppingQueueHandler(log_queue, queue_size)
+
+        self.logger = logging.getLogger("daily_logger")
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        self.logger.setLevel(getattr(logging, str(self.options['level']).upper(), logging.DEBUG))
+        self.logger.addHandler(self._queue_handler)
+        # 防止重复日志
+        self.logger.propagate = False
+
+        self.listener = BatchQueueListener(log_queue, handlers, int(self.options['batch_size']), self._queue_handler)
+        self.listener.start()
+        # 进程退出前写完队列中剩余的日志
+        atexit.register(self.close)
+
+        print(f"[日志] 日志文件: {log_filename}")
+
+    def close(self):
+        """停止写入线程并关闭文件"""
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+    def stats(self):
+        """队列中待写入的记录数和累计丢弃数"""
+        return {
+            'queue_depth': self._queue_handler.queue.qsize(),
+            'dropped': self._queue_handler.dropped,
+        }
+
+    # stacklevel 指向调用方，日志中的 module:funcName:lineno 是业务代码的位置而不是本模块
+    def info(self, message, stacklevel=2):
         """记录信息日志"""
-        self._check_date_change()
-        self.logger.info(message)
-    
-    def warning(self, message):
+        self.logger.info(message, stacklevel=stacklevel)
+
+    def warning(self, message, stacklevel=2):
         """记录警告日志"""
-        self._check_date_change()
-        self.logger.warning(message)
-    
-    def error(self, message, exc_info=None):
+        self.logger.warning(message, stacklevel=stacklevel)
+
+    def error(self, message, exc_info=None, stacklevel=2):
         """记录错误日志"""
-        self._check_date_change()
-        if exc_info:
-            self.logger.error(message, exc_info=exc_info)
-        else:
-            self.logger.error(message)
-    
-    def exception(self, message):
+        self.logger.error(message, exc_info=exc_info or None, stacklevel=stacklevel)
+
+    def exception(self, message, stacklevel=2):
         """记录异常日志（自动包含堆栈信息）"""
-        self._check_date_change()
-        self.logger.exception(message)
-    
-    def debug(self, message):
+        self.logger.exception(message, stacklevel=stacklevel)
+
+    def debug(self, message, stacklevel=2):
         """记录调试日志"""
-        self._check_date_change()
-        self.logger.debug(message)
+        self.logger.debug(message, stacklevel=stacklevel)
 
 # 全局日志实例
 daily_logger = DailyLogger()
@@ -134,9 +298,11 @@ def log_exceptions(func):
     return wrapper
 
 def log_function_call(func):
-    """装饰器：记录函数调用"""
+    """装饰器：记录函数调用（未开启 DEBUG 级别时不产生任何日志开销）"""
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        if not daily_logger.logger.isEnabledFor(logging.DEBUG):
+            return func(*args, **kwargs)
         daily_logger.debug(f"调用函数: {func.__name__}")
         try:
             result = func(*args, **kwargs)
@@ -150,33 +316,33 @@ def log_function_call(func):
 # 便捷函数
 def log_info(message):
     """记录信息日志"""
-    daily_logger.info(message)
+    daily_logger.info(message, stacklevel=3)
 
 def log_warning(message):
     """记录警告日志"""
-    daily_logger.warning(message)
+    daily_logger.warning(message, stacklevel=3)
 
 def log_error(message, exc_info=None):
     """记录错误日志"""
-    daily_logger.error(message, exc_info=exc_info)
+    daily_logger.error(message, exc_info=exc_info, stacklevel=3)
 
 def log_exception(message):
     """记录异常日志"""
-    daily_logger.exception(message)
+    daily_logger.exception(message, stacklevel=3)
 
 def log_debug(message):
     """记录调试日志"""
-    daily_logger.debug(message)
+    daily_logger.debug(message, stacklevel=3)
 
 if __name__ == "__main__":
     # 测试日志功能
     log_info("日志系统启动")
     log_debug("这是一个调试信息")
     log_warning("这是一个警告信息")
-    
+
     try:
         1 / 0
     except Exception as e:
         log_exception("测试异常捕获")
-    
+
     log_info("日志系统测试完成")
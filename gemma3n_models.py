@@ -1,6 +1,9 @@
-import re, sys, json, urllib.parse, requests
+import re, sys, json, urllib.parse, requests, httpx
 from skin_analysis import Sample
 import back_configuration as bc
+from client_registry import get_registry
+from resilience import get_resilience
+from tracing import get_tracer
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -50,15 +53,13 @@ def clean_json_string(json_str):
         # 如果清理失败，返回原始字符串
         return json_str
 
-def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens):
-    """
-    用 NVIDIA NIM 的 google/gemma-3n-e4b-it 模型生成 Chart.js 配置
-    """
+def build_nim_request(data, api_key, model_name, max_tokens):
+    """构造 NIM 请求的 headers 和 payload（同步和异步调用共用）"""
     prompt = f"""
 你是一个专业数据可视化专家。请根据以下数据内容，分析其数据特征（如类别数量、数值分布、对比关系等），
 推荐最适合的可视化图表类型（如雷达图、柱状图、饼图等），并自动选择合适的配色和对比度，使不同类别对比清晰。
 最后只输出适用于 Chart.js 的 config JSON（不要输出任何解释说明），config 要包含合适的 type、labels、datasets、options（如颜色、标题、legend等）。
-数据：{json.dumps(data, ensure_ascii=False, indent=2)}
+数据：{bc.prompt_compactor_instantiation().compact(data, "chart")}
 """
     stream = False
 
@@ -79,64 +80,125 @@ def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens)
         "presence_penalty": 0.0,
         "stream": stream
     }
+    return headers, payload
 
-    try:
-        response = requests.post(invoke_url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()  # 检查 HTTP 错误
-        
-        if not response.text:
-            raise Exception("API 返回空响应")
-            
-        result = response.json()
-        
-        # 添加更多的错误检查
-        if "choices" not in result or not result["choices"]:
-            raise Exception("API 响应中缺少 choices 字段")
-            
-        # 取出大模型返回的内容
-        content = result["choices"][0]["message"]["content"]
-
-        # 提取 config JSON，兼容多种输出格式
-        match = re.search(r"```json\s*(\{.*?\})\s*```", content, re.DOTALL)
+def parse_chart_config(response_text):
+    """从 NIM 的响应文本中提取 Chart.js 配置"""
+    if not response_text:
+        raise Exception("API 返回空响应")
+
+    result = json.loads(response_text)
+
+    # 添加更多的错误检查
+    if "choices" not in result or not result["choices"]:
+        raise Exception("API 响应中缺少 choices 字段")
+
+    # 取出大模型返回的内容
+    content = result["choices"][0]["message"]["content"]
+
+    # 提取 config JSON，兼容多种输出格式
+    match = re.search(r"```json\s*(\{.*?\})\s*```", content, re.DOTALL)
+    if match:
+        config_str = match.group(1)
+    else:
+        match = re.search(r"(\{.*\})", content, re.DOTALL)
         if match:
             config_str = match.group(1)
         else:
-            match = re.search(r"(\{.*\})", content, re.DOTALL)
-            if match:
-                config_str = match.group(1)
-            else:
-                raise ValueError("未能从大模型输出中提取到合法的 JSON 配置！原始内容：" + content)
-                
-        # 清理JSON字符串，处理重复键等问题
-        config_str = clean_json_string(config_str)
-        config = json.loads(config_str)
-        return config
-        
-    except requests.exceptions.RequestException as e:
-        # 导入日志模块并记录错误
+            raise ValueError("未能从大模型输出中提取到合法的 JSON 配置！原始内容：" + content)
+
+    # 清理JSON字符串，处理重复键等问题
+    config_str = clean_json_string(config_str)
+    config = json.loads(config_str)
+    return config
+
+def _log_nim_error(message, response_text=None):
+    try:
+        from daily_logger import log_error
+        log_error(f"Gemma3n{message}")
+        if response_text is not None:
+            log_error(f"Gemma3n API响应: {response_text}")
+    except:
+        print(message)
+        if response_text is not None:
+            print(f"API 响应: {response_text}")
+
+def trace_nim_response(span, response):
+    # 记录响应大小和 token 用量（响应中没有 usage 时只记录字节数）
+    span.set("bytes", len(response.content))
+    try:
+        body = response.json()
+    except ValueError:
+        return
+    usage = (body.get("usage") if isinstance(body, dict) else None) or {}
+    span.set("prompt_tokens", usage.get("prompt_tokens"))
+    span.set("completion_tokens", usage.get("completion_tokens"))
+
+def get_chart_config_from_nim(data, api_key, invoke_url, model_name, max_tokens):
+    """
+    用 NVIDIA NIM 的 google/gemma-3n-e4b-it 模型生成 Chart.js 配置
+    """
+    headers, payload = build_nim_request(data, api_key, model_name, max_tokens)
+    response = None
+
+    def post():
         try:
-            from daily_logger import log_error
-            log_error(f"Gemma3n网络请求错误: {str(e)}")
-        except:
-            print(f"网络请求错误: {str(e)}")
+            # 复用带连接池的 Session，避免每次请求重新握手
+            response = get_registry().http_session().post(invoke_url, headers=headers, json=payload, timeout=30)
+        except requests.exceptions.ConnectionError:
+            # 连接类错误时丢弃旧的 Session，重试时重建连接池
+            get_registry().invalidate('http')
+            raise
+        response.raise_for_status()  # 检查 HTTP 错误
+        return response
+
+    try:
+        # 网络错误、429、5xx 按退避策略重试，NIM 连续失败时熔断
+        with get_tracer().span("nim.chart_config", model=model_name, max_tokens=max_tokens) as span:
+            response = get_resilience().call("nim", post)
+            trace_nim_response(span, response)
+            return parse_chart_config(response.text)
+
+    except requests.exceptions.RequestException as e:
+        _log_nim_error(f"网络请求错误: {str(e)}")
         raise
     except json.JSONDecodeError as e:
-        try:
-            from daily_logger import log_error
-            log_error(f"Gemma3n JSON解析错误: {str(e)}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                log_error(f"Gemma3n API响应: {response.text}")
-        except:
-            print(f"JSON 解析错误: {str(e)}")
-            if 'response' in locals() and hasattr(response, 'text'):
-                print(f"API 响应: {response.text}")
+        _log_nim_error(f"JSON解析错误: {str(e)}", response.text if response is not None else None)
         raise
     except Exception as e:
+        _log_nim_error(f"模型调用发生错误: {str(e)}")
+        raise
+
+async def get_chart_config_from_nim_async(data, api_key, invoke_url, model_name, max_tokens):
+    """
+    get_chart_config_from_nim 的异步版本，使用 httpx.AsyncClient，等待期间不占用线程
+    """
+    headers, payload = build_nim_request(data, api_key, model_name, max_tokens)
+    response = None
+
+    async def post():
         try:
-            from daily_logger import log_error
-            log_error(f"Gemma3n模型调用发生错误: {str(e)}")
-        except:
-            print(f"发生错误: {str(e)}")
+            response = await get_registry().async_http_client().post(invoke_url, headers=headers, json=payload, timeout=30)
+        except httpx.TransportError:
+            get_registry().invalidate('async_http')
+            raise
+        response.raise_for_status()  # 检查 HTTP 错误
+        return response
+
+    try:
+        with get_tracer().span("nim.chart_config", model=model_name, max_tokens=max_tokens) as span:
+            response = await get_resilience().call_async("nim", post)
+            trace_nim_response(span, response)
+            return parse_chart_config(response.text)
+
+    except httpx.HTTPError as e:
+        _log_nim_error(f"网络请求错误: {str(e)}")
+        raise
+    except json.JSONDecodeError as e:
+        _log_nim_error(f"JSON解析错误: {str(e)}", response.text if response is not None else None)
+        raise
+    except Exception as e:
+        _log_nim_error(f"模型调用发生错误: {str(e)}")
         raise
 
 def generate_quickchart_url(config):
@@ -152,7 +214,12 @@ def gemma3n_skin_quickchartURL(data, api_key, invoke_url, model_name, max_tokens
     # 2. 生成 quickchart URL
     chart_url = generate_quickchart_url(config)
     return chart_url, config
-    
+
+async def gemma3n_skin_quickchartURL_async(data, api_key, invoke_url, model_name, max_tokens):
+    config = await get_chart_config_from_nim_async(data, api_key, invoke_url, model_name, max_tokens)
+    chart_url = generate_quickchart_url(config)
+    return chart_url, config
+
 if __name__ == '__main__':
     # 实例化基础配置
     api_key, invoke_url, model_name, max_tokens = bc.skin_data_visualization()
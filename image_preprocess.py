@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+图片预处理模块
+上传的原图（手机照片常见 5~10 MB）原样保存并上传到 OSS，既拖慢上传，也超过了皮肤分析实际需要的分辨率。
+这里在保存时只解码一次：
+- 按 EXIF 方向自动旋转（旋转后丢弃 EXIF，避免重复旋转，也不把拍摄信息上传出去）
+- 长宽比过大时居中裁剪，长边超过 max_side 时等比缩小（不放大）
+- 重新编码为 JPEG / WebP，质量可配置
+未安装 Pillow 或图片无法解码时，退化为原样复制。
+"""
+
+import os
+import time
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未安装时只做原样复制
+    Image = None
+    ImageOps = None
+
+# 输出格式对应的扩展名
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class ImagePreprocessor:
+    """上传前的图片预处理"""
+
+    def __init__(self, enabled=True, max_side=1024, max_aspect_ratio=0.0, output_format="JPEG", quality=85):
+        self.enabled = enabled and Image is not None
+        self.max_side = max_side
+        self.max_aspect_ratio = max_aspect_ratio
+        self.output_format = output_format.upper() if output_format.upper() in FORMAT_EXTENSIONS else "JPEG"
+        self.quality = quality
+
+    def _crop(self, img):
+        """长宽比超过上限时居中裁剪"""
+        if not self.max_aspect_ratio:
+            return img
+        width, height = img.size
+        if width >= height and width > height * self.max_aspect_ratio:
+            new_width = int(height * self.max_aspect_ratio)
+            left = (width - new_width) // 2
+            return img.crop((left, 0, left + new_width, height))
+        if height > width and height > width * self.max_aspect_ratio:
+            new_height = int(width * self.max_aspect_ratio)
+            top = (height - new_height) // 2
+            return img.crop((0, top, width, top + new_height))
+        return img
+
+    def _flatten(self, img):
+        """JPEG 不支持透明通道，透明区域铺白底"""
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            return background
+        if img.mode != "RGB":
+            return img.convert("RGB")
+        return img
+
+    def encode(self, src_path):
+        """解码并处理图片，返回 (编码后的字节, 扩展名, 统计信息)；无法处理时返回 None"""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        try:
+            with Image.open(src_path) as original:
+                original_size = original.size
+                img = ImageOps.exif_transpose(original)
+                img = self._crop(img)
+                if max(img.size) > self.max_side:
+                    img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                img = self._flatten(img)
+
+                buffer = BytesIO()
+                save_options = {"quality": self.quality}
+                if self.output_format == "JPEG":
+                    save_options.update(optimize=True, progressive=True)
+                else:
+                    save_options.update(method=4)
+                img.save(buffer, self.output_format, **save_options)
+                data = buffer.getvalue()
+        except Exception:
+            return None
+
+        stats = {
+            "original_bytes": os.path.getsize(src_path),
+            "output_bytes": len(data),
+            "original_size": original_size,
+            "output_size": img.size,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        return data, FORMAT_EXTENSIONS[self.output_format], stats
+
+    def prepare(self, src_path):
+        """在内存中完成预处理，返回 (图片字节, 扩展名, 统计信息)，不写本地文件"""
+        encoded = self.encode(src_path)
+        if encoded is not None:
+            data, extension, stats = encoded
+            # 原图已经足够小且无需缩放时，保留原图
+            if stats["output_bytes"] < stats["original_bytes"] or stats["output_size"] != stats["original_size"]:
+                stats["preprocessed"] = True
+                return data, extension, stats
+
+        with open(src_path, 'rb') as f:
+            data = f.read()
+        extension = os.path.splitext(src_path)[1] or '.png'
+        return data, extension, {"original_bytes": len(data), "output_bytes": len(data), "preprocessed": False}
+
+    def process(self, src_path, dest_base):
+        """把 src_path 处理后写到 dest_base + 扩展名，返回 (目标路径, 统计信息)"""
+        data, extension, stats = self.prepare(src_path)
+        dest_path = dest_base + extension
+        with open(dest_path, 'wb') as f:
+            f.write(data)
+        return dest_path, stats
+
+
+def create_image_preprocessor(options):
+    """根据配置字典创建预处理器"""
+    options = options or {}
+    return ImagePreprocessor(
+        enabled=bool(options.get('enabled', True)),
+        max_side=int(options.get('max_side') or 1024),
+        max_aspect_ratio=float(options.get('max_aspect_ratio') or 0),
+        output_format=str(options.get('format') or 'JPEG'),
+        quality=int(options.get('quality') or 85),
+    )
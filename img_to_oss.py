@@ -1,25 +1,168 @@
 
-import oss2, sys
+import sys, os, asyncio, hashlib, threading, time, uuid
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+from oss2.models import PartInfo
 
 import back_configuration as bc
+from client_registry import get_registry
+from resilience import get_resilience
+from storage_retention import storage_metrics
+from tracing import get_tracer
 
 sys.stdout.reconfigure(encoding='utf-8')
 
+# 已上传对象的签名URL缓存：同一对象的URL仍有效时直接复用，不重新签名，也不重新上传
+class SignedUrlCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, oss_object_name, min_remaining_seconds):
+        with self._lock:
+            entry = self._entries.get(oss_object_name)
+            # 剩余有效期不足以完成一次分析时不再复用
+            if entry is None or entry[1] - time.time() < min_remaining_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(oss_object_name)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, oss_object_name, url, expires_at):
+        with self._lock:
+            self._entries[oss_object_name] = (url, expires_at)
+            self._entries.move_to_end(oss_object_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, oss_object_name):
+        with self._lock:
+            self._entries.pop(oss_object_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+signed_url_cache = SignedUrlCache()
+
+# 生成对象的访问URL：public 为公共读地址；signed 为本地计算的签名URL，bucket 可以保持私有
+def object_url(bucket, bucket_name, oss_endpoint, oss_object_name, url_mode='public', url_expires=300):
+    if url_mode == 'signed':
+        # sign_url 只在本地计算签名，不产生额外的网络请求
+        signed_url = bucket.sign_url('GET', oss_object_name, url_expires, slash_safe=True)
+        # endpoint 未写协议时 oss2 生成 http 地址；签名不包含协议，统一换成 https
+        if signed_url.startswith('http://'):
+            signed_url = 'https://' + signed_url[len('http://'):]
+        return signed_url
+    return f'https://{bucket_name}.{oss_endpoint}/{oss_object_name}'
+
+# 从URL（公共读地址或签名URL）中取出对象名
+def object_name_from_url(oss_url):
+    return unquote(urlsplit(oss_url).path).lstrip('/')
+
 # 将上传的图片路径储存到OSS对应的bucket中，然后转换为URL
-def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, local_img_path):
-    # 上传
-    auth = oss2.Auth(access_key_id, access_key_secret)
-    bucket = oss2.Bucket(auth, oss_endpoint, bucket_name)
+def file_paths_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, local_img_path,
+                       url_mode='public', url_expires=300):
+    # 上传（复用注册表中的 Bucket 和连接池）
+    bucket = get_registry().oss_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
 
     # 将Windows路径分隔符转换为正斜杠，用于OSS对象名
     oss_object_name = local_img_path.replace('\\', '/')
-    with open(local_img_path, 'rb') as fileobj:
-        bucket.put_object(oss_object_name, fileobj)
 
-    # 拼接公网URL
-    oss_url = f'https://{bucket_name}.{oss_endpoint}/{oss_object_name}'
+    def upload():
+        # 每次重试都重新打开文件，保证从头上传
+        with open(local_img_path, 'rb') as fileobj:
+            bucket.put_object(oss_object_name, fileobj)
+
+    # 网络抖动、5xx 时按退避策略重试，OSS 连续失败时熔断
+    with get_tracer().span("oss.upload", bytes=os.path.getsize(local_img_path)):
+        get_resilience().call("oss", upload)
+
+    # 拼接公网URL或生成签名URL
+    return object_url(bucket, bucket_name, oss_endpoint, oss_object_name, url_mode, url_expires)
+
+# 按图片内容生成OSS对象名，同一张图片重复上传时对象名不变
+# unique=True 时追加随机后缀：分析后立即删除对象的模式下，同一张图片的并发分析各用各的对象，
+# 一次分析结束删除对象时不会影响另一次仍在读取该对象的分析
+def content_object_name(image_data, extension, prefix='uploads', unique=False):
+    name = hashlib.sha256(image_data).hexdigest()
+    if unique:
+        name = f"{name}-{uuid.uuid4().hex[:12]}"
+    return f"{prefix.strip('/')}/{name}{extension}" if prefix else f"{name}{extension}"
+
+# 直接从内存上传图片字节，不经过本地文件；大文件使用分片上传
+def upload_bytes_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint, image_data, oss_object_name,
+                         multipart_threshold=10 * 1024 * 1024, part_size=2 * 1024 * 1024, headers=None,
+                         url_mode='public', url_expires=300, url_min_remaining=60):
+    # 签名模式下，同一对象已上传且签名URL仍有效时直接复用（对象名由内容决定，内容相同即对象相同）
+    if url_mode == 'signed':
+        cached_url = signed_url_cache.get(oss_object_name, url_min_remaining)
+        if cached_url is not None:
+            return cached_url
+
+    bucket = get_registry().oss_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+
+    # headers 中可以带上对象标签（x-oss-tagging），供生命周期规则清理
+    multipart = len(image_data) > multipart_threshold
+    with get_tracer().span("oss.upload", bytes=len(image_data), multipart=multipart):
+        if multipart:
+            _multipart_upload(bucket, oss_object_name, image_data, part_size, headers)
+        else:
+            get_resilience().call("oss", bucket.put_object, oss_object_name, image_data, headers=headers)
+    storage_metrics.incr("oss_uploaded")
+    storage_metrics.incr("oss_uploaded_bytes", len(image_data))
+
+    oss_url = object_url(bucket, bucket_name, oss_endpoint, oss_object_name, url_mode, url_expires)
+    if url_mode == 'signed':
+        signed_url_cache.set(oss_object_name, oss_url, time.time() + url_expires)
     return oss_url
 
+def _multipart_upload(bucket, oss_object_name, image_data, part_size, headers=None):
+    # 每个分片单独按退避策略重试，失败时只重传该分片；最终失败则中止上传，不留下碎片
+    resilience = get_resilience()
+    upload_id = resilience.call("oss", bucket.init_multipart_upload, oss_object_name, headers=headers).upload_id
+    try:
+        parts = []
+        for part_number, offset in enumerate(range(0, len(image_data), part_size), start=1):
+            chunk = image_data[offset:offset + part_size]
+            result = resilience.call("oss", bucket.upload_part, oss_object_name, upload_id, part_number, chunk)
+            parts.append(PartInfo(part_number, result.etag, size=len(chunk)))
+        resilience.call("oss", bucket.complete_multipart_upload, oss_object_name, upload_id, parts)
+    except Exception:
+        try:
+            bucket.abort_multipart_upload(oss_object_name, upload_id)
+        except Exception:
+            pass
+        raise
+
+# 异步版本：oss2 没有原生的异步接口，放到线程池中执行，不阻塞事件循环
+async def upload_bytes_oss_url_async(access_key_id, access_key_secret, bucket_name, oss_endpoint, image_data, oss_object_name,
+                                     **upload_options):
+    return await asyncio.to_thread(upload_bytes_oss_url, access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                   image_data, oss_object_name, **upload_options)
+
+# 分析完成后按保留策略处理上传的对象（删除或改标签）
+def release_oss_object(access_key_id, access_key_secret, bucket_name, oss_endpoint, oss_url, retention):
+    # 只处理本 bucket 的对象（公共读地址和签名URL的域名相同）
+    if not oss_url or urlsplit(oss_url).netloc != f'{bucket_name}.{oss_endpoint}':
+        return "skipped"
+    oss_object_name = object_name_from_url(oss_url)
+    bucket = get_registry().oss_bucket(access_key_id, access_key_secret, bucket_name, oss_endpoint)
+    try:
+        action = get_resilience().call("oss", retention.release, bucket, oss_object_name)
+    except Exception:
+        storage_metrics.incr("oss_release_failed")
+        raise
+    if action == "deleted":
+        # 对象已删除，缓存的签名URL不能再复用
+        signed_url_cache.discard(oss_object_name)
+    return action
+
 
 if __name__ == "__main__":
     local_img_path = r'D:\桌面\second_sky_hackathon\images\uploaded_20250708_215208_f90973ff.png'
@@ -1,16 +1,153 @@
 # -*- coding: utf-8 -*-
+"""
+配置加载模块
+config.yaml 在进程启动时加载、校验一次，保存为不可变的快照；Config() 只读取内存中的快照，
+请求处理路径上不再打开和解析 YAML 文件。
+- 环境变量覆盖：LITTLESKIN__<SECTION>__<KEY>=value，例如 LITTLESKIN__DEEPSEEK_API__API_KEY=sk-xxx，
+  值按 YAML 语法解析（数字、布尔值会自动转换）
+- 热更新：后台线程定期检查 config.yaml 的修改时间，变化后重新加载、校验，校验通过才整体替换快照，
+  校验失败则保留旧快照
+"""
 import yaml
 import os
+import threading
+from types import MappingProxyType
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yaml')
+ENV_PREFIX = 'LITTLESKIN__'
 
-def load_config():
-    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+# 启动时必须存在的配置段
+REQUIRED_SECTIONS = (
+    'skin_analysis_main_configuration',
+    'img_to_oss',
+    'skin_analysis',
+    'deepseek_api',
+    'gemma3n_api',
+    'front_end_configuration',
+)
+
+def load_config(path=CONFIG_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f)
 
+def apply_env_overrides(config, environ=None):
+    """用 LITTLESKIN__SECTION__KEY 形式的环境变量覆盖配置项"""
+    environ = os.environ if environ is None else environ
+    for name, raw_value in environ.items():
+        if not name.startswith(ENV_PREFIX):
+            continue
+        keys = [part.lower() for part in name[len(ENV_PREFIX):].split('__') if part]
+        if not keys:
+            continue
+        node = config
+        for key in keys[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            node = node[key]
+        node[keys[-1]] = yaml.safe_load(raw_value) if raw_value != '' else None
+    return config
+
+def validate_config(config):
+    """校验配置结构，结构错误时抛出 ValueError"""
+    if not isinstance(config, dict):
+        raise ValueError("config.yaml 顶层必须是字典")
+    missing = [section for section in REQUIRED_SECTIONS if section not in config]
+    if missing:
+        raise ValueError(f"config.yaml 缺少配置段: {', '.join(missing)}")
+    for section, value in config.items():
+        if value is not None and not isinstance(value, dict):
+            raise ValueError(f"配置段 {section} 必须是字典")
+    return config
+
+def _freeze(value):
+    """把配置递归转换为只读结构，防止调用方修改共享快照"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+class ConfigStore:
+    """持有当前配置快照，并负责热更新"""
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self.reload_count = 0
+        self.last_error = None
+        self._mtime = None
+        self._watcher = None
+        self._stop = threading.Event()
+        self._reload_lock = threading.Lock()
+        self._snapshot = self._build()
+
+    def _build(self):
+        mtime = os.path.getmtime(self.path)
+        config = validate_config(apply_env_overrides(load_config(self.path) or {}))
+        # 空配置段统一替换为空字典，方便调用方直接 .get()
+        config = {section: (value if value is not None else {}) for section, value in config.items()}
+        self._mtime = mtime
+        return _freeze(config)
+
+    def snapshot(self):
+        """返回当前配置快照（只读，纯内存访问）"""
+        return self._snapshot
+
+    def reload(self):
+        """重新加载配置，校验通过后原子替换快照；返回是否替换成功"""
+        with self._reload_lock:
+            try:
+                snapshot = self._build()
+            except Exception as e:
+                self.last_error = str(e)
+                return False
+            self._snapshot = snapshot
+            self.reload_count += 1
+            self.last_error = None
+            return True
+
+    def reload_if_changed(self):
+        """配置文件修改时间变化时重新加载"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        return self.reload()
+
+    def start_watcher(self, interval_seconds=2.0, on_reload=None):
+        """启动后台线程轮询配置文件修改时间，变化后热更新"""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval_seconds):
+                previous_error = self.last_error
+                if self.reload_if_changed():
+                    if on_reload:
+                        on_reload(True, None)
+                elif self.last_error and self.last_error != previous_error and on_reload:
+                    on_reload(False, self.last_error)
+
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+# 进程级配置存储：导入时加载并校验一次，配置有误时启动即失败
+config_store = ConfigStore()
+
+def start_config_watcher(on_reload=None):
+    """按 config_reload 配置段启动热更新"""
+    options = config_store.snapshot().get('config_reload', {})
+    if options.get('enabled', True):
+        config_store.start_watcher(float(options.get('interval_seconds') or 2.0), on_reload)
+
 class Config:
     def __init__(self):
-        self._config = load_config()
+        # 只取内存中的快照，不访问磁盘
+        self._config = config_store.snapshot()
 
     def get_main_configuration(self):
         return self._config.get('skin_analysis_main_configuration', {})
@@ -20,12 +157,57 @@ class Config:
 
     def get_skin_analysis(self):
         return self._config.get('skin_analysis', {})
-    
+
     def get_deepseek_api(self):
         return self._config.get('deepseek_api', {})
-    
+
     def get_gemma3n_api(self):
         return self._config.get('gemma3n_api', {})
-    
+
     def get_front_end(self):
         return self._config.get('front_end_configuration', {})
+
+    def get_result_cache(self):
+        return self._config.get('result_cache', {})
+
+    def get_stream_coalescing(self):
+        return self._config.get('stream_coalescing', {})
+
+    def get_client_pool(self):
+        return self._config.get('client_pool', {})
+
+    def get_pipeline(self):
+        return self._config.get('pipeline', {})
+
+    def get_rate_limit(self):
+        return self._config.get('rate_limit', {})
+
+    def get_resilience(self):
+        return self._config.get('resilience', {})
+
+    def get_image_preprocess(self):
+        return self._config.get('image_preprocess', {})
+
+    def get_storage_retention(self):
+        return self._config.get('storage_retention', {})
+
+    def get_batch_analysis(self):
+        return self._config.get('batch_analysis', {})
+
+    def get_prompt_compaction(self):
+        return self._config.get('prompt_compaction', {})
+
+    def get_chart_builder(self):
+        return self._config.get('chart_builder', {})
+
+    def get_chart_render(self):
+        return self._config.get('chart_render', {})
+
+    def get_tracing(self):
+        return self._config.get('tracing', {})
+
+    def get_logging(self):
+        return self._config.get('logging', {})
+
+    def get_reasoning_cache(self):
+        return self._config.get('reasoning_cache', {})
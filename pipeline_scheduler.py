@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+分析流水线调度模块
+一次提交会扇出为 皮肤分析 -> {DeepSeek推理, 图表生成} 三个阶段，每个阶段的下游服务都有各自的限额
+（阿里云公测版的速率/并发、NIM 配额、DeepSeek 并发）。这里为每个阶段维护独立的并发槽位：
+- max_workers: 阶段内同时执行的任务数上限
+- max_queue:   允许排队等待的任务数上限，超过后直接拒绝（背压），而不是无限堆积
+- acquire_timeout: 排队等待的最长时间
+同步（线程）和异步（协程）调用方在同一个先进先出的等待队列中排队，槽位释放时按顺序直接交给下一个等待者。
+并统计每个阶段的执行数、排队数、拒绝数和排队耗时，用于按目标 QPS 规划部署规模。
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+
+class StageBusyError(Exception):
+    """阶段已满（排队已满或等待超时）"""
+    # 本地排队已满，重试只会加重拥塞
+    retryable = False
+
+    def __init__(self, stage_name, reason):
+        super().__init__(f"阶段 {stage_name} 繁忙: {reason}")
+        self.stage_name = stage_name
+        self.reason = reason
+
+
+class _ThreadWaiter:
+    """在线程中阻塞等待槽位"""
+
+    def __init__(self):
+        self.granted = False
+        self._event = threading.Event()
+
+    def wake(self):
+        self._event.set()
+        return True
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+
+
+class _AsyncWaiter:
+    """在事件循环中等待槽位，释放槽位的线程通过 call_soon_threadsafe 唤醒"""
+
+    def __init__(self):
+        self.granted = False
+        self._loop = asyncio.get_running_loop()
+        self.future = self._loop.create_future()
+
+    def wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # 事件循环已关闭，该等待者不会再取走槽位
+            return False
+        return True
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Stage:
+    """单个阶段的并发槽位与统计"""
+
+    def __init__(self, name, max_workers=4, max_queue=16, acquire_timeout=30.0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.acquire_timeout = acquire_timeout
+
+        # 执行槽位：限制并发数，没有空闲槽位时按先后顺序排队
+        self._free_workers = max_workers
+        self._waiters = deque()
+        # 准入槽位：执行中 + 排队中 的总数上限，满了直接拒绝
+        self._admission = threading.BoundedSemaphore(max_workers + max_queue)
+
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _admit(self):
+        if not self._admission.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise StageBusyError(self.name, "排队已满")
+        with self._lock:
+            self.waiting += 1
+
+    def _acquire_worker(self, waiter):
+        """有空闲槽位且没有更早的等待者时直接占用，否则加入等待队列；返回是否已占用"""
+        with self._lock:
+            if self._free_workers > 0 and not self._waiters:
+                self._free_workers -= 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _settle(self, waiter):
+        """等待结束（被唤醒、超时或被取消）后确认结果：已分到槽位返回 True，否则退出等待队列"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            return False
+
+    def _release_worker(self):
+        """归还槽位：直接交给最早的等待者，没有等待者时放回空闲槽位"""
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.wake():
+                    waiter.granted = True
+                    return
+            self._free_workers += 1
+
+    def _timed_out(self):
+        self._admission.release()
+        with self._lock:
+            self.rejected += 1
+        raise StageBusyError(self.name, f"等待超过{self.acquire_timeout}秒")
+
+    def _started(self, wait):
+        with self._lock:
+            self.active += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def _finished(self, succeeded):
+        with self._lock:
+            self.active -= 1
+            if succeeded:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self._release_worker()
+        self._admission.release()
+
+    @contextmanager
+    def slot(self):
+        """占用一个执行槽位，阶段已满时抛出 StageBusyError"""
+        self._admit()
+        enqueued_at = time.monotonic()
+        waiter = _ThreadWaiter()
+        try:
+            acquired = self._acquire_worker(waiter)
+            if not acquired:
+                waiter.wait(self.acquire_timeout)
+                acquired = self._settle(waiter)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            self._timed_out()
+
+        wait = time.monotonic() - enqueued_at
+        self._started(wait)
+        succeeded = False
+        try:
+            yield wait
+            succeeded = True
+        finally:
+            self._finished(succeeded)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """slot() 的异步版本，与同步调用共享同一组限额和等待队列；排队时让出事件循环，协程被取消时不会泄漏槽位"""
+        self._admit()
+        enqueued_at = time.monotonic()
+        waiter = _AsyncWaiter()
+        try:
+            acquired = self._acquire_worker(waiter)
+            if not acquired:
+                try:
+                    await asyncio.wait_for(waiter.future, self.acquire_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                acquired = self._settle(waiter)
+        except BaseException:
+            # 被取消时可能已经分到了槽位，交给下一个等待者
+            if self._settle(waiter):
+                self._release_worker()
+            self._admission.release()
+            raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            self._timed_out()
+
+        wait = time.monotonic() - enqueued_at
+        self._started(wait)
+        succeeded = False
+        try:
+            yield wait
+            succeeded = True
+        finally:
+            self._finished(succeeded)
+
+    def run(self, fn, *args, **kwargs):
+        """在槽位中执行函数"""
+        with self.slot():
+            return fn(*args, **kwargs)
+
+    async def run_async(self, fn, *args, **kwargs):
+        """在槽位中执行协程函数"""
+        async with self.async_slot():
+            return await fn(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.failed + self.active
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queue_depth": self.waiting,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_seconds": round(self.total_wait / started, 4) if started else 0.0,
+                "max_wait_seconds": round(self.max_wait, 4),
+            }
+
+
+class PipelineScheduler:
+    """按名称管理各阶段"""
+
+    def __init__(self, stages):
+        self._stages = {stage.name: stage for stage in stages}
+
+    def stage(self, name):
+        return self._stages[name]
+
+    def run(self, name, fn, *args, **kwargs):
+        return self._stages[name].run(fn, *args, **kwargs)
+
+    async def run_async(self, name, fn, *args, **kwargs):
+        return await self._stages[name].run_async(fn, *args, **kwargs)
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self._stages.items()}
+
+
+# 默认阶段参数：分析阶段受阿里云公测并发限制，推理阶段是长时间的流式连接
+DEFAULT_STAGES = {
+    "analysis": {"max_workers": 2, "max_queue": 16, "acquire_timeout": 30},
+    "chart": {"max_workers": 4, "max_queue": 32, "acquire_timeout": 30},
+    "reasoning": {"max_workers": 16, "max_queue": 64, "acquire_timeout": 60},
+}
+
+
+def create_pipeline_scheduler(options):
+    """根据配置字典创建调度器"""
+    options = options or {}
+    stage_options = options.get('stages') or {}
+    stages = []
+    for name, defaults in DEFAULT_STAGES.items():
+        merged = dict(defaults)
+        merged.update(stage_options.get(name) or {})
+        stages.append(Stage(
+            name,
+            max_workers=int(merged['max_workers']),
+            max_queue=int(merged['max_queue']),
+            acquire_timeout=float(merged['acquire_timeout']),
+        ))
+    return PipelineScheduler(stages)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+图片预处理基准测试
+对比预处理前后的上传字节数；加 --upload 时实际上传到 OSS 测量上传耗时，
+加 --analyze 时再调用阿里云皮肤分析，测量 上传 + 分析 的端到端耗时。
+上传的对象放在 uploads/benchmark/ 前缀下（每次上传使用独立的对象名），测量结束后立即删除；
+进程异常退出时遗留的对象由后台清理线程按上传前缀清理。
+
+用法：
+    python preprocess_benchmark.py                 # 只比较字节数和预处理耗时
+    python preprocess_benchmark.py --upload        # 额外测量OSS上传耗时
+    python preprocess_benchmark.py --analyze       # 额外测量上传 + 皮肤分析的端到端耗时
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import back_configuration as bc
+import img_to_oss
+import logger_config
+from skin_analysis import Sample
+from storage_retention import OssRetention
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+# 基准测试上传的对象不与线上请求共用对象名，测量结束后直接删除
+BENCHMARK_PREFIX = 'benchmark'
+BENCHMARK_RETENTION = OssRetention(mode="delete")
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def measure(path, analyze):
+    """与线上相同地从内存上传（并可选分析）一张图片，返回耗时秒数；结束后删除上传的对象（不计入耗时）"""
+    with open(path, 'rb') as f:
+        image_data = f.read()
+    access_key_id, access_key_secret, bucket_name, oss_endpoint = bc.img_to_oss_url()
+    object_prefix = logger_config.Config().get_img_to_oss().get('object_prefix', 'uploads')
+    oss_object_name = img_to_oss.content_object_name(
+        image_data, os.path.splitext(path)[1].lower(), f"{object_prefix}/{BENCHMARK_PREFIX}", unique=True)
+    started = time.perf_counter()
+    oss_img_url = img_to_oss.upload_bytes_oss_url(access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                                  image_data, oss_object_name)
+    try:
+        if analyze:
+            Sample.main([], logger_config.Config().get_skin_analysis(), oss_img_url)
+        return time.perf_counter() - started
+    finally:
+        img_to_oss.release_oss_object(access_key_id, access_key_secret, bucket_name, oss_endpoint,
+                                      oss_img_url, BENCHMARK_RETENTION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片预处理基准测试")
+    parser.add_argument('--dir', default='image', help="测试图片所在目录")
+    parser.add_argument('--upload', action='store_true', help="实际上传到OSS，测量上传耗时")
+    parser.add_argument('--analyze', action='store_true', help="上传后调用皮肤分析，测量端到端耗时")
+    args = parser.parse_args()
+
+    preprocessor = bc.image_preprocess_instantiation()
+    paths = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        print(f"目录 {args.dir} 中没有图片")
+        return
+
+    network = args.upload or args.analyze
+    header = f"{'图片':<42}{'原始字节':>12}{'处理后字节':>12}{'压缩比':>8}{'预处理秒':>10}"
+    if network:
+        header += f"{'原图耗时':>10}{'处理后耗时':>12}"
+    print(header)
+
+    totals = {"original": 0, "output": 0, "preprocess": 0.0, "before": 0.0, "after": 0.0}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for index, path in enumerate(paths):
+            (output_path, stats), seconds = timed(
+                preprocessor.process, path, os.path.join(work_dir, f"bench_{index}"))
+            original_bytes = os.path.getsize(path)
+            output_bytes = stats["output_bytes"]
+            totals["original"] += original_bytes
+            totals["output"] += output_bytes
+            totals["preprocess"] += seconds
+
+            line = f"{os.path.basename(path):<42}{original_bytes:>12}{output_bytes:>12}" \
+                   f"{output_bytes / original_bytes:>8.2f}{seconds:>10.3f}"
+            if network:
+                before = measure(path, args.analyze)
+                # 处理后的耗时包含预处理本身
+                after = measure(output_path, args.analyze) + seconds
+                totals["before"] += before
+                totals["after"] += after
+                line += f"{before:>10.3f}{after:>12.3f}"
+            print(line)
+
+    print("-" * len(header))
+    print(f"合计: 原始 {totals['original']} 字节 -> 处理后 {totals['output']} 字节 "
+          f"({totals['output'] / totals['original']:.2%})，预处理总耗时 {totals['preprocess']:.3f} 秒")
+    if network:
+        label = "上传+分析" if args.analyze else "上传"
+        print(f"{label}总耗时: 原图 {totals['before']:.3f} 秒 -> 处理后 {totals['after']:.3f} 秒")
+
+
+if __name__ == '__main__':
+    main()
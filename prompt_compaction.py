@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+提示词压缩模块
+皮肤分析结果注入 NIM（图表）和 DeepSeek（推理）提示词之前，按各模型实际用到的字段做投影：
+- 每个目标（chart / reasoning）只保留配置的字段，例如图表只需要 results
+- 置信度按 decimals 保留小数位，可按 min_score / top_k 去掉低置信度的结果
+- 空值不输出；格式可选紧凑 JSON（json）或逐行 键=值（dense）
+- 每次压缩记录 压缩前（原先带缩进的完整 JSON）和压缩后的估算 token 数，并累计统计
+关闭 enabled 时输出原先的完整格式，便于对比两种提示词的回答质量
+（也可用环境变量 LITTLESKIN__PROMPT_COMPACTION__ENABLED=false 临时关闭）。
+"""
+
+import json
+import re
+import threading
+
+from daily_logger import log_info
+from skin_result import SkinResult
+
+# 各目标默认保留的字段
+DEFAULT_FIELDS = {
+    "chart": ("results",),
+    "reasoning": ("body_part", "image_quality", "image_type", "results"),
+}
+
+# 中日韩字符大多单独计为一个 token，其余字符按约 4 个字符一个 token 估算
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的 token 数（不依赖具体模型的分词器，用于前后对比）"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class CompactionMetrics:
+    """按目标累计压缩前后的估算 token 数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._targets = {}
+
+    def record(self, target, original_tokens, prompt_tokens):
+        with self._lock:
+            stats = self._targets.setdefault(target, {"requests": 0, "original_tokens": 0, "prompt_tokens": 0})
+            stats["requests"] += 1
+            stats["original_tokens"] += original_tokens
+            stats["prompt_tokens"] += prompt_tokens
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for target, stats in self._targets.items():
+                stats = dict(stats)
+                stats["saved_ratio"] = round(1 - stats["prompt_tokens"] / stats["original_tokens"], 3) \
+                    if stats["original_tokens"] else 0.0
+                snapshot[target] = stats
+            return snapshot
+
+
+# 全局统计实例
+compaction_metrics = CompactionMetrics()
+
+
+def full_prompt_data(value):
+    """压缩前的格式：完整字段、带缩进的 JSON"""
+    result = SkinResult.from_value(value)
+    data = result.to_dict() if result is not None else value
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+class PromptCompactor:
+    """把分析结果投影、压缩为注入提示词的文本"""
+
+    def __init__(self, enabled=True, output_format="json", decimals=3, min_score=0.0, top_k=0,
+                 fields=None, report=True):
+        self.enabled = enabled
+        self.output_format = output_format
+        self.decimals = decimals
+        self.min_score = min_score
+        self.top_k = top_k
+        self.fields = dict(DEFAULT_FIELDS)
+        self.fields.update({target: tuple(names) for target, names in (fields or {}).items()})
+        self.report = report
+
+    def _round(self, value):
+        return round(value, self.decimals) if isinstance(value, float) else value
+
+    def _project_results(self, results):
+        """按置信度从高到低排序，去掉低于 min_score 的结果，最多保留 top_k 个"""
+        items = sorted(results.items(), key=lambda item: item[1] if isinstance(item[1], (int, float)) else 0,
+                       reverse=True)
+        if self.min_score:
+            items = [(name, score) for name, score in items
+                     if not isinstance(score, (int, float)) or score >= self.min_score]
+        if self.top_k:
+            items = items[:self.top_k]
+        return {name: self._round(score) for name, score in items}
+
+    def project(self, result, target):
+        """只保留目标模型用到的字段，返回字典"""
+        projected = {}
+        for name in self.fields.get(target, DEFAULT_FIELDS["reasoning"]):
+            value = getattr(result, name, None)
+            if name in ("results", "results_english") and value:
+                value = self._project_results(value)
+            else:
+                value = self._round(value)
+            if value not in (None, "", {}, []):
+                projected[name] = value
+        # 模拟数据需要让模型知道
+        if result.is_mock:
+            projected["source"] = result.source
+        return projected
+
+    def render(self, projected):
+        if self.output_format == "dense":
+            lines = []
+            for name, value in projected.items():
+                if isinstance(value, dict):
+                    value = ",".join(f"{key}:{item}" for key, item in value.items())
+                lines.append(f"{name}={value}")
+            return "\n".join(lines)
+        return json.dumps(projected, ensure_ascii=False, separators=(',', ':'))
+
+    def compact(self, value, target):
+        """返回注入 target 模型提示词的分析结果文本"""
+        original = full_prompt_data(value)
+        result = SkinResult.from_value(value)
+        if not self.enabled or result is None:
+            text = original
+        else:
+            text = self.render(self.project(result, target))
+
+        original_tokens = estimate_tokens(original)
+        prompt_tokens = estimate_tokens(text)
+        compaction_metrics.record(target, original_tokens, prompt_tokens)
+        if self.report:
+            mode = "compact" if self.enabled else "full"
+            log_info(f"提示词数据({target}, {mode}): 估算 {original_tokens} -> {prompt_tokens} tokens，"
+                     f"累计统计: {compaction_metrics.snapshot().get(target)}")
+        return text
+
+
+def create_prompt_compactor(options):
+    """根据配置字典创建压缩器"""
+    options = options or {}
+    return PromptCompactor(
+        enabled=bool(options.get('enabled', True)),
+        output_format=str(options.get('format') or 'json'),
+        decimals=int(options.get('decimals') if options.get('decimals') is not None else 3),
+        min_score=float(options.get('min_score') or 0),
+        top_k=int(options.get('top_k') or 0),
+        fields=options.get('fields') or None,
+        report=bool(options.get('report', True)),
+    )
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+阿里云 DetectSkinDisease 调用限速模块
+公测版对速率和并发都有限制，盲目调用只会触发限流错误，再被当作普通失败反复重试，最后退化为模拟数据。
+- TokenBucket: 令牌桶限速，拿不到令牌的请求排队等待（有等待人数和等待时间上限），
+  上游返回限流错误时暂停发放令牌一段时间
+  - memory: 进程内令牌桶
+  - sqlite: 令牌桶状态保存在本地 SQLite 文件中，同一台机器上的多个进程共享同一个桶
+- SingleFlight: 相同键（图片内容哈希）的并发请求只发起一次上游调用，其余请求等待并共享结果
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+
+class RateLimitTimeout(Exception):
+    """等待令牌超时或等待人数已满"""
+    # 本地排队已满，重试只会加重拥塞
+    retryable = False
+
+    def __init__(self, name, reason):
+        super().__init__(f"限速器 {name} 繁忙: {reason}")
+        self.name = name
+        self.reason = reason
+
+
+class UpstreamThrottledError(Exception):
+    """上游服务返回了限流错误"""
+
+    def __init__(self, code, message=None):
+        super().__init__(f"上游限流: {code} {message or ''}".strip())
+        self.code = code
+
+
+class MemoryBucketState:
+    """进程内令牌桶状态"""
+
+    # 只在进程内加锁，不会长时间阻塞，异步调用方可以直接在事件循环中访问
+    blocking = False
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, name, rate, burst):
+        """尝试取一个令牌：成功返回 0，否则返回还需等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(name, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self._buckets[name] = (tokens - 1, now)
+                return 0.0
+            self._buckets[name] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def drain(self, name, rate, burst, cooldown_seconds):
+        """清空令牌并透支 cooldown_seconds 秒的补充量，期间不再发放令牌"""
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[name] = (-rate * cooldown_seconds, now)
+
+
+class SqliteBucketState:
+    """SQLite 令牌桶状态，多个进程通过文件锁（BEGIN IMMEDIATE）串行更新同一个桶"""
+
+    # 其他进程（例如批量分析任务）持有文件锁时最多阻塞 timeout 秒，异步调用方需要在线程池中访问
+    blocking = True
+
+    def __init__(self, path="cache/rate_limit.db"):
+        self.path = path
+        self._lock = threading.Lock()
+
+        state_dir = os.path.dirname(path)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+
+        # isolation_level=None 以便手动控制事务；timeout 是等待其他进程释放锁的时间
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _update(self, name, compute):
+        # 跨进程共享必须使用墙上时间
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                tokens, result = compute(row, now)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (name, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def take(self, name, rate, burst):
+        def compute(row, now):
+            tokens = float(burst) if row is None else \
+                min(float(burst), row[0] + max(0.0, now - row[1]) * rate)
+            if tokens >= 1:
+                return tokens - 1, 0.0
+            return tokens, (1 - tokens) / rate
+
+        return self._update(name, compute)
+
+    def drain(self, name, rate, burst, cooldown_seconds):
+        return self._update(name, lambda row, now: (-rate * cooldown_seconds, None))
+
+
+class TokenBucket:
+    """令牌桶限速器"""
+
+    def __init__(self, state, name="detect_skin_disease", rate_per_second=1.0, burst=2,
+                 acquire_timeout=30.0, max_waiting=64, throttle_cooldown_seconds=2.0):
+        self.state = state
+        self.name = name
+        self.rate = rate_per_second
+        self.burst = burst
+        self.acquire_timeout = acquire_timeout
+        self.max_waiting = max_waiting
+        self.throttle_cooldown_seconds = throttle_cooldown_seconds
+
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def _enter(self):
+        with self._lock:
+            if self.max_waiting and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise RateLimitTimeout(self.name, "等待人数已满")
+            self.waiting += 1
+
+    def _leave(self, wait, granted):
+        with self._lock:
+            self.waiting -= 1
+            if granted:
+                self.granted += 1
+                self.total_wait += wait
+            else:
+                self.rejected += 1
+
+    def _next_delay(self, deadline):
+        """取令牌；成功返回 None，否则返回下次尝试前的等待秒数，超时抛出 RateLimitTimeout"""
+        return self._delay_until(self.state.take(self.name, self.rate, self.burst), deadline)
+
+    async def _next_delay_async(self, deadline):
+        """_next_delay() 的异步版本，SQLite 状态在线程池中访问，等待文件锁时不阻塞事件循环"""
+        if self.state.blocking:
+            delay = await asyncio.to_thread(self.state.take, self.name, self.rate, self.burst)
+        else:
+            delay = self.state.take(self.name, self.rate, self.burst)
+        return self._delay_until(delay, deadline)
+
+    def _delay_until(self, delay, deadline):
+        if delay <= 0:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RateLimitTimeout(self.name, f"等待超过{self.acquire_timeout}秒")
+        return min(delay, remaining)
+
+    def acquire(self):
+        """阻塞直到拿到令牌，返回等待的秒数"""
+        self._enter()
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        granted = False
+        try:
+            while True:
+                delay = self._next_delay(deadline)
+                if delay is None:
+                    granted = True
+                    return time.monotonic() - started
+                time.sleep(delay)
+        finally:
+            self._leave(time.monotonic() - started, granted)
+
+    async def acquire_async(self):
+        """acquire() 的异步版本，排队时让出事件循环"""
+        self._enter()
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        granted = False
+        try:
+            while True:
+                delay = await self._next_delay_async(deadline)
+                if delay is None:
+                    granted = True
+                    return time.monotonic() - started
+                await asyncio.sleep(delay)
+        finally:
+            self._leave(time.monotonic() - started, granted)
+
+    def on_throttled(self):
+        """上游返回限流错误：暂停发放令牌，让排队的请求自然退避"""
+        with self._lock:
+            self.throttled += 1
+        self.state.drain(self.name, self.rate, self.burst, self.throttle_cooldown_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "waiting": self.waiting,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "avg_wait_seconds": round(self.total_wait / self.granted, 4) if self.granted else 0.0,
+            }
+
+
+class NullRateLimiter:
+    """未启用限速时使用的空实现"""
+
+    def acquire(self):
+        return 0.0
+
+    async def acquire_async(self):
+        return 0.0
+
+    def on_throttled(self):
+        pass
+
+    def stats(self):
+        return {"enabled": False}
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """相同键的并发调用合并为一次执行，其余调用方共享结果（或异常）"""
+
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """do() 的异步版本：上游调用在独立的任务中执行，发起者被取消时不影响其他等待者"""
+        with self._lock:
+            task = self._async_calls.get(key)
+            if task is None:
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                self._async_calls[key] = task
+                task.add_done_callback(lambda _: self._async_calls.pop(key, None))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls),
+            }
+
+
+def create_rate_limiter(options):
+    """根据配置字典创建限速器"""
+    options = options or {}
+    if not options.get('enabled', True):
+        return NullRateLimiter()
+
+    if options.get('backend', 'memory') == 'sqlite':
+        state = SqliteBucketState(options.get('sqlite_path') or "cache/rate_limit.db")
+    else:
+        state = MemoryBucketState()
+
+    return TokenBucket(
+        state,
+        rate_per_second=float(options.get('rate_per_second') or 1.0),
+        burst=int(options.get('burst') or 1),
+        acquire_timeout=float(options.get('acquire_timeout') or 30),
+        max_waiting=int(options.get('max_waiting') or 0),
+        throttle_cooldown_seconds=float(options.get('throttle_cooldown_seconds') or 0),
+    )
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+DeepSeek 回答缓存模块
+相同的皮肤分析结果加上常见问题（例如默认的“请分析我的皮肤状况”）每次都会触发一次几千 token 的 R1 生成。
+这里按精确匹配缓存完整的回答（推理过程、真实输出、双模型模式下的简要结论），键为以下内容的哈希：
+- 注入提示词的皮肤数据（与 prompt_compaction 压缩后的文本一致）
+- 规范化后的问题：去掉首尾空白和标点、合并连续空白、英文转小写
+- 提示词模板版本（system_prompt.txt 修改后版本变化，旧条目不再命中，并清空当前缓存）
+- R1 和快速模型的名称
+命中时由调用方把缓存的回答切成分片，按 replay_chars_per_second 的速度经同一个流式界面回放。
+存储复用 result_cache 的后端（memory / sqlite）、TTL 与 LRU 淘汰，并统计命中率。
+"""
+
+import hashlib
+import json
+import re
+import threading
+
+import result_cache
+from daily_logger import log_info
+from prompt_compaction import full_prompt_data
+from skin_result import SkinResult
+
+# 规范化问题时去掉的首尾标点
+_QUESTION_PUNCTUATION = " \t\r\n。！？!?.,，;；~～…"
+_WHITESPACE = re.compile(r'\s+')
+
+# 回放顺序：先简要结论，再推理过程，最后真实输出
+REPLAY_FIELDS = ("summary", "reasoning", "content")
+
+
+def normalize_question(question):
+    """问题的规范形式，只消除不影响语义的差异"""
+    return _WHITESPACE.sub(" ", (question or "").strip()).strip(_QUESTION_PUNCTUATION).lower()
+
+
+def replay_pieces(entry, chunk_chars):
+    """把缓存的回答切成 (字段, 文本) 分片，字段为 summary / reasoning / content"""
+    chunk_chars = max(1, chunk_chars)
+    for field in REPLAY_FIELDS:
+        text = entry.get(field) or ""
+        for offset in range(0, len(text), chunk_chars):
+            yield field, text[offset:offset + chunk_chars]
+
+
+class ReasoningCache:
+    """按 (皮肤数据, 问题, 提示词版本, 模型) 精确匹配的回答缓存"""
+
+    def __init__(self, cache, replay_chars_per_second=0, replay_chunk_chars=20):
+        self.cache = cache
+        self.replay_chars_per_second = replay_chars_per_second
+        self.replay_chunk_chars = replay_chunk_chars
+        self._version = None
+        self._lock = threading.Lock()
+
+    def check_version(self, template_version):
+        """提示词模板版本变化时清空缓存（旧版本的条目即使保留也不会再命中）"""
+        with self._lock:
+            changed = self._version is not None and self._version != template_version
+            self._version = template_version
+        if changed:
+            self.cache.clear()
+            log_info(f"提示词模板已更新为 {template_version}，清空DeepSeek回答缓存")
+
+    def key(self, skin_data, question, template_version, model_names, compactor):
+        """缓存键；模拟数据或无法识别的数据不缓存，返回 None"""
+        result = SkinResult.from_value(skin_data)
+        if result is None or result.is_mock:
+            return None
+        if compactor.enabled:
+            prompt_data = compactor.render(compactor.project(result, "reasoning"))
+        else:
+            prompt_data = full_prompt_data(result)
+        material = json.dumps([prompt_data, normalize_question(question), template_version, list(model_names)],
+                              ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    def set(self, key, entry):
+        if key is not None and entry.get("content"):
+            self.cache.set(key, entry)
+
+    def replay_delay(self, text):
+        """回放一个分片后的等待时间（秒），0 表示不等待"""
+        if self.replay_chars_per_second <= 0:
+            return 0.0
+        return len(text) / self.replay_chars_per_second
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def create_reasoning_cache(options):
+    """根据配置字典创建回答缓存，存储参数与 result_cache 相同"""
+    options = dict(options or {})
+    options.setdefault('sqlite_path', 'cache/reasoning_cache.db')
+    return ReasoningCache(
+        result_cache.create_result_cache(options),
+        replay_chars_per_second=float(options.get('replay_chars_per_second') or 0),
+        replay_chunk_chars=int(options.get('replay_chunk_chars') or 20),
+    )
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+外部服务调用的容错模块（OSS、阿里云 imageprocess、DeepSeek、NIM 共用）
+- RetryPolicy: 指数退避 + 随机抖动（full jitter），避免大量请求在同一时刻集中重试
+- classify_error: 按阿里云错误码 / HTTP 状态码 / 异常类型区分 限流、可重试、不可重试 三类错误，
+  参数错误、图片不合法、鉴权失败等重试也不会成功的错误直接返回
+- Deadline: 单次请求的总时间预算，预算不足以等待下一次退避时不再重试
+- CircuitBreaker: 连续失败达到阈值后熔断，熔断期间直接失败（上层走降级路径），
+  冷却后放行少量试探请求，成功则恢复
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+import logger_config
+from tracing import current_span
+
+# 错误分类
+THROTTLED = "throttled"
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+# 重试也不会成功的阿里云错误码前缀（参数、图片、鉴权类）
+FATAL_CODE_PREFIXES = (
+    "InvalidParameter", "InvalidImage", "InvalidFile", "InvalidUrl", "InvalidAccessKeyId",
+    "SignatureDoesNotMatch", "Forbidden", "MissingParameter", "Unauthorized", "NoPermission",
+)
+# 网络层异常的类名（requests / httpx / openai / oss2 / Tea SDK），不在此处导入这些库
+TRANSPORT_ERROR_NAMES = (
+    "ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout", "TimeoutException",
+    "TransportError", "RequestError", "APIConnectionError", "APITimeoutError", "RetryError",
+)
+
+
+class CircuitOpenError(Exception):
+    """服务处于熔断状态，请求被直接拒绝"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"服务 {name} 熔断中，{retry_after:.0f}秒后重试")
+        self.name = name
+        self.retry_after = retry_after
+        self.retryable = False
+
+
+class DeadlineExceeded(Exception):
+    """请求的时间预算已用完"""
+    retryable = False
+
+
+def _status_code(error):
+    """尽量从各种 SDK 的异常中取出 HTTP 状态码"""
+    for attr in ("status_code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    data = getattr(error, "data", None)
+    if isinstance(data, dict) and isinstance(data.get("statusCode"), int):
+        return data["statusCode"]
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(error):
+    """返回 THROTTLED / RETRYABLE / FATAL"""
+    # 异常可以通过 retryable 属性自行声明（例如本地排队已满、熔断中）
+    declared = getattr(error, "retryable", None)
+    if declared is not None:
+        return RETRYABLE if declared else FATAL
+
+    code = str(getattr(error, "code", "") or "")
+    if code.startswith("Throttling") or type(error).__name__ in ("UpstreamThrottledError", "RateLimitError"):
+        return THROTTLED
+    if code.startswith(FATAL_CODE_PREFIXES):
+        return FATAL
+
+    status = _status_code(error)
+    if status == 429:
+        return THROTTLED
+    if status is not None:
+        # oss2 的网络错误状态码为负数
+        if status < 0 or status >= 500 or status == 408:
+            return RETRYABLE
+        if 400 <= status < 500:
+            return FATAL
+
+    if isinstance(error, (ConnectionError, TimeoutError)) or \
+            any(cls.__name__ in TRANSPORT_ERROR_NAMES for cls in type(error).__mro__):
+        return RETRYABLE
+    # 其他异常（解析错误、本地代码的 AttributeError 等）重试也不会改变结果
+    return FATAL
+
+
+def is_service_response(error):
+    """异常是否携带服务端返回的错误码或状态码，即服务本身给出了响应"""
+    return bool(getattr(error, "code", None)) or _status_code(error) is not None
+
+
+class RetryPolicy:
+    """指数退避 + full jitter"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, multiplier=2.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def backoff(self, attempt):
+        """第 attempt 次（从0开始）失败后的等待时间"""
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        return random.uniform(0, ceiling)
+
+
+class Deadline:
+    """单次请求的时间预算"""
+
+    def __init__(self, budget_seconds=None):
+        self.expires_at = time.monotonic() + budget_seconds if budget_seconds else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded("请求时间预算已用完")
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._half_open_calls = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self):
+        """请求前调用，熔断中抛出 CircuitOpenError"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.monotonic() - self.opened_at
+                if elapsed < self.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+                self.state = self.HALF_OPEN
+                self._half_open_calls = 0
+            if self.state == self.HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout)
+                self._half_open_calls += 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def record_neutral(self):
+        """调用结果不能说明服务是否可用，归还半开状态的试探名额"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or \
+                    (self.failure_threshold and self.failures >= self.failure_threshold):
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+class ServiceResilience:
+    """单个外部服务的重试策略 + 熔断器"""
+
+    def __init__(self, name, policy, breaker):
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+
+    def _attempt_failed(self, error, attempt, deadline, on_throttled):
+        """记录一次失败；需要重试时返回等待秒数，否则返回 None"""
+        kind = classify_error(error)
+        if getattr(error, "retryable", None) is not None or kind == THROTTLED:
+            # 本地排队、熔断、限流都不代表服务故障，不计入熔断统计
+            self.breaker.record_neutral()
+        elif kind == FATAL:
+            if is_service_response(error):
+                # 服务能正常返回业务错误，说明服务本身可用
+                self.breaker.record_success()
+            else:
+                # 本地错误不能说明服务是否可用
+                self.breaker.record_neutral()
+        else:
+            self.breaker.record_failure()
+
+        if kind == FATAL:
+            return None
+        if kind == THROTTLED and on_throttled is not None:
+            on_throttled()
+        if attempt + 1 >= self.policy.max_attempts:
+            return None
+        delay = self.policy.backoff(attempt)
+        if deadline is not None and deadline.remaining() <= delay:
+            return None
+        with self._lock:
+            self.retries += 1
+        # 重试次数同时计入当前的追踪 Span（OSS上传、DeepSeek、NIM 调用）
+        current_span().incr("retries")
+        return delay
+
+    def call(self, fn, *args, deadline=None, on_throttled=None, **kwargs):
+        """按重试策略调用 fn；熔断中抛出 CircuitOpenError"""
+        with self._lock:
+            self.calls += 1
+        for attempt in range(self.policy.max_attempts):
+            if deadline is not None:
+                deadline.check()
+            self.breaker.allow()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                delay = self._attempt_failed(error, attempt, deadline, on_throttled)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, fn, *args, deadline=None, on_throttled=None, **kwargs):
+        """call() 的异步版本，fn 为协程函数"""
+        with self._lock:
+            self.calls += 1
+        for attempt in range(self.policy.max_attempts):
+            if deadline is not None:
+                deadline.check()
+            self.breaker.allow()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as error:
+                delay = self._attempt_failed(error, attempt, deadline, on_throttled)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            stats = {"calls": self.calls, "retries": self.retries}
+        stats.update(self.breaker.stats())
+        return stats
+
+
+# 各服务的默认参数
+DEFAULT_SERVICES = {
+    "oss": {"max_attempts": 3, "base_delay": 0.5, "max_delay": 4, "failure_threshold": 5, "recovery_timeout": 30},
+    "imageprocess": {"max_attempts": 3, "base_delay": 1.0, "max_delay": 8, "failure_threshold": 5, "recovery_timeout": 60},
+    "deepseek": {"max_attempts": 2, "base_delay": 1.0, "max_delay": 4, "failure_threshold": 5, "recovery_timeout": 30},
+    "nim": {"max_attempts": 2, "base_delay": 0.5, "max_delay": 4, "failure_threshold": 5, "recovery_timeout": 30},
+}
+
+
+class Resilience:
+    """按服务名管理重试策略与熔断器"""
+
+    def __init__(self, services, deadline_seconds=None):
+        self._services = services
+        self.deadline_seconds = deadline_seconds
+
+    def service(self, name):
+        return self._services[name]
+
+    def deadline(self):
+        """按配置的预算创建一个新的请求截止时间"""
+        return Deadline(self.deadline_seconds)
+
+    def call(self, name, fn, *args, **kwargs):
+        return self._services[name].call(fn, *args, **kwargs)
+
+    async def call_async(self, name, fn, *args, **kwargs):
+        return await self._services[name].call_async(fn, *args, **kwargs)
+
+    def stats(self):
+        return {name: service.stats() for name, service in self._services.items()}
+
+
+def create_resilience(options):
+    """根据配置字典创建各服务的容错策略"""
+    options = options or {}
+    service_options = options.get('services') or {}
+    services = {}
+    for name, defaults in DEFAULT_SERVICES.items():
+        merged = dict(defaults)
+        merged.update(service_options.get(name) or {})
+        services[name] = ServiceResilience(
+            name,
+            RetryPolicy(
+                max_attempts=int(merged['max_attempts']),
+                base_delay=float(merged['base_delay']),
+                max_delay=float(merged['max_delay']),
+            ),
+            CircuitBreaker(
+                name,
+                failure_threshold=int(merged['failure_threshold']),
+                recovery_timeout=float(merged['recovery_timeout']),
+            ),
+        )
+    return Resilience(services, float(options.get('deadline_seconds') or 0) or None)
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience():
+    """返回进程级的容错策略（首次调用时按配置创建）"""
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = create_resilience(logger_config.Config().get_resilience())
+    return _resilience
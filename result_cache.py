@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+皮肤分析结果缓存模块
+以图片内容哈希为键缓存 DetectSkinDisease 的分析结果，同一张图片重复提交时直接返回，
+跳过 OSS 上传和阿里云接口调用，节省公测版的调用配额。
+支持 TTL 过期、按条目数的 LRU 淘汰、命中/未命中统计，以及可插拔的存储后端：
+- memory: 进程内字典，进程重启后失效
+- sqlite: 磁盘上的 SQLite 文件，进程重启后依然有效
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_content_hash(image_path=None, data=None):
+    """计算图片内容的 SHA-256 哈希，作为缓存键（与文件名、上传时间无关）"""
+    hasher = hashlib.sha256()
+    if data is not None:
+        hasher.update(data)
+    else:
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+class MemoryBackend:
+    """进程内字典后端，按最近访问顺序做 LRU 淘汰"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (value, expires_at)，不存在时返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SqliteBackend:
+    """SQLite 磁盘后端，按 last_access 做 LRU 淘汰，值以 JSON 文本存储"""
+
+    def __init__(self, path="cache/skin_result_cache.db", max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+            )
+            # 超出容量时淘汰最久未访问的条目
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class ResultCache:
+    """带 TTL 与命中统计的结果缓存，具体存储交给后端"""
+
+    def __init__(self, backend, ttl_seconds=86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """命中返回缓存值，未命中或已过期返回 None"""
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > time.time():
+                self._count(hit=True)
+                return value
+            # 已过期，顺手清理
+            self.backend.delete(key)
+        self._count(hit=False)
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        self.backend.set(key, value, expires_at)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """返回命中统计信息"""
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self.backend),
+            }
+
+
+class NullCache:
+    """缓存关闭时使用的空实现，接口与 ResultCache 一致"""
+
+    hits = 0
+    misses = 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+
+
+def create_result_cache(options):
+    """根据配置字典创建缓存实例"""
+    options = options or {}
+    if not options.get('enabled', True):
+        return NullCache()
+
+    backend_name = options.get('backend', 'memory')
+    max_entries = int(options.get('max_entries') or 1024)
+    ttl_seconds = int(options.get('ttl_seconds') or 0)
+
+    if backend_name == 'sqlite':
+        backend = SqliteBackend(options.get('sqlite_path') or "cache/skin_result_cache.db", max_entries)
+    elif backend_name == 'memory':
+        backend = MemoryBackend(max_entries)
+    else:
+        raise ValueError(f"不支持的缓存后端: {backend_name}")
+
+    return ResultCache(backend, ttl_seconds)
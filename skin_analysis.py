@@ -3,27 +3,62 @@
 
 """
 from typing import List
-import json
 from alibabacloud_imageprocess20200320.client import Client as imageprocess20200320Client
 from alibabacloud_credentials.client import Client as CredentialClient
-from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_imageprocess20200320 import models as imageprocess_20200320_models
 from alibabacloud_tea_util import models as util_models
 from alibabacloud_tea_util.client import Client as UtilClient
 
 import back_configuration as bc
+from client_registry import get_registry
+from rate_limiter import UpstreamThrottledError
+from resilience import FATAL, classify_error
+from skin_result import SkinResult
+from tracing import get_tracer
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
 
 class Sample:
     @staticmethod
     def create_client(skin_analysis) -> imageprocess20200320Client:
-        config = open_api_models.Config(
-            access_key_id=skin_analysis.get('access_key_id'),
-            access_key_secret=skin_analysis.get('access_key_secret'),
+        # 客户端在进程内只构建一次，密钥变化时由注册表自动重建
+        return get_registry().imageprocess_client(skin_analysis)
+
+    @staticmethod
+    def create_request(skin_analysis, oss_img_url):
+        return imageprocess_20200320_models.DetectSkinDiseaseRequest(
+            url=oss_img_url,
+            org_id=skin_analysis.get('org_id'),
+            org_name=skin_analysis.get('org_name')
         )
-        config.endpoint = skin_analysis.get('endpoint', 'imageprocess.cn-shanghai.aliyuncs.com')
-        return imageprocess20200320Client(config)
+
+    @staticmethod
+    def format_response(response) -> SkinResult:
+        # 直接读取响应字段构建结果模型，不再递归转换为字典和带缩进的字符串
+        return SkinResult.from_sdk(response.body.data)
+
+    @staticmethod
+    def check_throttled(error) -> None:
+        # 公测版的限流错误单独抛出，由调用方按限速器退避，而不是当作普通失败
+        code = str(getattr(error, 'code', '') or '')
+        data = getattr(error, 'data', None)
+        status = data.get('statusCode') if isinstance(data, dict) else None
+        if code.startswith('Throttling') or status == 429:
+            raise UpstreamThrottledError(code or status, getattr(error, 'message', None)) from error
+
+    @staticmethod
+    def check_retryable(error) -> None:
+        # 限流和可重试的错误（网络、5xx）抛给调用方按重试策略处理，参数、图片等错误直接报告
+        Sample.check_throttled(error)
+        if classify_error(error) != FATAL:
+            raise error
+
+    @staticmethod
+    def report_error(error) -> None:
+        print(getattr(error, 'message', str(error)))
+        if hasattr(error, 'data') and error.data:
+            print(error.data.get("Recommend"))
+        UtilClient.assert_as_string(getattr(error, 'message', str(error)))
 
     @staticmethod
     def main(
@@ -32,34 +67,42 @@ class Sample:
         oss_img_url
     ) -> None:
         client = Sample.create_client(skin_analysis)
-        detect_skin_disease_request = imageprocess_20200320_models.DetectSkinDiseaseRequest(
-            url=oss_img_url,
-            org_id=skin_analysis.get('org_id'),
-            org_name=skin_analysis.get('org_name')
-        )
+        detect_skin_disease_request = Sample.create_request(skin_analysis, oss_img_url)
         runtime = util_models.RuntimeOptions()
-        try:
-            response = client.detect_skin_disease_with_options(detect_skin_disease_request, runtime)
-            # 格式化输出
-            def obj_to_dict(obj):
-                if isinstance(obj, dict):
-                    return {k: obj_to_dict(v) for k, v in obj.items()}
-                elif hasattr(obj, '__dict__'):
-                    return {k: obj_to_dict(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
-                elif isinstance(obj, list):
-                    return [obj_to_dict(i) for i in obj]
-                else:
-                    return obj
-
-            # 在打印前使用
-            skin_analysis_data = json.dumps(obj_to_dict(response.body.data), ensure_ascii=False, indent=2)
+        # 每次调用（包括外层的重试）各记录一个 Span
+        with get_tracer().span("imageprocess.detect_skin") as span:
+            try:
+                response = client.detect_skin_disease_with_options(detect_skin_disease_request, runtime)
+                result = Sample.format_response(response)
+                span.set("results", len(result.results))
+                return result
+            except Exception as error:
+                span.set("error_code", getattr(error, 'code', None))
+                span.fail(error)
+                Sample.check_retryable(error)
+                Sample.report_error(error)
 
-            return skin_analysis_data
-        except Exception as error:
-            print(getattr(error, 'message', str(error)))
-            if hasattr(error, 'data') and error.data:
-                print(error.data.get("Recommend"))
-            UtilClient.assert_as_string(getattr(error, 'message', str(error)))
+    @staticmethod
+    async def main_async(
+        args: List[str],
+        skin_analysis,
+        oss_img_url
+    ) -> None:
+        # 与 main 相同，但使用 SDK 的异步接口，等待期间不占用线程
+        client = Sample.create_client(skin_analysis)
+        detect_skin_disease_request = Sample.create_request(skin_analysis, oss_img_url)
+        runtime = util_models.RuntimeOptions()
+        with get_tracer().span("imageprocess.detect_skin") as span:
+            try:
+                response = await client.detect_skin_disease_with_options_async(detect_skin_disease_request, runtime)
+                result = Sample.format_response(response)
+                span.set("results", len(result.results))
+                return result
+            except Exception as error:
+                span.set("error_code", getattr(error, 'code', None))
+                span.fail(error)
+                Sample.check_retryable(error)
+                Sample.report_error(error)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+皮肤分析结果模型
+DetectSkinDisease 的结果在各环节之间统一使用 SkinResult 传递：
+- from_sdk: 直接读取 SDK 响应对象的字段，不再递归遍历对象再 json.dumps(indent=2) 成字符串
+- to_dict / from_value: 缓存中保存紧凑的字典；from_value 兼容旧缓存中的 JSON 字符串和 SDK 风格的键名
+真实结果和模拟数据使用同一个结构，下游不需要区分两种格式。
+"""
+
+import json
+
+# 结果来源
+SOURCE_ALIYUN = "aliyun"
+SOURCE_MOCK = "mock"
+
+# SDK / 旧格式的键名到规范键名的映射
+_LEGACY_KEYS = {
+    "BodyPart": "body_part",
+    "ImageQuality": "image_quality",
+    "ImageType": "image_type",
+    "Results": "results",
+    "ResultsEnglish": "results_english",
+}
+
+
+class SkinResult:
+    """一次皮肤分析的结果：results 为 {病症名称: 置信度}"""
+
+    __slots__ = ("body_part", "image_quality", "image_type", "results", "results_english", "source")
+
+    def __init__(self, body_part=None, image_quality=None, image_type=None, results=None,
+                 results_english=None, source=SOURCE_ALIYUN):
+        self.body_part = body_part
+        self.image_quality = image_quality
+        self.image_type = image_type
+        self.results = results or {}
+        self.results_english = results_english or {}
+        self.source = source
+
+    @classmethod
+    def from_sdk(cls, data):
+        """从 DetectSkinDiseaseResponseBodyData 构建"""
+        return cls(
+            body_part=data.body_part,
+            image_quality=data.image_quality,
+            image_type=data.image_type,
+            results=dict(data.results or {}),
+            results_english=dict(data.results_english or {}),
+        )
+
+    @classmethod
+    def from_value(cls, value):
+        """从 SkinResult、规范字典、SDK 风格字典或 JSON 字符串构建；无法识别时返回 None"""
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, (str, bytes)):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return None
+        if not isinstance(value, dict):
+            return None
+        fields = {_LEGACY_KEYS.get(key, key): item for key, item in value.items()}
+        return cls(**{name: fields[name] for name in cls.__slots__ if name in fields})
+
+    @classmethod
+    def mock(cls):
+        """降级时使用的模拟数据，结构与真实结果相同"""
+        return cls(
+            body_part="面部",
+            image_quality=0.9,
+            image_type="clinical",
+            results={"痤疮": 0.85, "皱纹": 0.72, "色斑": 0.68},
+            results_english={"acne": 0.85, "wrinkle": 0.72, "spot": 0.68},
+            source=SOURCE_MOCK,
+        )
+
+    @property
+    def is_mock(self):
+        return self.source == SOURCE_MOCK
+
+    def to_dict(self):
+        """紧凑字典，省略空字段；用于缓存和批量结果"""
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) not in (None, {})}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+    def __repr__(self):
+        return f"SkinResult({self.to_json()})"
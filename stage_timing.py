@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段耗时统计模块
+一次提交会经过 预处理 -> 上传OSS -> 皮肤分析 -> {推理, 图表}，开启推测执行后还有并行的连接预热。
+RequestTimeline 以提交时刻为零点记录每个阶段的开始偏移和耗时，可以直接看出哪些阶段重叠、
+哪些阶段在关键路径上；所有预期阶段结束后汇总到 TimingMetrics，按阶段统计平均耗时。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TimingMetrics:
+    """按阶段累计耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.requests = 0
+        self.total_seconds = 0.0
+
+    def record(self, timeline):
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += timeline.elapsed()
+            for name, (_, duration) in timeline.stages.items():
+                stats = self._stages.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stats["count"] += 1
+                stats["total_seconds"] += duration
+                stats["max_seconds"] = max(stats["max_seconds"], duration)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {
+                name: {
+                    "count": stats["count"],
+                    "avg_seconds": round(stats["total_seconds"] / stats["count"], 3),
+                    "max_seconds": round(stats["max_seconds"], 3),
+                }
+                for name, stats in self._stages.items()
+            }
+            return {
+                "requests": self.requests,
+                "avg_total_seconds": round(self.total_seconds / self.requests, 3) if self.requests else 0.0,
+                "stages": stages,
+            }
+
+
+# 全局统计实例
+timing_metrics = TimingMetrics()
+
+
+class RequestTimeline:
+    """一次提交的阶段时间线：{阶段: (相对提交时刻的开始秒数, 耗时秒数)}"""
+
+    def __init__(self, task_id, expected=("chart", "reasoning"), on_complete=None):
+        self.task_id = task_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._pending = set(expected)
+        self._on_complete = on_complete
+        self._lock = threading.Lock()
+        self._completed = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record(self, name, start, end):
+        """记录一个阶段（start / end 为 time.perf_counter() 的值）"""
+        with self._lock:
+            self.stages[name] = (start - self.started, end - start)
+        self._finish(name)
+
+    def _finish(self, name):
+        with self._lock:
+            self._pending.discard(name)
+            completed = not self._pending and not self._completed
+            if completed:
+                self._completed = True
+        if completed and self._on_complete is not None:
+            self._on_complete(self)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def skip(self, name):
+        """预期的阶段不会执行（例如分析失败），不再等待它"""
+        self._finish(name)
+
+    def summary(self):
+        """按开始时间排序的阶段列表，例如 preprocess@0.00s+0.12s"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1][0])
+        return ", ".join(f"{name}@{offset:.2f}s+{duration:.2f}s" for name, (offset, duration) in stages)
+
+
+class _NullTimeline:
+    """未开启统计时使用，所有操作为空"""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def record(self, name, start, end):
+        pass
+
+    def skip(self, name):
+        pass
+
+
+NULL_TIMELINE = _NullTimeline()
+
+
+class TimelineRegistry:
+    """按任务ID保存进行中的时间线，后续的推理、图表事件按任务ID取回"""
+
+    def __init__(self, max_entries=256, on_complete=None):
+        self.max_entries = max_entries
+        self.on_complete = on_complete
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, task_id):
+        timeline = RequestTimeline(task_id, on_complete=self._complete)
+        with self._lock:
+            self._timelines[task_id] = timeline
+            while len(self._timelines) > self.max_entries:
+                self._timelines.popitem(last=False)
+        return timeline
+
+    def get(self, task_id):
+        with self._lock:
+            return self._timelines.get(task_id) or NULL_TIMELINE
+
+    def _complete(self, timeline):
+        with self._lock:
+            self._timelines.pop(timeline.task_id, None)
+        timing_metrics.record(timeline)
+        if self.on_complete is not None:
+            self.on_complete(timeline)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+存储保留策略模块
+每次提交都会产生本地图片（开启 archive_local 时）和一个 OSS 对象，如果没有任何清理，
+磁盘和 bucket 的用量会随流量无限增长。
+- LocalRetention: 按 总大小 / 文件数 / 文件年龄 三个上限清理本地目录，超出时从最旧的文件开始删除
+- OssRetention: 上传时给对象打上临时标签（可在 bucket 上配置按标签过期的生命周期规则兜底），
+  分析完成后按配置改为“已分析”标签交给生命周期规则过期（默认），或直接删除对象
+  - tag: 对象按内容命名，相同图片共用一个对象，签名URL缓存可以命中；对象由生命周期规则按天过期
+  - delete: 用量最小，但每次上传都要使用独立的对象名（否则会删掉其他分析正在读取的对象），签名URL缓存不会命中
+- sweep_oss_prefix: 删除上传前缀下超过保留时间的对象，清理进程异常退出时遗留的对象
+- RetentionSweeper: 后台线程定期执行以上清理
+- StorageMetrics: 本地目录占用和 OSS 对象上传/删除的统计
+"""
+
+import os
+import threading
+import time
+
+import oss2
+from oss2.models import Tagging, TaggingRule
+
+
+class StorageMetrics:
+    """存储占用统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "local_files": 0,
+            "local_bytes": 0,
+            "local_removed_files": 0,
+            "local_removed_bytes": 0,
+            "oss_uploaded": 0,
+            "oss_uploaded_bytes": 0,
+            "oss_deleted": 0,
+            "oss_tagged": 0,
+            "oss_swept": 0,
+            "oss_release_failed": 0,
+        }
+        self.last_sweep_at = None
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_local_usage(self, files, total_bytes):
+        with self._lock:
+            self._counters["local_files"] = files
+            self._counters["local_bytes"] = total_bytes
+            self.last_sweep_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot["last_sweep_at"] = self.last_sweep_at
+            return snapshot
+
+
+# 全局统计实例
+storage_metrics = StorageMetrics()
+
+
+class LocalRetention:
+    """本地目录的大小 / 数量 / 年龄上限"""
+
+    def __init__(self, directory="images", max_bytes=0, max_files=0, max_age_seconds=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age_seconds = max_age_seconds
+
+    def _list_files(self):
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        return files
+
+    def sweep(self):
+        """执行一次清理，返回 (删除的文件数, 删除的字节数)"""
+        files = self._list_files()
+        now = time.time()
+        total_bytes = sum(size for _, size, _ in files)
+        removed_files = 0
+        removed_bytes = 0
+
+        # 从最旧的文件开始，删除超龄的文件，直到数量和大小都回到上限以内
+        for mtime, size, path in list(files):
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            over_count = self.max_files and len(files) - removed_files > self.max_files
+            over_size = self.max_bytes and total_bytes - removed_bytes > self.max_bytes
+            if not (expired or over_count or over_size):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed_files += 1
+            removed_bytes += size
+
+        storage_metrics.set_local_usage(len(files) - removed_files, total_bytes - removed_bytes)
+        storage_metrics.incr("local_removed_files", removed_files)
+        storage_metrics.incr("local_removed_bytes", removed_bytes)
+        return removed_files, removed_bytes
+
+
+class OssRetention:
+    """OSS 上传对象的保留策略：tag 分析后改标签交给生命周期规则；delete 分析后删除；keep 保留"""
+
+    def __init__(self, mode="tag", tag_key="littleskin-retention", tag_value="temporary",
+                 analyzed_tag_value="analyzed"):
+        self.mode = mode
+        self.tag_key = tag_key
+        self.tag_value = tag_value
+        self.analyzed_tag_value = analyzed_tag_value
+
+    @property
+    def deletes_objects(self):
+        """分析完成后是否立即删除对象"""
+        return self.mode == "delete"
+
+    def upload_headers(self):
+        """上传时附带的对象标签，进程异常退出、没来得及删除的对象也能被生命周期规则清理"""
+        if self.mode == "keep" or not self.tag_key:
+            return None
+        return {"x-oss-tagging": f"{self.tag_key}={self.tag_value}"}
+
+    def release(self, bucket, object_name):
+        """分析完成后处理对象，返回执行的动作"""
+        if self.mode == "delete":
+            bucket.delete_object(object_name)
+            storage_metrics.incr("oss_deleted")
+            return "deleted"
+        if self.mode == "tag" and self.tag_key:
+            rule = TaggingRule()
+            rule.add(self.tag_key, self.analyzed_tag_value)
+            bucket.put_object_tagging(object_name, Tagging(rule))
+            storage_metrics.incr("oss_tagged")
+            return "tagged"
+        return "kept"
+
+
+def sweep_oss_prefix(bucket, prefix, max_age_seconds):
+    """删除前缀下超过保留时间的对象，返回删除数量"""
+    if not max_age_seconds:
+        return 0
+    cutoff = time.time() - max_age_seconds
+    expired = [obj.key for obj in oss2.ObjectIterator(bucket, prefix=prefix)
+               if obj.last_modified < cutoff]
+    # 批量删除接口每次最多 1000 个对象
+    for start in range(0, len(expired), 1000):
+        bucket.batch_delete_objects(expired[start:start + 1000])
+    storage_metrics.incr("oss_swept", len(expired))
+    return len(expired)
+
+
+class RetentionSweeper:
+    """后台清理线程"""
+
+    def __init__(self, local_retention, interval_seconds=600, oss_sweep=None, on_sweep=None):
+        self.local_retention = local_retention
+        self.interval_seconds = interval_seconds
+        # oss_sweep: 无参数的可调用对象，返回删除的对象数；未配置 bucket 时为 None
+        self.oss_sweep = oss_sweep
+        self.on_sweep = on_sweep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sweep_once(self):
+        removed_files, removed_bytes = self.local_retention.sweep()
+        oss_removed = 0
+        error = None
+        if self.oss_sweep is not None:
+            try:
+                oss_removed = self.oss_sweep()
+            except Exception as e:
+                error = str(e)
+        result = {
+            "local_removed_files": removed_files,
+            "local_removed_bytes": removed_bytes,
+            "oss_removed": oss_removed,
+            "error": error,
+            "footprint": storage_metrics.snapshot(),
+        }
+        if self.on_sweep:
+            self.on_sweep(result)
+        return result
+
+    def start(self):
+        if self._thread is not None or not self.interval_seconds:
+            return
+
+        def run():
+            # 启动时先清理一次，之后按间隔执行
+            while True:
+                try:
+                    self.sweep_once()
+                except Exception:
+                    pass
+                if self._stop.wait(self.interval_seconds):
+                    break
+
+        self._thread = threading.Thread(target=run, name="retention-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def create_local_retention(options):
+    options = options or {}
+    return LocalRetention(
+        directory=options.get('local_dir') or "images",
+        max_bytes=int(options.get('local_max_bytes') or 0),
+        max_files=int(options.get('local_max_files') or 0),
+        max_age_seconds=int(options.get('local_max_age_seconds') or 0),
+    )
+
+
+def create_oss_retention(options):
+    options = options or {}
+    return OssRetention(
+        mode=options.get('oss_mode') or "tag",
+        tag_key=options.get('oss_tag_key', "littleskin-retention"),
+        tag_value=options.get('oss_tag_value') or "temporary",
+        analyzed_tag_value=options.get('oss_analyzed_tag_value') or "analyzed",
+    )
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+流式输出合并（限帧）模块
+OpenAI 流每个 token 都会产生一个分片，如果每个分片都向浏览器推送两份完整的 HTML，
+并发用户一多，websocket 带宽和服务端渲染 CPU 都会被打满。
+StreamCoalescer 位于模型流和 Gradio yield 之间：分片先累积，满足时间间隔（每秒最多 N 次）
+或累积字数阈值时才真正推送一次，流结束时由调用方保证最后一次完整推送。
+同时按会话统计推送次数和发送字节数。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class StreamCoalescer:
+    """按时间和累积字数合并流式更新"""
+
+    def __init__(self, max_updates_per_second=8, min_pending_chars=1, max_pending_chars=800):
+        # max_updates_per_second <= 0 表示不限帧，每个分片都推送
+        self.min_interval = 1.0 / max_updates_per_second if max_updates_per_second > 0 else 0.0
+        self.min_pending_chars = min_pending_chars
+        self.max_pending_chars = max_pending_chars
+
+        self.chunks_received = 0
+        self.chars_received = 0
+        self.updates_sent = 0
+        self.bytes_sent = 0
+
+        self._pending_chars = 0
+        self._last_flush = 0.0
+        self._started_at = time.monotonic()
+
+    def add(self, delta_text):
+        """记录一个新收到的分片"""
+        self.chunks_received += 1
+        self.chars_received += len(delta_text)
+        self._pending_chars += len(delta_text)
+
+    def should_flush(self):
+        """判断当前累积的内容是否需要推送"""
+        if self._pending_chars <= 0:
+            return False
+        # 累积过多时立即推送，避免界面长时间不更新
+        if self.max_pending_chars and self._pending_chars >= self.max_pending_chars:
+            return True
+        if self._pending_chars < self.min_pending_chars:
+            return False
+        return time.monotonic() - self._last_flush >= self.min_interval
+
+    def flushed(self, *payloads):
+        """记录一次推送并原样返回推送内容，便于直接 yield"""
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.updates_sent += 1
+        self.bytes_sent += sum(len(p.encode('utf-8')) for p in payloads if p)
+        return payloads
+
+    def stats(self):
+        """返回本次流式输出的统计信息"""
+        return {
+            "chunks_received": self.chunks_received,
+            "chars_received": self.chars_received,
+            "updates_sent": self.updates_sent,
+            "bytes_sent": self.bytes_sent,
+            "duration_seconds": round(time.monotonic() - self._started_at, 3),
+        }
+
+
+class StreamMetrics:
+    """按会话累计的流式推送统计（只保留最近活跃的 max_sessions 个会话）"""
+
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, session_id, stats):
+        with self._lock:
+            totals = self._sessions.setdefault(session_id, {
+                "streams": 0, "chunks_received": 0, "updates_sent": 0, "bytes_sent": 0
+            })
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            totals["streams"] += 1
+            totals["chunks_received"] += stats.get("chunks_received", 0)
+            totals["updates_sent"] += stats.get("updates_sent", 0)
+            totals["bytes_sent"] += stats.get("bytes_sent", 0)
+            return dict(totals)
+
+    def snapshot(self):
+        with self._lock:
+            return {sid: dict(totals) for sid, totals in self._sessions.items()}
+
+
+# 全局统计实例
+stream_metrics = StreamMetrics()
+
+
+def create_stream_coalescer(options):
+    """根据配置字典创建合并器"""
+    options = options or {}
+    if not options.get('enabled', True):
+        return StreamCoalescer(max_updates_per_second=0, min_pending_chars=1, max_pending_chars=0)
+    return StreamCoalescer(
+        max_updates_per_second=float(options.get('max_updates_per_second', 8)),
+        min_pending_chars=int(options.get('min_pending_chars', 1)),
+        max_pending_chars=int(options.get('max_pending_chars', 800)),
+    )
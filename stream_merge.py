@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+多路流式响应合并模块
+双模型模式下，快速模型的简要结论和 R1 的深度推理同时请求、同时输出：
+每一路流在各自的线程（异步版本为任务）中建立连接并读取分片，按到达顺序合并为一个事件序列，
+哪一路先有内容就先推送哪一路，不会因为 R1 的长推理而推迟简要结论。
+事件为 (来源名称, 事件类型, 值)：
+- STARTED: 连接已建立，值为流对象
+- ITEM: 一个分片
+- DONE: 该路流正常结束
+- ERROR: 建立连接或读取失败，值为异常；其他路不受影响
+"""
+
+import asyncio
+import contextvars
+import queue
+import threading
+
+STARTED = "started"
+ITEM = "item"
+DONE = "done"
+ERROR = "error"
+
+
+def _close_stream(stream):
+    """关闭流；流对象可能没有 close()，或已经关闭"""
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+
+async def _async_close_stream(stream):
+    try:
+        await stream.close()
+    except Exception:
+        pass
+
+
+class StreamMerger:
+    """sources 为 {名称: 无参函数}，函数在后台线程中调用，返回可迭代的流"""
+
+    def __init__(self, sources):
+        self._sources = sources
+        self._queue = queue.Queue()
+        self._streams = {}
+        self._closed = False
+
+    def _produce(self, name, factory):
+        stream = None
+        try:
+            stream = factory()
+            self._streams[name] = stream
+            # 建立连接期间合并器已关闭（任务取消、页面关闭），不再读取
+            if self._closed:
+                return
+            self._queue.put((name, STARTED, stream))
+            for item in stream:
+                if self._closed:
+                    break
+                self._queue.put((name, ITEM, item))
+            self._queue.put((name, DONE, None))
+        except Exception as error:
+            self._queue.put((name, ERROR, error))
+        finally:
+            # 无论正常结束、出错还是被关闭，都释放该路流的连接
+            if stream is not None:
+                _close_stream(stream)
+
+    def __iter__(self):
+        for name, factory in self._sources.items():
+            # 复制当前上下文，追踪用的请求ID等上下文变量在后台线程中仍然可用
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._produce, name, factory),
+                             name=f"stream-{name}", daemon=True).start()
+
+        active = len(self._sources)
+        while active and not self._closed:
+            name, event, value = self._queue.get()
+            if event in (DONE, ERROR):
+                active -= 1
+            yield name, event, value
+
+    def close(self):
+        """停止读取并关闭所有已建立的流"""
+        self._closed = True
+        for stream in list(self._streams.values()):
+            _close_stream(stream)
+
+
+class AsyncStreamMerger:
+    """StreamMerger 的异步版本，sources 为 {名称: 无参协程函数}，协程返回可 async for 迭代的流"""
+
+    def __init__(self, sources):
+        self._sources = sources
+        self._queue = asyncio.Queue()
+        self._streams = {}
+        self._tasks = []
+        self._closed = False
+
+    async def _produce(self, name, factory):
+        stream = None
+        try:
+            stream = await factory()
+            self._streams[name] = stream
+            if self._closed:
+                return
+            await self._queue.put((name, STARTED, stream))
+            async for item in stream:
+                await self._queue.put((name, ITEM, item))
+            await self._queue.put((name, DONE, None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await self._queue.put((name, ERROR, error))
+        finally:
+            if stream is not None:
+                await _async_close_stream(stream)
+
+    async def __aiter__(self):
+        self._tasks = [asyncio.ensure_future(self._produce(name, factory)) for name, factory in self._sources.items()]
+        try:
+            active = len(self._sources)
+            while active and not self._closed:
+                name, event, value = await self._queue.get()
+                if event in (DONE, ERROR):
+                    active -= 1
+                yield name, event, value
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def close(self):
+        """停止读取并关闭所有已建立的流"""
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        for stream in list(self._streams.values()):
+            await _async_close_stream(stream)
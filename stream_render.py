@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+流式 Markdown 增量渲染模块
+DeepSeek 的推理内容和真实输出是逐 token 追加的，如果每个分片都把全文重新转换一次，
+CPU 开销会随输出长度平方增长。这里把已经结束的块（段落、代码块、表格等）渲染后缓存为 HTML，
+每次只重新渲染末尾尚未结束的块，单次开销与新增内容成正比。
+"""
+
+import html
+import re
+import threading
+
+import markdown
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables']
+
+# 代码围栏的起止行
+_FENCE_RE = re.compile(r'^\s{0,3}(```|~~~)')
+# 以这些形式开头的行会与上一个块连在一起解析（列表项、缩进续行、表格行、引用）
+_CONTINUATION_RE = re.compile(r'^(\s+\S|[-*+]\s|\d+[.)]\s|\||>)')
+
+_thread_local = threading.local()
+
+
+def _get_engine():
+    """每个线程复用一个 Markdown 实例，避免每次渲染都重新构建扩展"""
+    engine = getattr(_thread_local, 'engine', None)
+    if engine is None:
+        engine = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        _thread_local.engine = engine
+    return engine
+
+
+def render_markdown(text):
+    """一次性渲染一段 Markdown 文本，渲染失败时退化为转义后的纯文本"""
+    try:
+        engine = _get_engine()
+        engine.reset()
+        return engine.convert(text)
+    except Exception:
+        return html.escape(text).replace('\n', '<br>')
+
+
+class IncrementalMarkdownRenderer:
+    """增量 Markdown 渲染器：feed() 追加文本，html() 返回当前完整的 HTML"""
+
+    def __init__(self):
+        self._finalized_html = ""
+        self._pending = ""
+        self._pending_html = ""
+        self._dirty = False
+
+    def feed(self, delta):
+        """追加一段新文本，并把其中已经结束的块固化为 HTML"""
+        if not delta:
+            return
+        self._pending += delta
+        self._dirty = True
+
+        split_at = self._find_split_point(self._pending)
+        if split_at:
+            self._finalized_html += render_markdown(self._pending[:split_at]) + "\n"
+            self._pending = self._pending[split_at:]
+
+    def html(self):
+        """返回已固化部分 + 末尾未结束块的渲染结果"""
+        if self._dirty:
+            self._pending_html = render_markdown(self._pending) if self._pending.strip() else ""
+            self._dirty = False
+        return self._finalized_html + self._pending_html
+
+    @staticmethod
+    def _find_split_point(text):
+        """
+        找到最后一个可以安全切分的位置：代码围栏之外的空行，且空行之后已经出现了
+        不属于上一个块的新内容。返回切分位置（新块的起始下标），找不到时返回 0。
+        """
+        split_at = 0
+        in_fence = False
+        previous_blank = False
+        position = 0
+        for line in text.splitlines(keepends=True):
+            # 最后一行还没有换行符，说明仍在输出中，暂不参与判断
+            if not line.endswith('\n'):
+                break
+
+            stripped = line.strip()
+            if _FENCE_RE.match(line):
+                if not in_fence and previous_blank:
+                    split_at = position
+                in_fence = not in_fence
+            elif not in_fence and stripped and previous_blank and not _CONTINUATION_RE.match(line):
+                split_at = position
+
+            previous_blank = not in_fence and not stripped
+            position += len(line)
+        return split_at
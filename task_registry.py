@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+按会话隔离的任务管理模块
+每个 Gradio 会话（session_hash）各自维护当前任务和取消令牌，
+同一用户重新提交只会取消自己的旧任务，不会影响其他用户正在进行的推理和可视化。
+"""
+
+import threading
+import time
+import uuid
+
+DEFAULT_SESSION = "default"
+
+
+def generate_task_id():
+    """生成唯一的任务ID（时间戳 + 随机后缀，避免并发提交时重复）"""
+    return f"task_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+
+
+def session_key(request):
+    """从 gr.Request 中取出会话标识，取不到时使用默认会话"""
+    session_hash = getattr(request, 'session_hash', None) if request is not None else None
+    return session_hash or DEFAULT_SESSION
+
+
+class CancelToken:
+    """任务取消令牌，被同一会话的新任务替换时置为已取消"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class TaskRegistry:
+    """会话 -> 当前任务令牌 的注册表"""
+
+    def __init__(self, session_ttl=3600):
+        # 会话超过 session_ttl 秒没有新任务则被清理，防止注册表无限增长
+        self.session_ttl = session_ttl
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id):
+        """为会话开启新任务：取消该会话的旧任务并返回新的令牌"""
+        token = CancelToken(generate_task_id())
+        now = time.time()
+        with self._lock:
+            previous = self._tasks.get(session_id)
+            if previous is not None:
+                previous[0].cancel()
+            self._tasks[session_id] = (token, now)
+            self._prune(now)
+        return token
+
+    def get(self, session_id, task_id):
+        """取回任务令牌；任务已被替换或不存在时返回一个已取消的令牌"""
+        with self._lock:
+            entry = self._tasks.get(session_id)
+        if entry is not None and entry[0].task_id == task_id:
+            return entry[0]
+        token = CancelToken(task_id)
+        token.cancel()
+        return token
+
+    def is_current(self, session_id, task_id):
+        """检查任务是否仍是该会话的当前任务"""
+        return not self.get(session_id, task_id).cancelled
+
+    def active_sessions(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def _prune(self, now):
+        expired = [sid for sid, (_, started) in self._tasks.items() if now - started > self.session_ttl]
+        for sid in expired:
+            self._tasks.pop(sid, None)
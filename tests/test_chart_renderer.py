@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""chart_renderer 模块对模型生成的非标准配置的处理测试"""
+
+import pytest
+
+from chart_renderer import QUICKCHART_URL, ChartRenderer, UnsupportedChartError
+
+
+def _bar_config(data, options=None):
+    return {
+        "type": "bar",
+        "data": {"labels": ["痤疮", "色斑"], "datasets": [{"label": "置信度", "data": data}]},
+        "options": options or {},
+    }
+
+
+def _renderer(tmp_path, fallback=True):
+    return ChartRenderer(output_dir=str(tmp_path / "charts"), fallback=fallback)
+
+
+@pytest.mark.parametrize("options", [
+    {"title": "皮肤状况"},
+    {"title": ["皮肤", "状况"]},
+    {"plugins": None},
+    {"plugins": {"title": {"display": True, "text": "皮肤状况"}}},
+])
+def test_title_variants_render_locally(tmp_path, options):
+    uri = _renderer(tmp_path).chart_url(_bar_config([40, 60], options))
+    assert uri.startswith("data:image/svg+xml;base64,")
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), "NaN"])
+def test_non_finite_values_fall_back_to_quickchart(tmp_path, value):
+    uri = _renderer(tmp_path).chart_url(_bar_config([value, 60]))
+    assert uri.startswith(QUICKCHART_URL)
+
+
+def test_non_finite_values_raise_without_fallback(tmp_path):
+    with pytest.raises(UnsupportedChartError):
+        _renderer(tmp_path, fallback=False).chart_url(_bar_config([float("nan"), 60]))
+
+
+def test_all_negative_values_render(tmp_path):
+    uri = _renderer(tmp_path).chart_url(_bar_config([-1, -2]))
+    assert uri.startswith("data:image/svg+xml;base64,")
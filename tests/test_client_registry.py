@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""client_registry 模块的客户端构建、替换与关闭测试"""
+
+import asyncio
+import threading
+import time
+
+from client_registry import ClientRegistry
+
+
+class _FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_slow_factory_does_not_block_other_slots():
+    registry = ClientRegistry()
+    started = threading.Event()
+
+    def slow_factory():
+        started.set()
+        time.sleep(0.5)
+        return _FakeClient("slow"), None, None
+
+    builder = threading.Thread(target=registry._get, args=(("slow",), "", slow_factory))
+    builder.start()
+    started.wait(1)
+    begin = time.monotonic()
+    fast = registry._get(("fast",), "", lambda: (_FakeClient("fast"), None, None))
+    assert time.monotonic() - begin < 0.2
+    assert fast.name == "fast"
+    builder.join()
+
+
+def test_concurrent_rebuild_keeps_one_client_and_closes_the_other():
+    registry = ClientRegistry()
+    barrier = threading.Barrier(2)
+    built = []
+
+    def factory():
+        client = _FakeClient(len(built))
+        built.append(client)
+        barrier.wait(1)
+        return client, client.close, None
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry._get(("openai",), "key", factory)))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results[0] is results[1]
+    assert sorted(client.closed for client in built) == [False, True]
+
+
+def test_replaced_client_is_closed_after_grace_period():
+    registry = ClientRegistry(retire_grace_seconds=0.2)
+    old = _FakeClient("old")
+    registry._get(("openai",), "old-key", lambda: (old, old.close, None))
+
+    # 密钥轮换：旧客户端可能仍有进行中的请求，不立即关闭
+    registry._get(("openai",), "new-key", lambda: (_FakeClient("new"), None, None))
+    assert not old.closed
+
+    time.sleep(0.25)
+    registry._get(("http",), "", lambda: (_FakeClient("http"), None, None))
+    assert old.closed
+
+
+def test_async_clients_are_closed():
+    registry = ClientRegistry(retire_grace_seconds=0)
+
+    async def scenario():
+        first = registry._get(("async_http",), "a", lambda: _async_entry("first"))
+        # 替换后在下一次取用时通过事件循环关闭
+        registry._get(("async_http",), "b", lambda: _async_entry("second"))
+        registry._get(("async_http",), "c", lambda: _async_entry("third"))
+        await asyncio.sleep(0)
+        assert first.closed
+
+        remaining = [entry.client for entry in list(registry._entries.values()) + registry._retired]
+        await registry.aclose_all()
+        assert all(client.closed for client in remaining)
+
+    def _async_entry(name):
+        client = _FakeClient(name)
+        return client, client.aclose, None
+
+    asyncio.run(scenario())
+
+
+def test_close_all_closes_async_clients_without_running_loop():
+    registry = ClientRegistry()
+    client = _FakeClient("async")
+    registry._get(("async_openai",), "", lambda: (client, client.aclose, None))
+    registry.close_all()
+    assert client.closed
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""daily_logger 模块的队列容量与批量写入测试"""
+
+import io
+import logging
+import queue
+import time
+
+from daily_logger import BatchQueueListener, BatchStreamHandler, DroppingQueueHandler
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(f"test_daily_logger.{name}")
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def _drain(log_queue):
+    records = []
+    while True:
+        try:
+            records.append(log_queue.get_nowait())
+        except queue.Empty:
+            return records
+
+
+def test_full_queue_drops_info_but_keeps_warnings():
+    # capacity 之外预留 2 条给 WARNING 及以上的记录
+    log_queue = queue.Queue(maxsize=7)
+    handler = DroppingQueueHandler(log_queue, capacity=5, block_timeout=0.2)
+    logger = _logger("reserve", handler)
+
+    for index in range(10):
+        logger.info("info %d", index)
+    logger.warning("warning")
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        logger.exception("error")
+
+    begin = time.monotonic()
+    logger.error("no room left")
+    assert time.monotonic() - begin >= 0.2
+
+    records = _drain(log_queue)
+    assert [record.levelname for record in records] == ["INFO"] * 5 + ["WARNING", "ERROR"]
+    assert handler.dropped == 5 + 1
+
+
+def test_records_are_formatted_in_calling_thread():
+    log_queue = queue.Queue()
+    logger = _logger("prepare", DroppingQueueHandler(log_queue, capacity=10))
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        logger.exception("失败: %s", "参数")
+
+    record = log_queue.get_nowait()
+    assert record.msg == "失败: 参数"
+    assert record.args is None
+    assert record.exc_info is None
+    assert "ValueError: bad value" in record.exc_text
+
+
+def test_listener_writes_batches_and_reports_drops():
+    log_queue = queue.Queue(maxsize=4)
+    queue_handler = DroppingQueueHandler(log_queue, capacity=2)
+    logger = _logger("listener", queue_handler)
+    stream = io.StringIO()
+    stream_handler = BatchStreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+    for index in range(4):
+        logger.info("info %d", index)
+    listener = BatchQueueListener(log_queue, [stream_handler], batch_size=16, queue_handler=queue_handler)
+    listener.start()
+    listener.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[:2] == ["INFO info 0", "INFO info 1"]
+    assert lines[2].startswith("WARNING 日志队列已满，丢弃了 2 条日志")
+
+
+def test_closed_stream_does_not_stop_listener(tmp_path, monkeypatch):
+    # 进程退出时控制台流可能先于写入线程关闭
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+    log_queue = queue.Queue()
+    stream = open(tmp_path / "console.log", "w", encoding="utf-8")
+    listener = BatchQueueListener(log_queue, [BatchStreamHandler(stream)])
+    listener.start()
+    stream.close()
+
+    _logger("closed", DroppingQueueHandler(log_queue, capacity=10)).info("after close")
+    deadline = time.monotonic() + 1
+    while not log_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert listener._thread.is_alive()
+    listener.stop()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""pipeline_scheduler 模块的并发槽位、排队上限与统计测试"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pipeline_scheduler import Stage, StageBusyError, create_pipeline_scheduler
+
+
+def _hold(stage, release, entered=None):
+    """在后台线程中占用一个槽位，直到 release 被设置"""
+    def run():
+        with stage.slot():
+            if entered is not None:
+                entered.set()
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_full_queue_rejects_immediately():
+    stage = Stage("analysis", max_workers=1, max_queue=0, acquire_timeout=5)
+    release, entered = threading.Event(), threading.Event()
+    holder = _hold(stage, release, entered)
+    entered.wait(1)
+
+    started = time.monotonic()
+    with pytest.raises(StageBusyError):
+        with stage.slot():
+            pass
+    assert time.monotonic() - started < 0.5
+    release.set()
+    holder.join()
+    assert stage.stats()["rejected"] == 1
+
+
+def test_waiting_longer_than_acquire_timeout_is_rejected():
+    stage = Stage("analysis", max_workers=1, max_queue=1, acquire_timeout=0.1)
+    release, entered = threading.Event(), threading.Event()
+    holder = _hold(stage, release, entered)
+    entered.wait(1)
+
+    with pytest.raises(StageBusyError):
+        with stage.slot():
+            pass
+    release.set()
+    holder.join()
+    # 超时的请求归还了准入名额，之后可以正常进入
+    with stage.slot():
+        pass
+    assert stage.stats()["queue_depth"] == 0
+
+
+def test_slot_is_released_when_the_body_raises():
+    stage = Stage("chart", max_workers=1, max_queue=0)
+    with pytest.raises(RuntimeError):
+        with stage.slot():
+            raise RuntimeError("render failed")
+    with stage.slot() as wait:
+        assert wait >= 0
+    stats = stage.stats()
+    assert (stats["active"], stats["completed"], stats["failed"]) == (0, 1, 1)
+
+
+def test_concurrency_never_exceeds_max_workers():
+    stage = Stage("reasoning", max_workers=2, max_queue=16)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    threads = [threading.Thread(target=stage.run, args=(work,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert stage.stats()["completed"] == 8
+
+
+def test_create_pipeline_scheduler_merges_stage_options():
+    scheduler = create_pipeline_scheduler({"stages": {"analysis": {"max_workers": 1}}})
+    stats = scheduler.stats()
+    assert stats["analysis"]["max_workers"] == 1
+    assert stats["analysis"]["max_queue"] == 16
+    assert set(stats) == {"analysis", "chart", "reasoning"}
+
+
+def test_sync_and_async_waiters_are_served_in_arrival_order():
+    stage = Stage("reasoning", max_workers=1, max_queue=16, acquire_timeout=5)
+    order = []
+
+    def sync_waiter(name):
+        with stage.slot():
+            order.append(name)
+            time.sleep(0.01)
+
+    async def async_waiter(name):
+        async with stage.async_slot():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def holder():
+            async with stage.async_slot():
+                await release.wait()
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0.01)
+        waiters = []
+        for index in range(6):
+            name = f"{'async' if index % 2 else 'sync'}-{index}"
+            if index % 2:
+                waiters.append(asyncio.ensure_future(async_waiter(name)))
+            else:
+                waiters.append(asyncio.ensure_future(asyncio.to_thread(sync_waiter, name)))
+            # 等待者确实进入队列后再加入下一个
+            while stage.stats()["queue_depth"] < index + 1:
+                await asyncio.sleep(0.005)
+        release.set()
+        await holding
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert order == ["sync-0", "async-1", "sync-2", "async-3", "sync-4", "async-5"]
+
+
+def test_cancelled_async_waiter_does_not_leak_slots():
+    stage = Stage("reasoning", max_workers=1, max_queue=4, acquire_timeout=5)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def holder():
+            async with stage.async_slot():
+                await release.wait()
+
+        async def waiter():
+            async with stage.async_slot():
+                pass
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0.01)
+
+        # 排队中被取消
+        queued = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+        # 已经分到槽位、还没来得及恢复执行时被取消
+        granted = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.01)
+        release.set()
+        await holding
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+
+        async with stage.async_slot() as wait:
+            assert wait < 0.1
+
+    asyncio.run(scenario())
+    stats = stage.stats()
+    assert (stats["active"], stats["queue_depth"]) == (0, 0)
+    # 准入名额也全部归还
+    for _ in range(5):
+        assert stage._admission.acquire(blocking=False)
+
+
+def test_async_waiter_times_out():
+    stage = Stage("reasoning", max_workers=1, max_queue=4, acquire_timeout=0.1)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def holder():
+            async with stage.async_slot():
+                await release.wait()
+
+        holding = asyncio.ensure_future(holder())
+        await asyncio.sleep(0.01)
+        with pytest.raises(StageBusyError):
+            async with stage.async_slot():
+                pass
+        release.set()
+        await holding
+
+    asyncio.run(scenario())
+    assert stage.stats()["rejected"] == 1
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""prompt_compaction 模块的字段投影与输出格式测试"""
+
+import json
+
+from prompt_compaction import PromptCompactor, create_prompt_compactor, estimate_tokens, full_prompt_data
+from skin_result import SkinResult
+
+_RESULT = {
+    "BodyPart": "面部",
+    "ImageQuality": 0.91234,
+    "ImageType": "clinical",
+    "Results": {"痤疮": 0.123456, "皱纹": 0.876543, "色斑": 0.5},
+    "ResultsEnglish": {"acne": 0.123456, "wrinkle": 0.876543, "spot": 0.5},
+}
+
+
+def _compactor(**kwargs):
+    kwargs.setdefault("report", False)
+    return PromptCompactor(**kwargs)
+
+
+def test_targets_keep_only_their_fields():
+    compactor = _compactor()
+    chart = json.loads(compactor.compact(_RESULT, "chart"))
+    reasoning = json.loads(compactor.compact(_RESULT, "reasoning"))
+
+    assert list(chart) == ["results"]
+    assert list(reasoning) == ["body_part", "image_quality", "image_type", "results"]
+    assert reasoning["image_quality"] == 0.912
+
+
+def test_results_are_sorted_filtered_and_rounded():
+    compactor = _compactor(decimals=2, min_score=0.3, top_k=1)
+    projected = compactor.project(SkinResult.from_value(_RESULT), "chart")
+    assert projected == {"results": {"皱纹": 0.88}}
+
+    projected = _compactor(decimals=2).project(SkinResult.from_value(_RESULT), "chart")
+    assert list(projected["results"]) == ["皱纹", "色斑", "痤疮"]
+
+
+def test_empty_fields_are_dropped():
+    result = SkinResult(body_part="", image_quality=None, image_type="clinical", results={"痤疮": 0.5})
+    assert _compactor().project(result, "reasoning") == {"image_type": "clinical", "results": {"痤疮": 0.5}}
+
+
+def test_mock_data_is_marked():
+    projected = _compactor().project(SkinResult.mock(), "chart")
+    assert projected["source"] == SkinResult.mock().source
+
+
+def test_dense_format():
+    text = _compactor(output_format="dense", decimals=2).compact(_RESULT, "reasoning")
+    assert text.splitlines() == [
+        "body_part=面部",
+        "image_quality=0.91",
+        "image_type=clinical",
+        "results=皱纹:0.88,色斑:0.5,痤疮:0.12",
+    ]
+
+
+def test_compact_is_smaller_than_full_prompt():
+    compactor = _compactor()
+    full = full_prompt_data(_RESULT)
+    assert estimate_tokens(compactor.compact(_RESULT, "reasoning")) < estimate_tokens(full)
+
+
+def test_disabled_or_unparseable_input_uses_full_format():
+    assert _compactor(enabled=False).compact(_RESULT, "chart") == full_prompt_data(_RESULT)
+    assert _compactor().compact("不是 JSON", "chart") == full_prompt_data("不是 JSON")
+
+
+def test_estimate_tokens_counts_cjk_characters():
+    assert estimate_tokens("痤疮") == 2
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("痤疮abcde") == 4
+
+
+def test_create_prompt_compactor_options():
+    compactor = create_prompt_compactor({
+        "format": "dense", "decimals": 0, "min_score": "0.5", "top_k": 2,
+        "fields": {"chart": ["results", "body_part"]}, "report": False,
+    })
+    assert compactor.output_format == "dense"
+    assert compactor.decimals == 0
+    assert compactor.min_score == 0.5
+    assert compactor.top_k == 2
+    assert compactor.fields["chart"] == ("results", "body_part")
+    assert compactor.fields["reasoning"] == ("body_part", "image_quality", "image_type", "results")
+    assert not compactor.report
+
+    defaults = create_prompt_compactor(None)
+    assert defaults.enabled and defaults.output_format == "json" and defaults.decimals == 3
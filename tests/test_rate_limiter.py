@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""rate_limiter 模块的令牌桶与 SingleFlight 测试"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import (
+    MemoryBucketState, NullRateLimiter, RateLimitTimeout, SingleFlight, SqliteBucketState, TokenBucket,
+    create_rate_limiter,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """假时钟：sleep 直接推进时间"""
+    now = [1000.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleep)
+    return now
+
+
+def _bucket(**kwargs):
+    kwargs.setdefault("rate_per_second", 2.0)
+    kwargs.setdefault("burst", 2)
+    return TokenBucket(MemoryBucketState(), **kwargs)
+
+
+def test_burst_then_rate(clock):
+    bucket = _bucket()
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.stats()["granted"] == 4
+    assert bucket.stats()["avg_wait_seconds"] == pytest.approx(0.25)
+
+
+def test_acquire_timeout(clock):
+    bucket = _bucket(rate_per_second=0.1, burst=1, acquire_timeout=3)
+    bucket.acquire()
+    with pytest.raises(RateLimitTimeout) as info:
+        bucket.acquire()
+    assert info.value.retryable is False
+    stats = bucket.stats()
+    assert (stats["granted"], stats["rejected"], stats["waiting"]) == (1, 1, 0)
+
+
+def test_throttled_pauses_tokens(clock):
+    bucket = _bucket(rate_per_second=1.0, burst=2, throttle_cooldown_seconds=2.0)
+    bucket.on_throttled()
+    # 令牌被清空并透支 2 秒的补充量，再补满一个令牌需要 3 秒
+    assert bucket.acquire() == pytest.approx(3.0)
+    assert bucket.stats()["throttled"] == 1
+
+
+def test_max_waiting_rejects_immediately():
+    bucket = _bucket(rate_per_second=1.0, burst=1, acquire_timeout=5, max_waiting=1)
+    bucket.acquire()
+    waiter = threading.Thread(target=bucket.acquire)
+    waiter.start()
+    while bucket.stats()["waiting"] < 1:
+        time.sleep(0.01)
+
+    begin = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire()
+    assert time.monotonic() - begin < 0.1
+    waiter.join()
+    assert bucket.stats()["granted"] == 2
+
+
+def test_create_rate_limiter():
+    assert isinstance(create_rate_limiter({"enabled": False}), NullRateLimiter)
+    bucket = create_rate_limiter({"rate_per_second": 5, "burst": 3, "max_waiting": 8})
+    assert isinstance(bucket.state, MemoryBucketState)
+    assert (bucket.rate, bucket.burst, bucket.max_waiting) == (5.0, 3, 8)
+
+
+def test_single_flight_shares_result():
+    flight = SingleFlight()
+    barrier = threading.Barrier(4)
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(1)
+        return {"痤疮": 0.8}
+
+    def caller():
+        barrier.wait(1)
+        results.append(flight.do("image-hash", upstream))
+
+    results = []
+    threads = [threading.Thread(target=caller) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["executed"] + flight.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"痤疮": 0.8}] * 4
+    assert flight.stats() == {"executed": 1, "coalesced": 3, "in_flight": 0}
+    # 调用结束后不再合并，下一次请求重新执行
+    flight.do("image-hash", upstream)
+    assert len(calls) == 2
+
+
+def test_single_flight_propagates_error():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def upstream():
+        started.set()
+        release.wait(1)
+        raise ValueError("upstream failed")
+
+    def caller():
+        try:
+            flight.do("image-hash", upstream)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    started.wait(1)
+    follower = threading.Thread(target=caller)
+    follower.start()
+    while flight.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_async_dedup_and_errors():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value == "bad":
+            raise ValueError(value)
+        return value
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do_async("a", upstream, "ok") for _ in range(3)))
+        assert results == ["ok"] * 3
+        errors = await asyncio.gather(*(flight.do_async("b", upstream, "bad") for _ in range(2)),
+                                      return_exceptions=True)
+        assert all(isinstance(error, ValueError) for error in errors)
+
+    asyncio.run(scenario())
+    assert calls == ["ok", "bad"]
+    assert flight.stats() == {"executed": 2, "coalesced": 3, "in_flight": 0}
+
+
+def test_single_flight_async_leader_cancel_keeps_followers():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async("a", upstream))
+        follower = asyncio.ensure_future(flight.do_async("a", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == "result"
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_acquire_async_does_not_block_event_loop(tmp_path):
+    path = str(tmp_path / "rate_limit.db")
+    bucket = TokenBucket(SqliteBucketState(path), rate_per_second=100, burst=1, acquire_timeout=5)
+    # 另一个进程（这里用另一个连接模拟）持有写锁
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def scenario():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.ensure_future(ticker())
+        acquiring = asyncio.ensure_future(bucket.acquire_async())
+        await asyncio.sleep(0.3)
+        # 等待文件锁期间事件循环仍在正常运行
+        assert not acquiring.done()
+        assert len(ticks) >= 10
+        other.execute("COMMIT")
+        wait = await asyncio.wait_for(acquiring, 5)
+        ticking.cancel()
+        return wait
+
+    assert asyncio.run(scenario()) >= 0.3
+    other.close()
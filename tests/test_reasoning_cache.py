@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""reasoning_cache 模块的缓存键、版本与只缓存完整回答的测试"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from prompt_compaction import PromptCompactor
+from reasoning_cache import ReasoningCache, create_reasoning_cache, normalize_question, replay_pieces
+from skin_result import SkinResult
+
+_DATA = {"results": {"痤疮": 0.5}}
+_MODELS = ("deepseek-r1", "fast")
+
+
+def _cache(**options):
+    options.setdefault("backend", "memory")
+    return create_reasoning_cache(options)
+
+
+def _key(cache, data=_DATA, question="请分析我的皮肤状况", version="v1", models=_MODELS):
+    return cache.key(data, question, version, models, PromptCompactor(report=False))
+
+
+def test_normalize_question():
+    assert normalize_question("  请分析我的皮肤状况。 ") == "请分析我的皮肤状况"
+    assert normalize_question("What  is\tthis?") == "what is this"
+    assert normalize_question(None) == ""
+
+
+def test_key_ignores_formatting_but_not_content():
+    cache = _cache()
+    assert _key(cache) == _key(cache, question=" 请分析我的皮肤状况！")
+    assert _key(cache) == _key(cache, data='{"Results": {"痤疮": 0.5}}')
+    assert _key(cache) != _key(cache, question="痤疮怎么治疗")
+    assert _key(cache) != _key(cache, version="v2")
+    assert _key(cache) != _key(cache, models=("deepseek-r1", ""))
+    assert _key(cache) != _key(cache, data={"results": {"痤疮": 0.6}})
+
+
+def test_mock_or_unknown_data_is_not_cached():
+    cache = _cache()
+    assert _key(cache, data=SkinResult.mock()) is None
+    assert _key(cache, data="不是 JSON") is None
+    cache.set(None, {"content": "回答"})
+    assert cache.get(None) is None
+
+
+def test_entries_without_content_are_not_cached():
+    cache = _cache()
+    key = _key(cache)
+    cache.set(key, {"reasoning": "推理", "content": ""})
+    assert cache.get(key) is None
+    cache.set(key, {"reasoning": "推理", "content": "回答"})
+    assert cache.get(key)["content"] == "回答"
+
+
+def test_template_version_change_clears_cache():
+    cache = _cache()
+    cache.check_version("v1")
+    key = _key(cache)
+    cache.set(key, {"content": "回答"})
+    cache.check_version("v1")
+    assert cache.get(key) is not None
+    cache.check_version("v2")
+    assert cache.get(key) is None
+
+
+def test_replay_pieces_and_delay():
+    entry = {"content": "abcde", "reasoning": "xyz", "summary": ""}
+    assert list(replay_pieces(entry, 2)) == [
+        ("reasoning", "xy"), ("reasoning", "z"), ("content", "ab"), ("content", "cd"), ("content", "e"),
+    ]
+    assert ReasoningCache(None, replay_chars_per_second=10).replay_delay("abcde") == 0.5
+    assert ReasoningCache(None).replay_delay("abcde") == 0.0
+
+
+def _chunk(**delta):
+    delta.setdefault("reasoning_content", None)
+    delta.setdefault("content", None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(**delta))])
+
+
+_R1_CHUNKS = [_chunk(reasoning_content="推理 "), _chunk(content="最终回答")]
+_SUMMARY_CHUNKS = [_chunk(content="简要结论")]
+
+
+@pytest.fixture
+def fake_app(monkeypatch):
+    """替换 DeepSeek 调用，记录 R1 的调用次数；回答缓存使用独立的内存缓存"""
+    pytest.importorskip("gradio")
+    import app
+
+    calls = []
+    summary = {"fail": True}
+
+    def analysis(*args):
+        calls.append(args)
+        return iter(_R1_CHUNKS)
+
+    def fast_summary(*args):
+        if summary["fail"]:
+            raise ConnectionError("fast model unavailable")
+        return iter(_SUMMARY_CHUNKS)
+
+    async def analysis_async(*args):
+        calls.append(args)
+        return _async_stream(_R1_CHUNKS)
+
+    async def fast_summary_async(*args):
+        if summary["fail"]:
+            raise ConnectionError("fast model unavailable")
+        return _async_stream(_SUMMARY_CHUNKS)
+
+    monkeypatch.setattr(app, "reasoning_response_cache", _cache(replay_chars_per_second=0))
+    monkeypatch.setattr(app.dp, "dp_analysis_result", analysis)
+    monkeypatch.setattr(app.dp, "dp_fast_summary", fast_summary)
+    monkeypatch.setattr(app.dp, "dp_analysis_result_async", analysis_async)
+    monkeypatch.setattr(app.dp, "dp_fast_summary_async", fast_summary_async)
+    monkeypatch.setattr(app.bc, "deepseek_fast_instantiation", lambda: ("key", "url", "fast", 100))
+    return SimpleNamespace(app=app, calls=calls, summary=summary)
+
+
+async def _async_stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _run(app):
+    token = app.set_current_task(app.session_key(None))
+    return list(app.stream_deepseek_analysis(_DATA, "请分析我的皮肤状况", token.task_id))
+
+
+def _run_async(app):
+    async def collect():
+        token = app.set_current_task(app.session_key(None))
+        return [panes async for panes in app.async_stream_deepseek_analysis(_DATA, "请分析我的皮肤状况",
+                                                                            token.task_id)]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("run", [_run, _run_async])
+def test_answer_is_cached_only_when_all_sources_succeed(fake_app, run):
+    # 简要结论失败时回答不完整，不缓存，下一次请求重新调用 R1
+    run(fake_app.app)
+    run(fake_app.app)
+    assert len(fake_app.calls) == 2
+    assert fake_app.app.reasoning_response_cache.stats()["size"] == 0
+
+    fake_app.summary["fail"] = False
+    run(fake_app.app)
+    assert len(fake_app.calls) == 3
+
+    panes = run(fake_app.app)
+    assert len(fake_app.calls) == 3
+    assert "最终回答" in panes[-1][1] and "简要结论" in panes[-1][1]
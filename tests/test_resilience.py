@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""resilience 模块的错误分类与熔断测试"""
+
+import pytest
+
+from resilience import (
+    FATAL, RETRYABLE, THROTTLED, CircuitBreaker, CircuitOpenError, RetryPolicy, ServiceResilience, classify_error,
+)
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _service(failure_threshold=2):
+    return ServiceResilience(
+        "test",
+        RetryPolicy(max_attempts=3, base_delay=0, max_delay=0),
+        CircuitBreaker("test", failure_threshold=failure_threshold, recovery_timeout=60),
+    )
+
+
+def test_classify_error():
+    assert classify_error(_StatusError(503)) == RETRYABLE
+    assert classify_error(_StatusError(429)) == THROTTLED
+    assert classify_error(_StatusError(400)) == FATAL
+    assert classify_error(ConnectionError("reset")) == RETRYABLE
+    # 未识别的异常类型（本地代码错误）不重试
+    assert classify_error(AttributeError("from_sdk")) == FATAL
+    assert classify_error(RuntimeError("unknown")) == FATAL
+
+
+def test_local_error_is_not_retried_and_does_not_open_breaker():
+    service = _service(failure_threshold=2)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise AttributeError("'NoneType' object has no attribute 'Elements'")
+
+    for _ in range(3):
+        with pytest.raises(AttributeError):
+            service.call(broken)
+
+    assert len(calls) == 3
+    assert service.retries == 0
+    assert service.breaker.stats()["state"] == CircuitBreaker.CLOSED
+    assert service.call(lambda: "ok") == "ok"
+
+
+def test_transport_errors_open_breaker():
+    service = _service(failure_threshold=2)
+
+    def unavailable():
+        raise _StatusError(503)
+
+    # 第二次失败达到阈值后熔断，第三次尝试被直接拒绝
+    with pytest.raises(CircuitOpenError):
+        service.call(unavailable)
+    assert service.breaker.stats()["state"] == CircuitBreaker.OPEN
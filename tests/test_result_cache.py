@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""result_cache 模块的命中、过期与淘汰测试"""
+
+import pytest
+
+import result_cache
+from result_cache import MemoryBackend, NullCache, ResultCache, SqliteBackend, create_result_cache, image_content_hash
+
+
+class _Clock:
+    """可手动推进的时钟，替换 time.time"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(max_entries):
+        if request.param == "memory":
+            return MemoryBackend(max_entries)
+        return SqliteBackend(str(tmp_path / "cache.db"), max_entries)
+    return make
+
+
+def test_hit_and_miss_are_counted(make_backend, clock):
+    cache = ResultCache(make_backend(8), ttl_seconds=60)
+    assert cache.get("a") is None
+    cache.set("a", {"results": {"痤疮": 0.5}})
+    assert cache.get("a") == {"results": {"痤疮": 0.5}}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "size": 1}
+
+
+def test_expired_entry_is_a_miss_and_removed(make_backend, clock):
+    cache = ResultCache(make_backend(8), ttl_seconds=60)
+    cache.set("a", 1)
+    clock.advance(61)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_zero_ttl_never_expires(make_backend, clock):
+    cache = ResultCache(make_backend(8), ttl_seconds=0)
+    cache.set("a", 1)
+    clock.advance(10 ** 9)
+    assert cache.get("a") == 1
+
+
+def test_least_recently_used_entry_is_evicted(make_backend, clock):
+    cache = ResultCache(make_backend(2), ttl_seconds=0)
+    cache.set("a", 1)
+    clock.advance(1)
+    cache.set("b", 2)
+    clock.advance(1)
+    # 访问 a 之后，b 成为最久未访问的条目
+    assert cache.get("a") == 1
+    clock.advance(1)
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_sqlite_entries_survive_reopen(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    ResultCache(SqliteBackend(path), ttl_seconds=60).set("a", {"x": 1})
+    assert ResultCache(SqliteBackend(path), ttl_seconds=60).get("a") == {"x": 1}
+
+
+def test_create_result_cache_respects_enabled_and_backend(tmp_path):
+    assert isinstance(create_result_cache({"enabled": False}), NullCache)
+    cache = create_result_cache({"backend": "sqlite", "sqlite_path": str(tmp_path / "c.db"), "max_entries": 4})
+    assert isinstance(cache.backend, SqliteBackend) and cache.backend.max_entries == 4
+    with pytest.raises(ValueError):
+        create_result_cache({"backend": "redis"})
+
+
+def test_image_content_hash_ignores_file_name(tmp_path):
+    first, second = tmp_path / "a.png", tmp_path / "b.png"
+    first.write_bytes(b"same image")
+    second.write_bytes(b"same image")
+    assert image_content_hash(str(first)) == image_content_hash(str(second)) == image_content_hash(data=b"same image")
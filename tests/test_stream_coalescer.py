@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""stream_coalescer 模块的推送时机与统计测试"""
+
+import pytest
+
+import stream_coalescer
+from stream_coalescer import StreamCoalescer, StreamMetrics, create_stream_coalescer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(stream_coalescer.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_nothing_pending_never_flushes(clock):
+    assert not StreamCoalescer().should_flush()
+
+
+def test_flushes_at_most_once_per_interval(clock):
+    coalescer = StreamCoalescer(max_updates_per_second=4, max_pending_chars=0)
+    coalescer.add("a")
+    assert coalescer.should_flush()
+    coalescer.flushed("a")
+
+    coalescer.add("b")
+    clock[0] += 0.24
+    assert not coalescer.should_flush()
+    clock[0] += 0.02
+    assert coalescer.should_flush()
+
+
+def test_min_pending_chars_holds_back_small_updates(clock):
+    coalescer = StreamCoalescer(max_updates_per_second=4, min_pending_chars=5, max_pending_chars=0)
+    coalescer.add("abcd")
+    assert not coalescer.should_flush()
+    coalescer.add("e")
+    assert coalescer.should_flush()
+
+
+def test_max_pending_chars_flushes_inside_the_interval(clock):
+    coalescer = StreamCoalescer(max_updates_per_second=1, max_pending_chars=10)
+    coalescer.add("x")
+    coalescer.flushed("x")
+    coalescer.add("123456789")
+    assert not coalescer.should_flush()
+    coalescer.add("0")
+    assert coalescer.should_flush()
+
+
+def test_disabled_coalescer_flushes_every_chunk(clock):
+    coalescer = create_stream_coalescer({"enabled": False})
+    for chunk in ("a", "b", "c"):
+        coalescer.add(chunk)
+        assert coalescer.should_flush()
+        coalescer.flushed(chunk)
+    assert coalescer.stats()["updates_sent"] == 3
+
+
+def test_flushed_returns_payloads_and_counts_utf8_bytes(clock):
+    coalescer = StreamCoalescer()
+    coalescer.add("痤疮")
+    assert coalescer.flushed("痤疮", None, "ok") == ("痤疮", None, "ok")
+    stats = coalescer.stats()
+    assert (stats["chunks_received"], stats["chars_received"], stats["updates_sent"], stats["bytes_sent"]) == (1, 2, 1, 8)
+
+
+def test_stream_metrics_accumulates_per_session_and_evicts_oldest():
+    metrics = StreamMetrics(max_sessions=2)
+    metrics.record("a", {"chunks_received": 3, "updates_sent": 1, "bytes_sent": 10})
+    totals = metrics.record("a", {"chunks_received": 2, "updates_sent": 1, "bytes_sent": 5})
+    assert totals == {"streams": 2, "chunks_received": 5, "updates_sent": 2, "bytes_sent": 15}
+
+    metrics.record("b", {})
+    metrics.record("c", {})
+    assert set(metrics.snapshot()) == {"b", "c"}
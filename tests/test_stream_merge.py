@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""stream_merge 模块的多路合并、错误隔离与关闭测试"""
+
+import asyncio
+import threading
+import time
+
+from stream_merge import DONE, ERROR, ITEM, STARTED, AsyncStreamMerger, StreamMerger
+
+
+class _FakeStream:
+    def __init__(self, items, delay=0.0):
+        self.items = items
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for item in self.items:
+            time.sleep(self.delay)
+            if self.closed:
+                return
+            yield item
+
+    async def __aiter__(self):
+        for item in self.items:
+            await asyncio.sleep(self.delay)
+            yield item
+
+    def close(self):
+        self.closed = True
+
+
+class _AsyncFakeStream(_FakeStream):
+    async def close(self):
+        self.closed = True
+
+
+def _items(events, name):
+    return [value for source, event, value in events if source == name and event == ITEM]
+
+
+def test_fast_source_is_not_delayed_by_slow_source():
+    slow = _FakeStream(["推理1", "推理2"], delay=0.2)
+    fast = _FakeStream(["结论"])
+    events = list(StreamMerger({"reasoning": lambda: slow, "fast": lambda: fast}))
+
+    assert [event[:2] for event in events if event[0] == "fast"] == [("fast", STARTED), ("fast", ITEM), ("fast", DONE)]
+    last_fast = max(index for index, event in enumerate(events) if event[0] == "fast")
+    first_slow_item = min(index for index, event in enumerate(events) if event[:2] == ("reasoning", ITEM))
+    assert last_fast < first_slow_item
+    assert _items(events, "reasoning") == ["推理1", "推理2"]
+    assert slow.closed and fast.closed
+
+
+def test_failed_source_does_not_affect_others():
+    def broken():
+        raise ConnectionError("refused")
+
+    stream = _FakeStream(["a", "b"])
+    events = list(StreamMerger({"broken": broken, "ok": lambda: stream}))
+
+    errors = [value for name, event, value in events if event == ERROR]
+    assert len(errors) == 1 and isinstance(errors[0], ConnectionError)
+    assert _items(events, "ok") == ["a", "b"]
+    assert ("ok", DONE, None) in events
+
+
+def test_close_closes_streams_started_after_close():
+    late = _FakeStream(["慢"])
+    started = threading.Event()
+
+    def slow_factory():
+        started.set()
+        time.sleep(0.3)
+        return late
+
+    merger = StreamMerger({"fast": lambda: _FakeStream(["快"]), "slow": slow_factory})
+    iterator = iter(merger)
+    assert next(iterator)[0] == "fast"
+    started.wait(1)
+    merger.close()
+    # 关闭时慢速流尚未建立连接，建立后应立即关闭，不再读取
+    time.sleep(0.5)
+    assert late.closed
+    assert all(event[0] != "slow" for event in list(merger._queue.queue))
+
+
+def test_close_stops_established_streams():
+    stream = _FakeStream(list(range(100)), delay=0.01)
+    merger = StreamMerger({"long": lambda: stream})
+    for name, event, value in merger:
+        if event == ITEM:
+            break
+    merger.close()
+    assert stream.closed
+
+
+def test_async_merge_and_error_isolation():
+    fast = _AsyncFakeStream(["结论"])
+    slow = _AsyncFakeStream(["推理1", "推理2"], delay=0.1)
+
+    async def fast_factory():
+        return fast
+
+    async def slow_factory():
+        return slow
+
+    async def broken():
+        raise ConnectionError("refused")
+
+    async def scenario():
+        merger = AsyncStreamMerger({"reasoning": slow_factory, "fast": fast_factory, "broken": broken})
+        return [event async for event in merger]
+
+    events = asyncio.run(scenario())
+    assert _items(events, "fast") == ["结论"]
+    assert _items(events, "reasoning") == ["推理1", "推理2"]
+    assert [name for name, event, value in events if event == ERROR] == ["broken"]
+    first_fast = min(index for index, event in enumerate(events) if event[:2] == ("fast", ITEM))
+    first_slow = min(index for index, event in enumerate(events) if event[:2] == ("reasoning", ITEM))
+    assert first_fast < first_slow
+    assert fast.closed and slow.closed
+
+
+def test_async_close_cancels_pending_sources():
+    stream = _AsyncFakeStream(list(range(100)), delay=0.01)
+
+    async def scenario():
+        cancelled = []
+
+        async def long_factory():
+            return stream
+
+        async def hanging_factory():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        merger = AsyncStreamMerger({"long": long_factory, "hanging": hanging_factory})
+        async for name, event, value in merger:
+            if event == ITEM:
+                break
+        await merger.close()
+        await asyncio.sleep(0)
+        return cancelled
+
+    assert asyncio.run(scenario()) == [True]
+    assert stream.closed
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""stream_render 模块的增量渲染与一次性渲染一致性测试"""
+
+import re
+
+import pytest
+
+from stream_render import IncrementalMarkdownRenderer, render_markdown
+
+DOCUMENT = """## 皮肤状况分析
+
+根据检测结果，您的皮肤整体状况**良好**，但存在以下问题：
+
+- 轻度痤疮（置信度 0.62）
+- 色素沉着
+  集中在两颊
+
+1. 每日温和清洁
+2. 使用防晒
+
+| 问题 | 置信度 |
+| --- | --- |
+| 痤疮 | 0.62 |
+| 色斑 | 0.31 |
+
+```python
+def routine():
+
+    return "清洁 -> 保湿"
+```
+
+> 以上建议仅供参考，请咨询专业医生。
+
+最后一段没有换行结尾"""
+
+
+def _normalize(html):
+    # 块之间的换行数量不影响页面显示
+    return re.sub(r">\s+<", "><", html).strip()
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, len(DOCUMENT)])
+def test_incremental_render_matches_full_render(size):
+    renderer = IncrementalMarkdownRenderer()
+    for chunk in _chunks(DOCUMENT, size):
+        renderer.feed(chunk)
+    assert _normalize(renderer.html()) == _normalize(render_markdown(DOCUMENT))
+
+
+def test_every_prefix_matches_full_render_of_that_prefix():
+    renderer = IncrementalMarkdownRenderer()
+    for index, chunk in enumerate(_chunks(DOCUMENT, 5)):
+        renderer.feed(chunk)
+        prefix = DOCUMENT[:(index + 1) * 5]
+        assert _normalize(renderer.html()) == _normalize(render_markdown(prefix) if prefix.strip() else "")
+
+
+def test_finished_blocks_are_not_rendered_again():
+    renderer = IncrementalMarkdownRenderer()
+    renderer.feed("第一段\n\n第二段\n\n")
+    renderer.feed("第三段\n")
+    # 新块开始后前两段已经固化，只有最后一段需要重新渲染
+    assert renderer._pending == "第三段\n"
+    assert "<p>第一段</p>" in renderer.html()
+
+
+def test_open_code_fence_is_not_split_on_blank_lines():
+    assert IncrementalMarkdownRenderer._find_split_point("```\ncode\n\nmore\n") == 0
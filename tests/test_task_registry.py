@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""task_registry 模块的按会话取消测试"""
+
+from types import SimpleNamespace
+
+import task_registry
+from task_registry import DEFAULT_SESSION, TaskRegistry, session_key
+
+
+def test_new_task_cancels_only_the_same_session():
+    registry = TaskRegistry()
+    first = registry.start("alice")
+    other = registry.start("bob")
+    second = registry.start("alice")
+
+    assert first.cancelled
+    assert not second.cancelled
+    assert not other.cancelled
+    assert first.task_id != second.task_id
+
+
+def test_get_returns_current_token_or_a_cancelled_one():
+    registry = TaskRegistry()
+    old = registry.start("alice")
+    current = registry.start("alice")
+
+    assert registry.get("alice", current.task_id) is current
+    assert registry.is_current("alice", current.task_id)
+    assert registry.get("alice", old.task_id).cancelled
+    assert not registry.is_current("alice", old.task_id)
+    # 未知会话和伪造的任务ID都视为已取消
+    assert registry.get("mallory", current.task_id).cancelled
+    assert registry.get("alice", "task_forged").cancelled
+
+
+def test_idle_sessions_are_pruned(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(task_registry.time, "time", lambda: now[0])
+    registry = TaskRegistry(session_ttl=60)
+    stale = registry.start("alice")
+    now[0] += 61
+    registry.start("bob")
+
+    assert registry.active_sessions() == 1
+    assert not registry.is_current("alice", stale.task_id)
+
+
+def test_session_key_falls_back_to_default_session():
+    assert session_key(SimpleNamespace(session_hash="abc")) == "abc"
+    assert session_key(SimpleNamespace(session_hash=None)) == DEFAULT_SESSION
+    assert session_key(None) == DEFAULT_SESSION
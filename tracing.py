@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段延迟追踪模块
+OSS上传、阿里云皮肤分析、DeepSeek 流式推理、NIM 图表生成等外部调用都包在 Span 中：
+- 每个 Span 记录请求ID（任务ID）、耗时、状态，以及 bytes / retries / tokens 等数值属性
+- 结束的 Span 按名称汇总为直方图（耗时）和计数器（数值属性），mark() 记录首 token 等事件相对 Span 开始的时间
+- start_metrics_server 在本地端口提供 /metrics（Prometheus 文本格式）和 /metrics.json（含 p50 / p99 估算）
+- 配置 export_path 时，结束的 Span 按 OTLP/JSON 格式分批追加到文件，可直接导入兼容 OpenTelemetry 的后端
+进程内只有一个 Tracer（get_tracer），关闭 enabled 后所有 Span 为空操作。
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logger_config
+
+# 默认的耗时分桶（秒），覆盖从本地处理到带退避重试的外部调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 按 Span 名称累计的数值属性
+COUNTED_ATTRIBUTES = ("bytes", "retries", "chunks", "chars", "prompt_tokens", "completion_tokens")
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+# 当前请求ID和当前 Span，随线程 / 协程的上下文传递
+_request_id = contextvars.ContextVar("littleskin_request_id", default="")
+_current_span = contextvars.ContextVar("littleskin_current_span", default=None)
+
+
+def bind_request(request_id):
+    """把之后创建的 Span 关联到该请求（任务ID）"""
+    _request_id.set(request_id or "")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels_text(labels):
+    return ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+
+
+def _bound(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    """固定分桶的直方图，quantile() 在桶内线性插值估算分位数"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+
+class MetricsRegistry:
+    """直方图、计数器，以及从其他模块的 stats() 读取的指标"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    def observe(self, metric, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((metric, labels))
+            if histogram is None:
+                histogram = self._histograms[(metric, labels)] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def incr(self, metric, labels, amount=1):
+        with self._lock:
+            self._counters[(metric, labels)] = self._counters.get((metric, labels), 0) + amount
+
+    def add_collector(self, prefix, label_name, collect):
+        """collect() 返回 {标签值: {指标名: 数值}}，例如 Resilience.stats()；非数值字段忽略"""
+        self._collectors.append((prefix, label_name, collect))
+
+    def _collected(self):
+        samples = []
+        for prefix, label_name, collect in self._collectors:
+            try:
+                groups = collect()
+            except Exception:
+                continue
+            for label_value, stats in groups.items():
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        samples.append((f"{prefix}_{key}", ((label_name, label_value),), value))
+        return samples
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            seen = set()
+            for (metric, labels), histogram in histograms:
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{_labels_text(labels + (("le", _bound(bound)),))}}} {cumulative}')
+                lines.append(f"{metric}_sum{{{_labels_text(labels)}}} {histogram.sum}")
+                lines.append(f"{metric}_count{{{_labels_text(labels)}}} {histogram.count}")
+            for (metric, labels), value in counters:
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{{{_labels_text(labels)}}} {value}")
+        for metric, labels, value in self._collected():
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{{{_labels_text(labels)}}} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """按指标和标签汇总的 count / avg / p50 / p99（秒），便于不接 Prometheus 时直接查看"""
+        with self._lock:
+            return {
+                f"{metric}{{{_labels_text(labels)}}}": {
+                    "count": histogram.count,
+                    "avg_seconds": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                    "p50_seconds": round(histogram.quantile(0.5), 4),
+                    "p99_seconds": round(histogram.quantile(0.99), 4),
+                }
+                for (metric, labels), histogram in sorted(self._histograms.items())
+            }
+
+
+class Span:
+    """一次阶段调用；可作为上下文管理器使用，退出时自动结束并记录异常"""
+
+    __slots__ = ("tracer", "name", "request_id", "trace_id", "span_id", "parent_id", "attributes",
+                 "events", "start_ns", "end_ns", "status", "error", "_token")
+
+    def __init__(self, tracer, name, attributes):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.request_id = _request_id.get()
+        # 同一请求的 Span 共用由请求ID派生的 trace_id
+        self.trace_id = hashlib.md5(self.request_id.encode("utf-8")).hexdigest() if self.request_id \
+            else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None and parent.trace_id == self.trace_id else ""
+        self.attributes = dict(attributes)
+        self.events = []
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.error = ""
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def incr(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def mark(self, event):
+        """记录一个事件（例如首 token），同名事件只记录第一次"""
+        if all(name != event for name, _ in self.events):
+            self.events.append((event, time.time_ns()))
+
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def fail(self, error):
+        """标记为失败（错误已在内部处理、不再向外抛出时使用）"""
+        self.status = STATUS_ERROR
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self, error=None):
+        """结束 Span；重复调用只有第一次生效"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.fail(error)
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+    @contextmanager
+    def activate(self):
+        """设为当前 Span 但退出时不结束（Span 的生命周期比代码块长时使用，例如流式响应）"""
+        token = _current_span.set(self)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+
+    def to_otlp(self):
+        """OTLP/JSON 中的 Span 结构"""
+        attributes = [("request.id", self.request_id)] + list(self.attributes.items())
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 3,  # SPAN_KIND_CLIENT：都是对外部服务的调用
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes if value is not None],
+            "events": [{"name": name, "timeUnixNano": str(at)} for name, at in self.events],
+            "status": {"code": 2, "message": self.error} if self.status == STATUS_ERROR else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class _NullSpan:
+    """追踪关闭或当前没有 Span 时使用，所有操作为空"""
+
+    name = ""
+
+    def set(self, key, value):
+        pass
+
+    def incr(self, key, amount=1):
+        pass
+
+    def mark(self, event):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    @contextmanager
+    def activate(self):
+        yield self
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current_span():
+    """当前上下文中的 Span（例如供重试逻辑累加 retries），没有时返回空 Span"""
+    return _current_span.get() or NULL_SPAN
+
+
+class Tracer:
+    """创建 Span，结束时汇总为指标并按需导出"""
+
+    def __init__(self, enabled=True, service_name="littleskin", buckets=DEFAULT_BUCKETS,
+                 export_path="", export_batch_size=32):
+        self.enabled = enabled
+        self.service_name = service_name
+        self.metrics = MetricsRegistry(buckets)
+        self.export_path = export_path
+        self.export_batch_size = max(1, export_batch_size)
+        self._pending = []
+        self._export_lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span):
+        labels = (("span", span.name), ("status", span.status))
+        self.metrics.observe("littleskin_span_duration_seconds", labels, span.duration())
+        for event, at in span.events:
+            self.metrics.observe("littleskin_span_event_seconds", (("span", span.name), ("event", event)),
+                                 (at - span.start_ns) / 1e9)
+        for key in COUNTED_ATTRIBUTES:
+            value = span.attributes.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.metrics.incr(f"littleskin_span_{key}_total", (("span", span.name),), value)
+        if self.export_path:
+            with self._export_lock:
+                self._pending.append(span)
+                if len(self._pending) < self.export_batch_size:
+                    return
+                batch, self._pending = self._pending, []
+            self._export(batch)
+
+    def _export(self, batch):
+        """一批 Span 写为一行 OTLP/JSON（ExportTraceServiceRequest）"""
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "littleskin.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }
+        line = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        try:
+            directory = os.path.dirname(self.export_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._export_lock, open(self.export_path, 'a', encoding='utf-8') as export_file:
+                export_file.write(line + "\n")
+        except OSError:
+            # 导出失败不影响请求处理，指标仍然保留在内存中
+            pass
+
+    def flush(self):
+        """把未满一批的 Span 写出（进程退出前调用）"""
+        with self._export_lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._export(batch)
+
+
+class TracedStream:
+    """包装流式响应：第一个分片时记录 first_token 事件，迭代结束、出错或 close() 时结束 Span"""
+
+    def __init__(self, response, span, on_chunk=None):
+        self._response = response
+        self._span = span
+        self._on_chunk = on_chunk
+
+    def _feed(self, chunk):
+        self._span.mark("first_token")
+        self._span.incr("chunks")
+        if self._on_chunk is not None:
+            self._on_chunk(self._span, chunk)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._response)
+        except StopIteration:
+            self._span.end()
+            raise
+        except Exception as error:
+            self._span.end(error)
+            raise
+        self._feed(chunk)
+        return chunk
+
+    def close(self):
+        self._span.set("closed", True)
+        self._span.end()
+        self._response.close()
+
+
+class AsyncTracedStream(TracedStream):
+    """TracedStream 的异步版本"""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._response.__anext__()
+        except StopAsyncIteration:
+            self._span.end()
+            raise
+        except Exception as error:
+            self._span.end(error)
+            raise
+        self._feed(chunk)
+        return chunk
+
+    async def close(self):
+        self._span.set("closed", True)
+        self._span.end()
+        await self._response.close()
+
+
+def create_tracer(options):
+    """根据配置字典创建 Tracer"""
+    options = options or {}
+    return Tracer(
+        enabled=bool(options.get('enabled', True)),
+        service_name=str(options.get('service_name') or 'littleskin'),
+        buckets=tuple(float(bound) for bound in options.get('buckets') or DEFAULT_BUCKETS),
+        export_path=str(options.get('export_path') or ''),
+        export_batch_size=int(options.get('export_batch_size') or 32),
+    )
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """返回进程级的 Tracer（首次调用时按配置创建）"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = create_tracer(logger_config.Config().get_tracing())
+    return _tracer
+
+
+def start_metrics_server(host, port, tracer=None):
+    """在后台线程中启动指标端点：/metrics 为 Prometheus 文本格式，/metrics.json 为分位数摘要"""
+    tracer = tracer or get_tracer()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, content_type = tracer.metrics.render(), "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body, content_type = json.dumps(tracer.metrics.snapshot(), ensure_ascii=False), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # 抓取请求很频繁，不写入访问日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server